@@ -1,7 +1,7 @@
 # agents/base_agent.py
 from abc import ABC, abstractmethod
-from qwen_agent.agents import Assistant
 from config import Config
+from .tool_cache import CachingAssistant
 
 class BaseAgent(ABC):
     def __init__(self, model_name=None, system_message=None, name=None, description=None, tools=None):
@@ -19,7 +19,8 @@ class BaseAgent(ABC):
         }
     
         self.system_message = system_message
-        self.agent = Assistant(
+        # Read-only tool calls (MCP SELECTs, file reads) are answered from a per-conversation cache
+        self.agent = CachingAssistant(
             llm=llm_cfg, 
             function_list=tools,
             system_message=system_message, 
@@ -1,5 +1,7 @@
 from .base_agent import BaseAgent
 from qwen_agent.utils.output_beautify import typewriter_print
+from config import Config
+from ..services.answer_cache import answer_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,11 +24,29 @@ class ChatAgent(BaseAgent):
 
     def handle(self, messages):
         logger.info(f"Processing chat request with messages: {messages}")
+        query = self._standalone_query(messages)
+        if query:
+            cached_answer = answer_cache.lookup(query)
+            if cached_answer:
+                return cached_answer
+
         try:
             response_plain_text = ''
             for response in self.agent.run(messages=messages):
                 response_plain_text = typewriter_print(response, response_plain_text)
+
+            if query:
+                answer_cache.store(query, response_plain_text)
             return response_plain_text
         except Exception as e:
             logger.error(f"Error processing chat request: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
+
+    def _standalone_query(self, messages):
+        # Only an opening text question can be answered without the conversation context
+        if not Config.ANSWER_CACHE_ENABLED or len(messages) != 1:
+            return None
+        message = messages[0]
+        if message.get('role') != 'user' or not isinstance(message.get('content'), str):
+            return None
+        return message['content']
@@ -1,4 +1,5 @@
 from .base_agent import BaseAgent
+from .document_search import resolve_attachments
 from qwen_agent.utils.output_beautify import typewriter_print
 import logging
 
@@ -16,6 +17,10 @@ Your capabilities include:
 2. Validating document authenticity and completeness
 3. Linking extracted data to relevant business sections
 4. Flagging missing or incorrect documentation
+
+Use the document_search tool to read documents: pass the document reference shown in the conversation,
+or leave it empty to search all uploaded documents. Search again with different words if the passages
+returned don't answer the question, and say which page an answer comes from.
 /no_think
 """
 
@@ -25,13 +30,16 @@ class DocumentAgent(BaseAgent):
             model_name=model_name,  #qwen-plus-latest
             system_message=DOCUMENT_PROMPT.strip(),
             name="Document Agent",
-            description="Analyze uploaded documents"
+            description="Analyze uploaded documents",
+            tools=['document_search']
         )
 
     def handle(self, messages):
         logger.info(f"Document agent processing request with messages: {messages}")
         # messages.append({"role": "user", "content": [{'text':'what is page 9 about in the document?'},{'file': 'https://www.smecorp.gov.my/images/pdf/SMEFINANCING.pdf'}]})
         try:
+            # Attachments are indexed once and read through document_search
+            messages = resolve_attachments(messages)
             response_plain_text = ''
             for response in self.agent.run(messages=messages):
                 response_plain_text = typewriter_print(response, response_plain_text)
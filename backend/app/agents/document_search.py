@@ -0,0 +1,197 @@
+import os
+import re
+import base64
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from qwen_agent.tools.base import BaseTool, register_tool
+from config import Config
+from ..core.database import SessionLocal
+from ..models.document import Document
+from ..services.ocr_service import OCRService
+from ..services.retrieval_index import retrieval_index, index_key, INDEX_KEY
+from ..services.text_vectorizer import HashingVectorizer
+from ..services import search_service
+
+logger = logging.getLogger(__name__)
+
+DATA_URL = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+)?(?:;[^,]*)?;base64,", re.IGNORECASE)
+
+
+def _load_document(db, document_id):
+    """
+    A processed document and its parsed text, with its index built if missing or stale
+    """
+    document = db.query(Document).filter(Document.id == document_id).first()
+    if not document:
+        return None
+    parsed = document.parsed_content
+    if not parsed or not parsed.markdown_text:
+        return None
+    retrieval_index.ensure(index_key(document), parsed.markdown_text, source=f"document {document.id}")
+    return document
+
+
+def search_chunks(db, query, document=None, top_k=None):
+    """
+    Top chunks for a question, from one document or from the best matching ones
+
+    Args:
+        db: Database session
+        query: The question
+        document: Document id, or the index reference of a chat attachment;
+            None shortlists documents with full-text search first
+        top_k: Number of chunks to return
+
+    Returns:
+        List of chunk dicts with "label" naming where each one came from
+    """
+    top_k = top_k or Config.RETRIEVAL_TOP_K
+    sources = []
+    if document is not None and str(document).strip().isdigit():
+        found = _load_document(db, int(str(document).strip()))
+        if found:
+            sources.append((index_key(found), f"Document {found.id} '{found.filename}'"))
+    elif document:
+        if INDEX_KEY.match(str(document)) and retrieval_index.meta(str(document)):
+            sources.append((str(document), "Attached file"))
+    else:
+        # Any term may match; bm25 ranks documents sharing more of them first
+        terms = [t for t in HashingVectorizer.tokenize(query) if len(t) > 2]
+        if terms:
+            try:
+                _, matches = search_service.search_documents(
+                    db, " OR ".join(terms), status="complete", limit=Config.RETRIEVAL_SEARCH_DOCUMENTS
+                )
+            except search_service.InvalidSearchQuery:
+                matches = []
+            for match in matches:
+                found = _load_document(db, match["id"])
+                if found:
+                    sources.append((index_key(found), f"Document {found.id} '{found.filename}'"))
+
+    results = []
+    for key, label in dict(sources).items():
+        for chunk in retrieval_index.search(key, query, top_k):
+            results.append({**chunk, "label": label})
+    results.sort(key=lambda chunk: -chunk["score"])
+    return results[:top_k]
+
+
+def format_chunks(chunks):
+    if not chunks:
+        return "No matching passages found."
+    parts = []
+    for chunk in chunks:
+        where = f", page {chunk['page']}" if chunk["page"] is not None else ""
+        parts.append(f"[{chunk['label']}{where}, relevance {chunk['score']}]\n{chunk['text']}")
+    return "\n\n---\n\n".join(parts)
+
+
+@register_tool('document_search')
+class DocumentSearch(BaseTool):
+    description = (
+        'Search the text of uploaded business documents and return the passages most relevant to a question. '
+        'Pass the document reference given in the conversation to search one document; leave it empty to '
+        'search all processed documents.'
+    )
+    parameters = [
+        {
+            'name': 'query',
+            'type': 'string',
+            'description': 'What to look for, phrased as a question or keywords, in the language of the document',
+            'required': True
+        },
+        {
+            'name': 'document',
+            'type': 'string',
+            'description': 'Document reference from the conversation (optional)',
+            'required': False
+        },
+        {
+            'name': 'top_k',
+            'type': 'integer',
+            'description': f'Number of passages to return (default {Config.RETRIEVAL_TOP_K})',
+            'required': False
+        }
+    ]
+
+    def call(self, params, **kwargs):
+        params = self._verify_json_format_args(params)
+        top_k = min(int(params.get('top_k') or Config.RETRIEVAL_TOP_K), 20)
+        db = SessionLocal()
+        try:
+            return format_chunks(search_chunks(db, params['query'], params.get('document'), top_k))
+        finally:
+            db.close()
+
+
+def _index_attachment(data, mime):
+    """
+    Index a chat attachment by its content hash, extracting its text only the first time
+
+    Returns:
+        Tuple of (reference for document_search, label), or None if the file can't be read
+    """
+    content_hash = hashlib.sha256(data).hexdigest()
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(
+            Document.content_hash == content_hash,
+            Document.status == "complete"
+        ).order_by(Document.id).first()
+        if document and _load_document(db, document.id):
+            return str(document.id), f"uploaded document {document.id} '{document.filename}'"
+    finally:
+        db.close()
+
+    if retrieval_index.meta(content_hash):
+        return content_hash, "attached file"
+
+    extension = mimetypes.guess_extension(mime or "") or ""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"attachment{extension}")
+        with open(path, "wb") as f:
+            f.write(data)
+        markdown_content = OCRService.extract_document(path)["markdown"]
+    if not markdown_content.strip() or markdown_content.startswith("Unsupported file format"):
+        return None
+    retrieval_index.build(content_hash, markdown_content, source="chat attachment")
+    return content_hash, "attached file"
+
+
+def resolve_attachments(messages):
+    """
+    Replace attached files in chat messages with document_search references
+
+    The chat client resends every attachment as a data URL on every turn;
+    without this, qwen_agent would parse and chunk the whole file again for
+    each question. Files that cannot be indexed are left for qwen_agent.
+
+    Returns:
+        New list of messages
+    """
+    resolved = []
+    for message in messages:
+        content = message.get('content')
+        if not isinstance(content, list):
+            resolved.append(message)
+            continue
+        items = []
+        for item in content:
+            value = item.get('file') if isinstance(item, dict) else None
+            match = DATA_URL.match(value) if isinstance(value, str) else None
+            reference = None
+            if match:
+                try:
+                    reference = _index_attachment(base64.b64decode(value[match.end():]), match.group('mime'))
+                except Exception as e:
+                    logger.warning(f"Could not index chat attachment, passing the file through: {str(e)}")
+            if reference:
+                ref, label = reference
+                items.append({'text': f"[Attached: {label}. Use document_search with document=\"{ref}\" to read it.]"})
+            else:
+                items.append(item)
+        resolved.append({**message, 'content': items})
+    return resolved
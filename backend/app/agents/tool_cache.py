@@ -0,0 +1,231 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from qwen_agent.agents import Assistant
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Tools that never change state. qwen_agent names MCP tools "<server>-<tool>".
+READ_ONLY_TOOLS = {
+    'sqlite-read_query',
+    'sqlite-list_tables',
+    'sqlite-describe_table',
+    'filesystem-read_file',
+    'filesystem-read_text_file',
+    'filesystem-read_multiple_files',
+    'filesystem-list_directory',
+    'filesystem-directory_tree',
+    'filesystem-search_files',
+    'filesystem-get_file_info',
+    'filesystem-list_allowed_directories',
+    'document_search',
+}
+
+# Any other tool on these servers may write, so calling it drops cached results
+INVALIDATING_TOOL_PREFIXES = ('sqlite-', 'filesystem-')
+
+# Data the MCP servers read from (paths are relative to the backend directory, like in MCPAgent)
+WATCHED_PATHS = ['financial_docs.db', os.path.join('app', 'data')]
+
+# Conversation the tools are being called for, set by the chat API around agent.handle()
+_conversation = ContextVar('tool_cache_conversation', default=None)
+
+
+def canonicalize_tool_args(tool_name, tool_args):
+    """
+    Build a stable cache key fragment from tool arguments
+
+    Args:
+        tool_name: Name of the tool being called
+        tool_args: JSON string or dict of arguments
+
+    Returns:
+        Canonical string representation of the arguments
+    """
+    if isinstance(tool_args, str):
+        try:
+            tool_args = json.loads(tool_args) if tool_args.strip() else {}
+        except json.JSONDecodeError:
+            return tool_args.strip()
+
+    if tool_name == 'sqlite-read_query' and isinstance(tool_args, dict) and isinstance(tool_args.get('query'), str):
+        # Whitespace and a trailing semicolon do not change the result of a SELECT
+        query = re.sub(r'\s+', ' ', tool_args['query']).strip().rstrip(';').strip()
+        tool_args = {**tool_args, 'query': query}
+
+    return json.dumps(tool_args, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+@contextmanager
+def conversation_scope(conversation_id):
+    """
+    Cache tool results under a conversation id while agents run in this block
+
+    The chat API is stateless (the client resends the history every turn), so
+    the client sends a conversation id with each request; tool calls made
+    outside any scope are not cached.
+    """
+    token = _conversation.set(conversation_id)
+    try:
+        yield
+    finally:
+        _conversation.reset(token)
+
+
+def iterate_in_conversation(conversation_id, chunks):
+    """
+    Iterate an agent's streamed response inside conversation_scope
+
+    The scope is entered around each step only, so the generator can be
+    consumed from any task or thread.
+    """
+    iterator = iter(chunks)
+    while True:
+        with conversation_scope(conversation_id):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+def conversation_key():
+    """
+    Id of the conversation tools are currently being called for, or None
+    """
+    return _conversation.get()
+
+
+class ToolResultCache:
+    """
+    Cache of read-only tool results, scoped per conversation and per data version
+    """
+
+    def __init__(self, watched_paths=None, ttl_seconds=None, max_conversations=None, max_entries=None):
+        self.watched_paths = watched_paths if watched_paths is not None else WATCHED_PATHS
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.TOOL_CACHE_TTL_SECONDS
+        self.max_conversations = max_conversations or Config.TOOL_CACHE_MAX_CONVERSATIONS
+        self.max_entries = max_entries or Config.TOOL_CACHE_MAX_ENTRIES_PER_CONVERSATION
+        self._conversations = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def data_version(self):
+        """
+        Fingerprint of the data the read-only tools look at
+
+        Any commit to the SQLite file (from the app or from an MCP server process)
+        changes its mtime/size, and so does any file written anywhere under a
+        watched directory, which makes every older entry unreachable.
+        """
+        parts = [str(self._generation)]
+        for path in self.watched_paths:
+            try:
+                if os.path.isdir(path):
+                    for root, dirs, files in os.walk(path):
+                        dirs.sort()
+                        for name in sorted(files):
+                            file_path = os.path.join(root, name)
+                            stat = os.stat(file_path)
+                            parts.append(f"{file_path}:{stat.st_mtime_ns}:{stat.st_size}")
+                else:
+                    stat = os.stat(path)
+                    parts.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+            except OSError:
+                parts.append(f"{path}:missing")
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, conversation, tool_name, args_key):
+        """
+        Return a cached result or None
+        """
+        version = self.data_version()
+        now = time.monotonic()
+        with self._lock:
+            entries = self._conversations.get(conversation)
+            if entries is None:
+                self.misses += 1
+                return None
+            self._conversations.move_to_end(conversation)
+
+            entry = entries.get((tool_name, args_key))
+            if entry is None or entry[0] != version or now - entry[1] > self.ttl_seconds:
+                entries.pop((tool_name, args_key), None)
+                self.misses += 1
+                return None
+
+            entries.move_to_end((tool_name, args_key))
+            self.hits += 1
+            return entry[2]
+
+    def put(self, conversation, tool_name, args_key, result):
+        """
+        Store a tool result for the current data version
+        """
+        version = self.data_version()
+        with self._lock:
+            entries = self._conversations.setdefault(conversation, OrderedDict())
+            self._conversations.move_to_end(conversation)
+            entries[(tool_name, args_key)] = (version, time.monotonic(), result)
+            entries.move_to_end((tool_name, args_key))
+
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+    def invalidate(self, conversation=None):
+        """
+        Drop cached results for one conversation, or for all of them
+        """
+        with self._lock:
+            if conversation is None:
+                self._conversations.clear()
+                self._generation += 1
+            else:
+                self._conversations.pop(conversation, None)
+
+
+tool_result_cache = ToolResultCache()
+
+
+class CachingAssistant(Assistant):
+    """
+    qwen_agent Assistant that answers repeated read-only tool calls from the cache
+    """
+
+    def _call_tool(self, tool_name, tool_args='{}', **kwargs):
+        if tool_name not in READ_ONLY_TOOLS:
+            result = super()._call_tool(tool_name, tool_args, **kwargs)
+            if tool_name.startswith(INVALIDATING_TOOL_PREFIXES):
+                logger.info(f"Tool {tool_name} may have written data, clearing tool cache")
+                tool_result_cache.invalidate()
+            return result
+
+        conversation = conversation_key()
+        if conversation is None:
+            return super()._call_tool(tool_name, tool_args, **kwargs)
+        args_key = canonicalize_tool_args(tool_name, tool_args)
+
+        cached = tool_result_cache.get(conversation, tool_name, args_key)
+        if cached is not None:
+            logger.info(f"Tool cache hit for {tool_name} {args_key}")
+            return cached
+
+        result = super()._call_tool(tool_name, tool_args, **kwargs)
+
+        # qwen_agent reports tool failures as a result string; don't pin those
+        if not (isinstance(result, str) and result.startswith('An error occurred when calling tool')):
+            tool_result_cache.put(conversation, tool_name, args_key, result)
+        return result
@@ -4,6 +4,7 @@ from typing import List, Dict, Any, Optional
 import logging
 from ...core.database import get_db
 from ...models.document import Document, ParsedContent, DocumentTag, FinancialMetric
+from ...services.financial_extraction import set_metric_documents
 from sqlalchemy import desc, func, text
 import os
 
@@ -212,9 +213,6 @@ async def force_analyze(
                 "message": f"No documents found for period {month}/{year}"
             }
         
-        # Format document IDs as comma-separated string
-        doc_ids_str = ",".join(str(doc_id) for doc_id in document_ids)
-        
         # Get an existing metrics record or create a new one
         metric = db.query(FinancialMetric).filter(
             FinancialMetric.year == year,
@@ -222,15 +220,10 @@ async def force_analyze(
         ).first()
         
         if not metric:
-            metric = FinancialMetric(
-                year=year,
-                month=month,
-                document_ids=doc_ids_str
-            )
+            metric = FinancialMetric(year=year, month=month)
             db.add(metric)
-        else:
-            metric.document_ids = doc_ids_str
         
+        set_metric_documents(db, metric, document_ids)
         db.commit()
         
         return {
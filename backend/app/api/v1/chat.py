@@ -11,10 +11,12 @@ from ...agents.loan_agent import LoanAgent
 from ...agents.document_agent import DocumentAgent
 from ...agents.insight_agent import InsightAgent
 from ...agents.mcp_agent import MCPAgent
+from ...agents.tool_cache import conversation_scope, iterate_in_conversation
 import logging
 import json
 import asyncio
 import os
+import uuid
 import base64
 
 # Configure logging
@@ -59,10 +61,10 @@ def _clean_response(text):
         return match.group(1).strip()
     return cleaned.strip()
     
-async def stream_response(messages, agent):
+async def stream_response(messages, agent, conversation_id=None):
     try:
         prev_chunk = ""
-        for chunk in agent.handle(messages=messages):
+        for chunk in iterate_in_conversation(conversation_id, agent.handle(messages=messages)):
             if chunk.strip() == "" and prev_chunk.strip() == "":
                 chunk = "\n  "  
             elif chunk.strip() == "":
@@ -74,10 +76,10 @@ async def stream_response(messages, agent):
         logger.error(f"Error in streaming response: {str(e)}", exc_info=True)
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
-async def stream_tool_response(messages, agent):
+async def stream_tool_response(messages, agent, conversation_id=None):
     try:
         buffer = ""
-        for chunk in agent.handle(messages=messages):
+        for chunk in iterate_in_conversation(conversation_id, agent.handle(messages=messages)):
             if chunk.strip() == "":
                 chunk = " "
             buffer += chunk
@@ -91,10 +93,11 @@ async def stream_tool_response(messages, agent):
         logger.error(f"Error in streaming response: {str(e)}", exc_info=True)
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
-async def stream_image_response(messages, agent):
+async def stream_image_response(messages, agent, conversation_id=None):
     try:
         # Get the response from agent
-        agent.handle(messages=messages)
+        with conversation_scope(conversation_id):
+            agent.handle(messages=messages)
         
         # Use the fixed path for the chart image
         image_path = os.path.join(PROJECT_ROOT, "backend", "workspace", "tools", "code_interpreter", "chart.png")
@@ -118,11 +121,11 @@ async def stream_image_response(messages, agent):
         logger.error(f"Error in streaming image response: {str(e)}", exc_info=True)
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
-async def stream_json_response(messages, agent):
+async def stream_json_response(messages, agent, conversation_id=None):
     try:
         buffer = ""
         loan_data = {}
-        for chunk in agent.handle(messages=messages):
+        for chunk in iterate_in_conversation(conversation_id, agent.handle(messages=messages)):
             cleaned_chunk = _clean_ollama_response(chunk)
             if cleaned_chunk.strip() == "":
                 cleaned_chunk = " "
@@ -188,12 +191,14 @@ async def chat_stream(request: ChatRequest):
         else:
             agent = chat_agent
 
+        # Requests without an id get their own, so their tool results are never shared
+        conversation_id = request.conversation_id or uuid.uuid4().hex
         if agent_name == 'LoanAgent':
-            response_stream = stream_json_response(messages, agent)
+            response_stream = stream_json_response(messages, agent, conversation_id)
         elif agent_name == 'InsightAgent':
-            response_stream = stream_image_response(messages, agent)
+            response_stream = stream_image_response(messages, agent, conversation_id)
         else:
-            response_stream = stream_response(messages, agent)
+            response_stream = stream_response(messages, agent, conversation_id)
 
         switch_tab = None
         if agent_name == 'FinancialAgent'or agent_name == 'BudgetAgent':
@@ -249,12 +254,14 @@ async def chat(request: ChatRequest):
         agent_name = _clean_ollama_response(agent_name)
         logger.info(f"Routing to agent: {agent_name}")
         
-        if agent_name in AGENT_MAP:
-            agent_class = AGENT_MAP[agent_name]
-            agent = agent_class()
-            response_text = _clean_ollama_response(agent.handle(messages))
-        else:
-            response_text = _clean_ollama_response(chat_agent.handle(messages))
+        conversation_id = request.conversation_id or uuid.uuid4().hex
+        with conversation_scope(conversation_id):
+            if agent_name in AGENT_MAP:
+                agent_class = AGENT_MAP[agent_name]
+                agent = agent_class()
+                response_text = _clean_ollama_response(agent.handle(messages))
+            else:
+                response_text = _clean_ollama_response(chat_agent.handle(messages))
             
         try:
             llm_response = json.loads(response_text)
@@ -6,7 +6,9 @@ import json
 import os
 from ...core.database import get_db
 from ...models.company import Company
+from starlette.concurrency import run_in_threadpool
 from ...services.storage_service import StorageService
+from ...services.file_validation import FileTooLargeError, UnsupportedFileError
 from ...services.company_ai_service import CompanyAIService
 
 router = APIRouter()
@@ -221,26 +223,27 @@ async def upload_company_document(
     and return the extracted information
     """
     try:
-        # Save the uploaded file
-        file_path, unique_filename = storage_service.save_file(
-            file.file, 
-            file.filename, 
-            custom_path="company_docs"
-        )
+        # Stream the uploaded file to storage (validated on the way)
+        file_path, unique_filename = await storage_service.save_upload(file, custom_path="company_docs")
         
-        # Process the document with OCR
-        document_text = company_ai_service.process_company_document(file_path)
-        
-        # Extract company information using AI
-        company_info = company_ai_service.extract_company_information(document_text)
-        
-        # Delete the temporary file after processing
-        storage_service.delete_file(file_path)
+        try:
+            # OCR and the LLM call block, so keep them off the event loop
+            document_text = await run_in_threadpool(company_ai_service.process_company_document, file_path)
+            
+            # Extract company information using AI
+            company_info = await run_in_threadpool(company_ai_service.extract_company_information, document_text)
+        finally:
+            # Delete the temporary file after processing
+            storage_service.delete_file(file_path)
         
         return {
             "message": "Document processed successfully",
             "data": company_info
         }
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedFileError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing company document: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error processing company document: {str(e)}")
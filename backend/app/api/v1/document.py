@@ -1,15 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, status
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, status
+from fastapi.responses import JSONResponse, FileResponse, Response
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 import logging
 import os
+import uuid
+import base64
+from config import Config
 from ...core.database import get_db
-from ...models.document import Document, ParsedContent, DocumentTag, FinancialMetric
+from ...models.document import Document, ParsedContent, DocumentTag
 from ...services.ocr_service import OCRService
 from ...services.storage_service import StorageService
+from ...services.file_validation import FileTooLargeError, UnsupportedFileError
 from ...services.ai_service import AIService
+from ...services.job_queue import job_queue, QueueFullError
+from ...services.document_pipeline import document_pipeline
+from ...services.near_duplicate import near_duplicate_index
+from ...services.retrieval_index import retrieval_index, index_key
+from ...services.preview_service import preview_service
+from ...services.financial_extraction import financial_extractor, metric_document_ids
+from ...services import search_service
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 import json
 
 router = APIRouter()
@@ -27,6 +41,8 @@ class DocumentResponse:
         self.upload_date = db_document.upload_date
         self.status = db_document.status
         self.ai_confidence = db_document.ai_confidence
+        self.duplicate_of = db_document.duplicate_of
+        self.detection_source = db_document.detection_source
         self.tags = [{"tag": tag.tag, "value": tag.value, "year": tag.year, "month": tag.month} 
                      for tag in db_document.tags]
     
@@ -37,93 +53,13 @@ class DocumentResponse:
             "upload_date": self.upload_date.isoformat() if self.upload_date else None,
             "status": self.status,
             "ai_confidence": self.ai_confidence,
+            "duplicate_of": self.duplicate_of,
+            "detection_source": self.detection_source,
             "tags": self.tags
         }
 
-# Background task to process document
-async def process_document_background(document_id: int, file_path: str, db: Session):
-    try:
-        # 1. Get document from DB
-        document = db.query(Document).filter(Document.id == document_id).first()
-        if not document:
-            logger.error(f"Document {document_id} not found")
-            return
-        
-        # 2. Update status to analyzing
-        document.status = "analyzing"
-        db.commit()
-        
-        # 3. Perform OCR
-        markdown_text = OCRService.process_document(file_path)
-        
-        # 4. Save parsed content
-        parsed_content = ParsedContent(
-            document_id=document_id,
-            markdown_text=markdown_text,
-            parse_status="success"
-        )
-        db.add(parsed_content)
-        db.commit()
-        
-        # 5. Detect time period with AI
-        ai_result = ai_service.detect_document_period(markdown_text, document.filename)
-        
-        # 6. Update document with AI analysis
-        document.status = "complete"
-        document.ai_confidence = ai_result.get("confidence", 50)
-        db.commit()
-        
-        # 7. Save detected tags
-        # Get detected periods
-        periods = ai_result.get("periods", [])
-        detected_tags = ai_result.get("detected_tags", [])
-        
-        # Add period tags for each detected period
-        for period in periods:
-            year = period.get("year")
-            month = period.get("month")
-            confidence = period.get("confidence", 50)
-            
-            if year:
-                db.add(DocumentTag(
-                    document_id=document_id,
-                    tag="period",
-                    value=f"{month}/{year}" if month else f"{year}",
-                    ai_detected=True,
-                    confidence=confidence,
-                    year=year,
-                    month=month
-                ))
-        
-        # Add other detected tags
-        for tag in detected_tags:
-            db.add(DocumentTag(
-                document_id=document_id,
-                tag="type",
-                value=tag,
-                ai_detected=True,
-                confidence=ai_result.get("confidence", 50)
-            ))
-        
-        db.commit()
-        logger.info(f"Document {document_id} processed successfully")
-        
-    except Exception as e:
-        # Update document status to error
-        try:
-            document = db.query(Document).filter(Document.id == document_id).first()
-            if document:
-                document.status = "error"
-                db.commit()
-        except Exception:
-            pass
-        
-        logger.error(f"Error processing document {document_id}: {str(e)}", exc_info=True)
-
-
 @router.post("/documents/upload", status_code=status.HTTP_202_ACCEPTED)
 async def upload_document(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
@@ -131,38 +67,183 @@ async def upload_document(
     Upload a document for processing
     """
     try:
-        # 1. Save file to storage
-        file_path, unique_filename = storage_service.save_file(file.file, file.filename)
-        
-        # 2. Create document record
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        document = Document(
-            filename=file.filename,
-            file_path=file_path,
-            original_format=file_extension.replace(".", ""),
-            status="uploading"
-        )
+        # Shed load before accepting the file if the workers are too far behind
+        job_queue.check_capacity(db)
+
+        # 1. Stream file to storage (validated and hashed on the way), content-addressed
+        #    so identical uploads share one copy
+        stored_file = await storage_service.store_upload(db, file)
         
-        db.add(document)
+        # 2. Create document record and queue its processing job in the same
+        #    transaction, unless the same bytes were already processed
+        document, job = document_pipeline.create_document(db, file.filename, stored_file)
         db.commit()
         db.refresh(document)
         
-        # 3. Queue background processing task
-        background_tasks.add_task(process_document_background, document.id, file_path, db)
-        
-        # 4. Return response
+        # 3. Return response
         return {
             "id": document.id,
             "filename": document.filename,
             "status": document.status,
-            "message": "Document upload initiated. Processing in background."
+            "message": "Document upload initiated. Processing in background." if job
+                       else "Identical document already processed. Results reused."
         }
         
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedFileError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except Exception as e:
         logger.error(f"Error uploading document: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
 
 
+@router.post("/documents/upload/batch", status_code=status.HTTP_202_ACCEPTED)
+async def upload_documents_batch(
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload several documents at once (e.g. a year of monthly statements)
+
+    All documents are created in one transaction and their period detection is
+    batched into a few LLM calls. Files that fail validation are reported in
+    "rejected" without affecting the rest of the batch.
+    """
+    try:
+        if len(files) > Config.BATCH_UPLOAD_MAX_FILES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"A batch can contain at most {Config.BATCH_UPLOAD_MAX_FILES} files"
+            )
+
+        # Shed load before accepting the files if the workers are too far behind
+        job_queue.check_capacity(db, incoming=len(files))
+
+        stored_uploads = []
+        rejected = []
+        for file in files:
+            try:
+                stored_file = await storage_service.store_upload(db, file)
+                stored_uploads.append((file.filename, stored_file))
+            except (FileTooLargeError, UnsupportedFileError) as e:
+                rejected.append({"filename": file.filename, "error": str(e)})
+
+        batch_id = uuid.uuid4().hex
+        created = document_pipeline.create_documents_batch(db, stored_uploads, batch_id) if stored_uploads else []
+        db.commit()
+
+        return {
+            "batch_id": batch_id,
+            "documents": [
+                {"id": document.id, "filename": document.filename, "status": document.status}
+                for document, _ in created
+            ],
+            "rejected": rejected,
+            "message": f"{len(created)} documents queued for processing."
+        }
+
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error uploading document batch: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error uploading document batch: {str(e)}")
+
+
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(document):
+    """
+    Opaque cursor pointing just past a document in the listing order
+    """
+    raw = json.dumps([document.upload_date.isoformat() if document.upload_date else None, document.id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    (upload_date, id) from a cursor made by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    upload_date, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return (datetime.fromisoformat(upload_date) if upload_date else None), int(document_id)
+
+
+@router.get("/documents")
+async def list_documents(
+    status: Optional[str] = None,
+    tag: Optional[str] = None,
+    value: Optional[str] = None,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    db: Session = Depends(get_db)
+):
+    """
+    List documents, newest first, one page at a time
+
+    Pages are fetched by keyset on (upload_date, id): pass the returned
+    next_cursor to get the following page. Filters: status, tag type (with an
+    optional tag value), and year/month of a period tag.
+    """
+    try:
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        if month is not None and (year is None or not 1 <= month <= 12):
+            raise HTTPException(status_code=400, detail="month requires a year and must be between 1 and 12")
+        if value is not None and tag is None:
+            raise HTTPException(status_code=400, detail="value requires a tag")
+
+        query = db.query(Document)
+        if status:
+            query = query.filter(Document.status == status)
+        if tag:
+            tagged = db.query(DocumentTag.document_id).filter(DocumentTag.tag == tag)
+            if value is not None:
+                tagged = tagged.filter(DocumentTag.value == value)
+            query = query.filter(Document.id.in_(tagged))
+        if year is not None:
+            period = db.query(DocumentTag.document_id).filter(DocumentTag.tag == "period", DocumentTag.year == year)
+            if month is not None:
+                period = period.filter(DocumentTag.month == month)
+            query = query.filter(Document.id.in_(period))
+        if cursor:
+            try:
+                upload_date, last_id = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query = query.filter(or_(
+                Document.upload_date < upload_date,
+                and_(Document.upload_date == upload_date, Document.id < last_id)
+            ))
+
+        # One extra row tells whether there is a next page; tags come in the same query
+        documents = query.options(joinedload(Document.tags)).order_by(
+            Document.upload_date.desc(), Document.id.desc()
+        ).limit(limit + 1).all()
+        has_more = len(documents) > limit
+        documents = documents[:limit]
+        return {
+            "items": [DocumentResponse(doc).dict() for doc in documents],
+            "next_cursor": encode_cursor(documents[-1]) if has_more else None,
+            "limit": limit
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing documents: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
+
+
 @router.get("/documents/recent")
 async def get_recent_documents(
     limit: int = 10,
@@ -172,13 +253,61 @@ async def get_recent_documents(
     Get recent documents
     """
     try:
-        documents = db.query(Document).order_by(Document.upload_date.desc()).limit(limit).all()
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        documents = db.query(Document).options(joinedload(Document.tags)).order_by(
+            Document.upload_date.desc(), Document.id.desc()
+        ).limit(limit).all()
         return [DocumentResponse(doc).dict() for doc in documents]
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching recent documents: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error fetching recent documents: {str(e)}")
 
 
+@router.get("/documents/search")
+async def search_documents(
+    q: str,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    status: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+    db: Session = Depends(get_db)
+):
+    """
+    Search the text of parsed documents
+
+    Results are ranked by relevance (BM25) and carry a snippet with the
+    matching terms wrapped in <mark> tags. year/month filter on period tags.
+    """
+    try:
+        if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"page must be >= 1 and page_size between 1 and {MAX_PAGE_SIZE}")
+        if month is not None and (year is None or not 1 <= month <= 12):
+            raise HTTPException(status_code=400, detail="month requires a year and must be between 1 and 12")
+
+        total, results = search_service.search_documents(
+            db, q, year=year, month=month, status=status,
+            limit=page_size, offset=(page - 1) * page_size
+        )
+        return {
+            "query": q,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "results": results
+        }
+    except HTTPException:
+        raise
+    except search_service.InvalidSearchQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error searching documents for '{q}': {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
+
+
 @router.get("/documents/{document_id}")
 async def get_document(
     document_id: int,
@@ -200,6 +329,132 @@ async def get_document(
         raise HTTPException(status_code=500, detail=f"Error fetching document: {str(e)}")
 
 
+def file_response(request, path, filename=None, etag=None, disposition="inline"):
+    """
+    Serve a file from disk with validators and Range support
+
+    FileResponse sends the file in chunks straight from disk (or hands the
+    path to the server where it supports that) and answers Range / If-Range
+    requests with 206, so a PDF viewer can fetch just the pages it shows.
+    Conditional requests still matching the file get 304 without a body.
+
+    Args:
+        request: Incoming request, for its conditional headers
+        path: File to send
+        filename: Name for Content-Disposition (and the media type)
+        etag: Strong ETag to use instead of one derived from size and mtime
+        disposition: "inline" or "attachment"
+    """
+    headers = {"Cache-Control": f"private, max-age={Config.PREVIEW_MAX_AGE}"}
+    if etag:
+        headers["ETag"] = etag
+    response = FileResponse(
+        path,
+        headers=headers,
+        filename=filename,
+        stat_result=os.stat(path),
+        content_disposition_type=disposition
+    )
+
+    validators = {key: response.headers[key] for key in ("etag", "last-modified", "cache-control")}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in tags or validators["etag"] in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validators)
+    elif request.headers.get("if-modified-since"):
+        try:
+            if parsedate_to_datetime(response.headers["last-modified"]) <= parsedate_to_datetime(request.headers["if-modified-since"]):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validators)
+        except (TypeError, ValueError):
+            pass
+    return response
+
+
+@router.get("/documents/{document_id}/download")
+async def download_document(
+    document_id: int,
+    request: Request,
+    download: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Stream a document's original file
+
+    Shown inline by default; download=true asks the browser to save it.
+    """
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+        if not os.path.isfile(document.file_path):
+            raise HTTPException(status_code=404, detail="Document file not found")
+
+        # Stored files are content addressed, so the hash is a stable validator
+        etag = f'"{document.content_hash}"' if document.content_hash else None
+        return file_response(
+            request, document.file_path, filename=document.filename, etag=etag,
+            disposition="attachment" if download else "inline"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error downloading document {document_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error downloading document: {str(e)}")
+
+
+@router.get("/documents/{document_id}/thumbnail")
+async def get_document_thumbnail(
+    document_id: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Small JPEG of a document's first page
+    """
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+
+        # Normally rendered at processing time; rendering here is the fallback
+        path = await run_in_threadpool(preview_service.thumbnail, document)
+        if not path:
+            raise HTTPException(status_code=404, detail="No preview available for this document")
+        return file_response(request, path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting thumbnail for document {document_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error getting thumbnail: {str(e)}")
+
+
+@router.get("/documents/{document_id}/preview/{page}")
+async def get_document_preview(
+    document_id: int,
+    page: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Low-resolution JPEG of one page of a document
+    """
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+
+        path = await run_in_threadpool(preview_service.page, document, page)
+        if not path:
+            raise HTTPException(status_code=404, detail=f"No preview for page {page} of this document")
+        return file_response(request, path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting preview of page {page} for document {document_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error getting preview: {str(e)}")
+
+
 @router.post("/documents/{document_id}/process")
 async def process_document(
     document_id: int,
@@ -222,21 +477,22 @@ async def process_document(
         if not file_path:
             raise HTTPException(status_code=400, detail="Document file path not found")
         
-        # Run OCR to get text from PDF
-        try:
-            text_content = OCRService.process_document(file_path)
-        except Exception as e:
-            logger.error(f"OCR error for document {document_id}: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"OCR processing error: {str(e)}")
-        
-        # Save parsed content to database
-        parsed_content = ParsedContent(
-            document_id=document_id,
-            markdown_text=text_content,
-            extracted_date=datetime.utcnow()
-        )
-        db.add(parsed_content)
-        db.commit()
+        # Reuse the current parse if it came from the same file and OCR settings;
+        # otherwise extract again and store the text as a new parse version
+        inputs = document_pipeline.parse_inputs(document)
+        parsed_content = document.parsed_content
+        if parsed_content and document_pipeline.parsed_from(parsed_content) == inputs and parsed_content.parse_status == "success":
+            logger.info(f"Document {document_id} was already parsed from the same inputs, skipping OCR")
+        else:
+            try:
+                extraction = OCRService.extract_document(file_path)
+            except Exception as e:
+                logger.error(f"OCR error for document {document_id}: {str(e)}", exc_info=True)
+                raise HTTPException(status_code=500, detail=f"OCR processing error: {str(e)}")
+            parsed_content = document_pipeline.store_extraction(db, document, inputs, extraction)
+            db.commit()
+            retrieval_index.index_document(document)
+        text_content = parsed_content.markdown_text
         
         # Detect time period with AI
         ai_result = ai_service.detect_document_period(text_content, document.filename)
@@ -244,6 +500,7 @@ async def process_document(
         # Update document with AI analysis result
         document.status = "complete"
         document.ai_confidence = ai_result.get("confidence", 50)
+        document.detection_source = ai_result.get("source")
         
         # Clear existing period tags
         db.query(DocumentTag).filter(
@@ -328,15 +585,16 @@ async def analyze_document_period(
             raise HTTPException(status_code=404, detail="Document not found")
         
         # Get parsed content
-        parsed_content = db.query(ParsedContent).filter(ParsedContent.document_id == document_id).first()
+        parsed_content = document.parsed_content
         if not parsed_content or not parsed_content.markdown_text:
             raise HTTPException(status_code=400, detail="Document has not been processed yet")
         
-        # Detect period with AI
-        ai_result = ai_service.detect_document_period(parsed_content.markdown_text, document.filename)
+        # Detect period with AI; an explicit re-analysis always asks the LLM
+        ai_result = ai_service.detect_document_period(parsed_content.markdown_text, document.filename, use_rules=False)
         
         # Update document
         document.ai_confidence = ai_result.get("confidence", 50)
+        document.detection_source = ai_result.get("source")
         
         # Clear existing period tags
         db.query(DocumentTag).filter(
@@ -418,35 +676,27 @@ async def add_document_to_records(
         if not period_tags:
             raise HTTPException(status_code=400, detail="Document has no period tags")
         
-        # Update or create financial metrics for each period
+        # Add the document to each period's metrics; only this document's
+        # figures are extracted, the rest of the month comes from stored figures.
+        # A rescan/re-upload of a recorded statement is left out of the sums
+        duplicate_periods = []
         for tag in period_tags:
             if not tag.year or not tag.month:
                 continue
                 
-            # Check if metric exists for this period
-            metric = db.query(FinancialMetric).filter(
-                FinancialMetric.year == tag.year,
-                FinancialMetric.month == tag.month
-            ).first()
-            
-            if metric:
-                # Update existing metric
-                doc_ids = metric.document_ids.split(',') if metric.document_ids else []
-                if str(document_id) not in doc_ids:
-                    doc_ids.append(str(document_id))
-                    metric.document_ids = ','.join(doc_ids)
-            else:
-                # Create new metric
-                metric = FinancialMetric(
-                    year=tag.year,
-                    month=tag.month,
-                    document_ids=str(document_id),
-                    revenue=0,
-                    expenses=0,
-                    profit=0,
-                    cash_flow=0
-                )
-                db.add(metric)
+            doc_ids = metric_document_ids(db, tag.year, tag.month)
+            if document_id not in doc_ids:
+                doc_ids.append(document_id)
+            result = await run_in_threadpool(financial_extractor.recompute_month, db, tag.year, tag.month, doc_ids)
+            # Copies of this statement (or this document itself) left out of the month
+            group = {left_out: kept for left_out, kept in result["duplicates"].items() if document_id in (left_out, kept)}
+            if group:
+                duplicate_periods.append({
+                    "year": tag.year,
+                    "month": tag.month,
+                    "counted_document_id": next(iter(group.values())),
+                    "left_out_document_ids": sorted(group)
+                })
         
         # Update tag to indicate it's been added to records
         # First check if the tag already exists
@@ -469,12 +719,14 @@ async def add_document_to_records(
         return {
             "id": document_id, 
             "status": "added_to_records",
-            "periods": [{"year": tag.year, "month": tag.month} for tag in period_tags if tag.year and tag.month]
+            "periods": [{"year": tag.year, "month": tag.month} for tag in period_tags if tag.year and tag.month],
+            "duplicate_periods": duplicate_periods
         }
         
     except HTTPException:
         raise
     except Exception as e:
+        db.rollback()
         logger.error(f"Error adding document {document_id} to records: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error adding to records: {str(e)}")
 
@@ -525,19 +777,8 @@ async def update_document_tags(
                 month=month
             ))
             
-            # Check if the document is linked to any metrics for old periods
-            metrics = db.query(FinancialMetric).all()
-            
-            for metric in metrics:
-                if not metric.document_ids:
-                    continue
-                    
-                doc_ids = metric.document_ids.split(',')
-                if str(document_id) in doc_ids:
-                    # If this metric is not for the new period, remove the document from it
-                    if metric.year != year or metric.month != month:
-                        doc_ids.remove(str(document_id))
-                        metric.document_ids = ','.join(doc_ids)
+            # Take the document out of the metrics for its old periods
+            financial_extractor.detach_document(db, document_id, keep_periods=[(year, month)])
         
         # Handle multiple period tags if provided
         elif "period_tags" in tags:
@@ -563,6 +804,10 @@ async def update_document_tags(
                         year=year,
                         month=month
                     ))
+            
+            financial_extractor.detach_document(db, document_id, keep_periods=[
+                (period.get("year"), period.get("month")) for period in period_tags
+            ])
         
         # Update custom tags if provided
         if "custom_tags" in tags:
@@ -606,40 +851,43 @@ async def delete_document(
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Get the file path for deletion later
-        file_path = document.file_path
+        # Drop this document's reference to the stored file; the file itself is
+        # only removed once no other document points at the same content
+        file_path = storage_service.release_file(db, document)
+        cache_key = index_key(document)
         
         # Delete associated tags
         db.query(DocumentTag).filter(DocumentTag.document_id == document_id).delete()
         
-        # Delete parsed content
+        # Delete parsed content (every stored version, after dropping the current pointer)
+        document.parsed_content = None
+        db.flush()
         db.query(ParsedContent).filter(ParsedContent.document_id == document_id).delete()
         
-        # Check if document is linked to any metrics
-        metrics = db.query(FinancialMetric).all()
+        # Take the document out of its months' metrics; the totals are summed
+        # again from the other documents' stored figures
+        financial_extractor.detach_document(db, document_id)
         
-        for metric in metrics:
-            if not metric.document_ids:
-                continue
-                
-            doc_ids = metric.document_ids.split(',')
-            if str(document_id) in doc_ids:
-                # Remove this document ID from the list
-                doc_ids.remove(str(document_id))
-                metric.document_ids = ','.join(doc_ids)
+        # Copies of this document now point at the oldest remaining copy instead
+        duplicates = db.query(Document).filter(Document.duplicate_of == document_id).order_by(Document.id).all()
+        if duplicates:
+            duplicates[0].duplicate_of = None
+            for duplicate in duplicates[1:]:
+                duplicate.duplicate_of = duplicates[0].id
         
         # Delete the document itself
         db.delete(document)
         
         # Commit all changes
         db.commit()
+        near_duplicate_index.remove(document_id)
         
         # Delete the physical file
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            logger.warning(f"Could not delete file {file_path}: {str(e)}")
+        if file_path:
+            storage_service.delete_file(file_path)
+            # The chunk index and previews are shared by identical uploads, like the file
+            retrieval_index.remove(cache_key)
+            preview_service.remove(cache_key)
         
         return {"message": f"Document {document_id} and all associated data deleted successfully"}
         
@@ -1,19 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, status
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import select, literal, union_all
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import List, Dict, Any, Optional
 import logging
-from datetime import datetime
 from ...core.database import get_db
-from ...models.document import Document, ParsedContent, DocumentTag, FinancialMetric
-from ...services.ai_service import AIService
+from ...core.data_version import data_version, YearCache
+from ...models.document import Document, DocumentTag, FinancialMetric, FinancialMetricDocument
+from ...services.financial_extraction import financial_extractor
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Initialize services
-ai_service = AIService()
-
 @router.post("/metrics/analyze/{year}/{month}")
 async def analyze_financial_metrics(
     year: int,
@@ -58,146 +57,96 @@ async def analyze_financial_metrics(
                 "cash_flow": 0
             }
         
-        # Get parsed content for all documents
-        document_contents = []
-        for doc_id in document_ids:
-            parsed_content = db.query(ParsedContent).filter(
-                ParsedContent.document_id == doc_id
-            ).first()
-            
-            if parsed_content and parsed_content.markdown_text:
-                document_contents.append((doc_id, parsed_content.markdown_text))
-        
-        # Run AI analysis
-        metrics = ai_service.analyze_financial_metrics(document_contents, year, month)
-        
-        # Save to database
-        existing_metric = db.query(FinancialMetric).filter(
-            FinancialMetric.year == year,
-            FinancialMetric.month == month
-        ).first()
-        
-        if existing_metric:
-            # Update existing metric
-            existing_metric.revenue = metrics.get("revenue", 0)
-            existing_metric.expenses = metrics.get("expenses", 0)
-            existing_metric.profit = metrics.get("profit", 0)
-            existing_metric.cash_flow = metrics.get("cash_flow", 0)
-            existing_metric.document_ids = metrics.get("document_ids", "")
-            existing_metric.last_analysis_date = datetime.utcnow()
-        else:
-            # Create new metric
-            new_metric = FinancialMetric(
-                year=year,
-                month=month,
-                revenue=metrics.get("revenue", 0),
-                expenses=metrics.get("expenses", 0),
-                profit=metrics.get("profit", 0),
-                cash_flow=metrics.get("cash_flow", 0),
-                document_ids=metrics.get("document_ids", ""),
-                last_analysis_date=datetime.utcnow()
-            )
-            db.add(new_metric)
-        
+        # Only documents without stored figures go to the LLM; the month
+        # totals are summed from the per-document figures, leaving out
+        # rescans/re-uploads of a statement that is already included
+        metrics = await run_in_threadpool(
+            financial_extractor.recompute_month, db, year, month, document_ids
+        )
         db.commit()
         
         # Return response
         return {
             "year": year,
             "month": month,
-            "revenue": metrics.get("revenue", 0),
-            "expenses": metrics.get("expenses", 0),
-            "profit": metrics.get("profit", 0),
-            "cash_flow": metrics.get("cash_flow", 0),
-            "analysis_notes": metrics.get("analysis_notes", ""),
-            "document_count": len(document_contents)
+            "revenue": metrics["revenue"],
+            "expenses": metrics["expenses"],
+            "profit": metrics["profit"],
+            "cash_flow": metrics["cash_flow"],
+            "analysis_notes": metrics["notes"],
+            "document_count": metrics["document_count"],
+            "failed_document_ids": metrics["failed"],
+            "duplicate_document_ids": sorted(metrics["duplicates"])
         }
         
     except HTTPException:
         raise
     except Exception as e:
+        db.rollback()
         logger.error(f"Error analyzing metrics for {month}/{year}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error analyzing metrics: {str(e)}")
 
-@router.get("/metrics/table/{year}")
-async def get_yearly_metrics_table(
-    year: int,
-    db: Session = Depends(get_db)
-):
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June",
+               "July", "August", "September", "October", "November", "December"]
+
+# Assembled yearly tables, dropped when the year's documents, tags or metrics change
+yearly_table_cache = YearCache()
+
+
+def build_yearly_metrics_table(db, year):
     """
-    Get metrics for all months in a year and build a month-by-month table
+    Month-by-month metrics and documents for a year, in two queries
+
+    A month lists the documents its metrics were computed from; months
+    without any fall back to the documents tagged with that period.
     """
-    # Define the month names
-    month_names = ["January", "February", "March", "April", "May", "June", 
-                   "July", "August", "September", "October", "November", "December"]
-    
-    # Initialize the result structure
+    metrics = {
+        metric.month: metric
+        for metric in db.query(FinancialMetric).filter(FinancialMetric.year == year).order_by(FinancialMetric.id)
+    }
+
+    # Recorded and period-tagged documents of every month in one pass
+    recorded = select(
+        FinancialMetric.month.label("month"), literal(True).label("recorded"),
+        Document.id.label("id"), Document.filename.label("filename"),
+        Document.status.label("status"), Document.upload_date.label("upload_date")
+    ).join(FinancialMetricDocument, FinancialMetricDocument.metric_id == FinancialMetric.id).join(
+        Document, Document.id == FinancialMetricDocument.document_id
+    ).where(FinancialMetric.year == year)
+    tagged = select(
+        DocumentTag.month.label("month"), literal(False).label("recorded"),
+        Document.id.label("id"), Document.filename.label("filename"),
+        Document.status.label("status"), Document.upload_date.label("upload_date")
+    ).join(Document, Document.id == DocumentTag.document_id).where(
+        DocumentTag.tag == "period",
+        DocumentTag.year == year
+    )
+    rows = db.execute(union_all(recorded, tagged).order_by("month", "id")).all()
+
+    documents = {month: {True: {}, False: {}} for month in range(1, 13)}
+    for row in rows:
+        if row.month in documents:
+            documents[row.month][bool(row.recorded)].setdefault(row.id, {
+                "id": row.id,
+                "filename": row.filename,
+                "status": row.status,
+                "upload_date": row.upload_date.isoformat() if row.upload_date else None
+            })
+
     result = {
         "year": year,
         "months": {}
     }
-    
-    # For each month, get the metrics
-    for month_idx, month_name in enumerate(month_names, 1):
-        # First check if we have metrics for this month
-        metrics_entry = db.query(FinancialMetric).filter(
-            FinancialMetric.year == year,
-            FinancialMetric.month == month_idx
-        ).first()
-        
-        documents = []
-        has_data = False
-        
-        # If we have metrics, get the associated documents
-        if metrics_entry:
-            has_data = True
-            document_ids = metrics_entry.document_ids.split(",") if metrics_entry.document_ids else []
-            
-            if document_ids:
-                # Get the documents associated with these metrics
-                doc_ids = [int(doc_id) for doc_id in document_ids if doc_id.strip()]
-                if doc_ids:
-                    docs = db.query(Document).filter(Document.id.in_(doc_ids)).all()
-                    for doc in docs:
-                        documents.append({
-                            "id": doc.id,
-                            "filename": doc.filename,
-                            "status": doc.status,
-                            "upload_date": doc.upload_date.isoformat() if doc.upload_date else None
-                        })
-        
-        # If no metrics found, also check for documents with period tags for this month/year
-        if not has_data or not documents:
-            # Look for documents with a period tag for this month and year
-            period_tag_docs = db.query(Document).join(
-                DocumentTag, 
-                Document.id == DocumentTag.document_id
-            ).filter(
-                DocumentTag.tag == "period",
-                DocumentTag.year == year,
-                DocumentTag.month == month_idx
-            ).all()
-            
-            if period_tag_docs:
-                has_data = True
-                for doc in period_tag_docs:
-                    # Check if this document is already in our list
-                    if not any(d['id'] == doc.id for d in documents):
-                        documents.append({
-                            "id": doc.id,
-                            "filename": doc.filename,
-                            "status": doc.status,
-                            "upload_date": doc.upload_date.isoformat() if doc.upload_date else None
-                        })
-        
-        # Get the current time for lastAnalysisDate
+    for month_idx, month_name in enumerate(MONTH_NAMES, 1):
+        metrics_entry = metrics.get(month_idx)
+        month_documents = list(documents[month_idx][True].values()) or list(documents[month_idx][False].values())
         last_analysis_date = metrics_entry.last_analysis_date.isoformat() if metrics_entry and metrics_entry.last_analysis_date else None
-        
-        # Add the month data to the result with metrics in a nested object for backward compatibility
+
+        # Metrics stay in a nested object for backward compatibility
         result["months"][month_name] = {
             "monthIndex": month_idx,
-            "hasData": has_data,
-            "documents": documents,
+            "hasData": bool(metrics_entry) or bool(month_documents),
+            "documents": month_documents,
             "metrics": {
                 "revenue": metrics_entry.revenue if metrics_entry else 0.0,
                 "expenses": metrics_entry.expenses if metrics_entry else 0.0,
@@ -206,9 +155,37 @@ async def get_yearly_metrics_table(
             },
             "lastAnalysisDate": last_analysis_date
         }
-    
     return result
 
+
+@router.get("/metrics/table/{year}")
+async def get_yearly_metrics_table(
+    year: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Get metrics for all months in a year and build a month-by-month table
+
+    Served with an ETag: a request whose If-None-Match still matches the
+    year's data version gets 304 after a single version lookup.
+    """
+    try:
+        version = data_version.version(db, year)
+        etag = f'W/"metrics-{year}-{version}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        result = yearly_table_cache.get(year, version)
+        if result is None:
+            result = build_yearly_metrics_table(db, year)
+            yearly_table_cache.put(year, version, result)
+        return JSONResponse(content=result, headers=headers)
+    except Exception as e:
+        logger.error(f"Error building metrics table for {year}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error building metrics table: {str(e)}")
+
 @router.get("/metrics/{year}/{month}")
 async def get_financial_metrics(
     year: int,
@@ -241,22 +218,11 @@ async def get_financial_metrics(
                 "last_analysis_date": None
             }
         
-        # Get associated document info
-        document_ids = metric.document_ids.split(",") if metric.document_ids else []
-        documents = []
-        
-        if document_ids:
-            for doc_id in document_ids:
-                try:
-                    doc_id_int = int(doc_id)
-                    doc = db.query(Document).filter(Document.id == doc_id_int).first()
-                    if doc:
-                        documents.append({
-                            "id": doc.id,
-                            "filename": doc.filename
-                        })
-                except (ValueError, TypeError):
-                    pass
+        # Get associated document info in one indexed join
+        docs = db.query(Document.id, Document.filename).join(FinancialMetricDocument).filter(
+            FinancialMetricDocument.metric_id == metric.id
+        ).order_by(Document.id).all()
+        documents = [{"id": doc.id, "filename": doc.filename} for doc in docs]
         
         return {
             "year": year,
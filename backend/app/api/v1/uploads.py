@@ -0,0 +1,301 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Body, status
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+import weakref
+from config import Config
+from ...core.database import get_db
+from ...models.document import Document, UploadSession
+from ...services.storage_service import StorageService
+from ...services.file_validation import (
+    HEAD_BYTES, FileTooLargeError, UnsupportedFileError, UploadValidator, check_file_head, check_pdf_pages
+)
+from ...services.job_queue import job_queue, QueueFullError
+from ...services.document_pipeline import document_pipeline
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+storage_service = StorageService()
+upload_dir = os.path.join(storage_service.storage_path, "uploads")
+os.makedirs(upload_dir, exist_ok=True)
+
+# Serializes chunk writes and finalize for one upload within this process;
+# a lock is dropped automatically once no request holds or waits on it
+_upload_locks = weakref.WeakValueDictionary()
+
+
+def _lock_for(upload_id):
+    lock = _upload_locks.get(upload_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _upload_locks[upload_id] = lock
+    return lock
+
+
+def _progress(upload):
+    return {
+        "upload_id": upload.id,
+        "filename": upload.filename,
+        "size": upload.total_size,
+        "offset": upload.received_bytes,
+        "status": upload.status,
+        "document_id": upload.document_id,
+        "chunk_size": Config.UPLOAD_CHUNK_BYTES
+    }
+
+
+def _get_upload(db, upload_id):
+    upload = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+def _write_at(path, offset, data):
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def _truncate(path, size):
+    with open(path, "r+b") as f:
+        f.truncate(size)
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        head = f.read(HEAD_BYTES)
+        digest.update(head)
+        for chunk in iter(lambda: f.read(Config.UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return head, digest.hexdigest()
+
+
+def _expire_stale_uploads(db):
+    """
+    Remove unfinished uploads that have not received data within the TTL
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=Config.UPLOAD_SESSION_TTL_HOURS)
+    stale = db.query(UploadSession).filter(
+        UploadSession.status == "uploading",
+        UploadSession.updated_at < cutoff
+    ).all()
+    for upload in stale:
+        storage_service.delete_file(upload.part_path)
+        db.delete(upload)
+    if stale:
+        logger.info(f"Expired {len(stale)} stale upload sessions")
+
+
+@router.post("/documents/uploads", status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    filename: str = Body(...),
+    size: int = Body(...),
+    sha256: str = Body(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Start a resumable upload
+
+    The client then PUTs the file in chunks to /documents/uploads/{upload_id}
+    and calls /documents/uploads/{upload_id}/finalize once all bytes are sent.
+    """
+    try:
+        UploadValidator(filename)
+        if size <= 0:
+            raise UnsupportedFileError("File is empty")
+        if size > Config.MAX_UPLOAD_BYTES:
+            raise FileTooLargeError(f"File exceeds the maximum upload size of {Config.MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+
+        _expire_stale_uploads(db)
+
+        upload_id = uuid.uuid4().hex
+        part_path = os.path.join(upload_dir, f"{upload_id}.part")
+        open(part_path, "wb").close()
+
+        upload = UploadSession(
+            id=upload_id,
+            filename=os.path.basename(filename),
+            total_size=size,
+            expected_hash=sha256.lower() if sha256 else None,
+            part_path=part_path
+        )
+        db.add(upload)
+        db.commit()
+        return _progress(upload)
+
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedFileError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error creating upload: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error creating upload: {str(e)}")
+
+
+@router.get("/documents/uploads/{upload_id}")
+async def get_upload(
+    upload_id: str,
+    db: Session = Depends(get_db)
+):
+    """
+    Get the progress of an upload; resume by sending the next chunk at `offset`
+    """
+    return _progress(_get_upload(db, upload_id))
+
+
+@router.put("/documents/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int,
+    x_chunk_sha256: str = Header(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Write one chunk of an upload at `offset`
+
+    The raw request body is the chunk and X-Chunk-SHA256 its sha256 hex digest.
+    A chunk that fails the checksum is discarded and can simply be resent.
+    """
+    async with _lock_for(upload_id):
+        try:
+            upload = _get_upload(db, upload_id)
+            if upload.status != "uploading":
+                raise HTTPException(status_code=409, detail="Upload is already finalized")
+            if offset != upload.received_bytes:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Expected offset {upload.received_bytes}",
+                    headers={"Upload-Offset": str(upload.received_bytes)}
+                )
+
+            digest = hashlib.sha256()
+            written = 0
+            try:
+                async for data in request.stream():
+                    if not data:
+                        continue
+                    if offset + written + len(data) > upload.total_size:
+                        raise HTTPException(status_code=413, detail="Chunk extends past the declared file size")
+                    digest.update(data)
+                    await run_in_threadpool(_write_at, upload.part_path, offset + written, data)
+                    written += len(data)
+
+                if digest.hexdigest() != x_chunk_sha256.lower():
+                    raise HTTPException(status_code=400, detail="Chunk checksum mismatch")
+
+                # Reject the wrong kind of file as soon as its first bytes are in
+                received = offset + written
+                if offset < HEAD_BYTES and (received >= HEAD_BYTES or received == upload.total_size):
+                    with open(upload.part_path, "rb") as f:
+                        head = f.read(HEAD_BYTES)
+                    check_file_head(os.path.splitext(upload.filename)[1].lower(), head)
+            except Exception:
+                # Drop whatever part of the chunk was written so the client can resend it
+                await run_in_threadpool(_truncate, upload.part_path, offset)
+                raise
+
+            upload.received_bytes = received
+            upload.updated_at = datetime.utcnow()
+            db.commit()
+            return _progress(upload)
+
+        except HTTPException:
+            raise
+        except FileTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except UnsupportedFileError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error writing chunk for upload {upload_id}: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Error writing chunk: {str(e)}")
+
+
+@router.post("/documents/uploads/{upload_id}/finalize", status_code=status.HTTP_202_ACCEPTED)
+async def finalize_upload(
+    upload_id: str,
+    db: Session = Depends(get_db)
+):
+    """
+    Turn a completed upload into a Document and queue it for processing
+
+    Idempotent: finalizing an upload again returns the document created the
+    first time.
+    """
+    async with _lock_for(upload_id):
+        try:
+            upload = _get_upload(db, upload_id)
+
+            if upload.document_id:
+                document = db.query(Document).filter(Document.id == upload.document_id).first()
+                if not document:
+                    raise HTTPException(status_code=410, detail="The document for this upload has been deleted")
+                return {
+                    "id": document.id,
+                    "filename": document.filename,
+                    "status": document.status,
+                    "message": "Upload already finalized."
+                }
+
+            if upload.received_bytes != upload.total_size:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Upload incomplete: {upload.received_bytes} of {upload.total_size} bytes received",
+                    headers={"Upload-Offset": str(upload.received_bytes)}
+                )
+
+            job_queue.check_capacity(db)
+
+            head, content_hash = await run_in_threadpool(_hash_file, upload.part_path)
+            if upload.expected_hash and content_hash != upload.expected_hash:
+                raise HTTPException(status_code=400, detail="File checksum mismatch")
+            file_type, _ = check_file_head(os.path.splitext(upload.filename)[1].lower(), head)
+            if file_type == "pdf":
+                await run_in_threadpool(check_pdf_pages, upload.part_path)
+
+            # The part file is linked into content-addressed storage and only
+            # removed once the document is committed, so a failed finalize can be retried
+            file_path, created = storage_service.place_content_addressed(upload.part_path, content_hash, upload.filename)
+            try:
+                stored_file = storage_service.register_file(db, file_path, content_hash, upload.total_size)
+                document, job = document_pipeline.create_document(db, upload.filename, stored_file)
+
+                upload.document_id = document.id
+                upload.status = "complete"
+                upload.updated_at = datetime.utcnow()
+                db.commit()
+            except Exception:
+                db.rollback()
+                if created:
+                    storage_service.discard_placed(db, file_path, content_hash)
+                raise
+            storage_service.delete_file(upload.part_path)
+
+            return {
+                "id": document.id,
+                "filename": document.filename,
+                "status": document.status,
+                "message": "Document upload initiated. Processing in background." if job
+                           else "Identical document already processed. Results reused."
+            }
+
+        except HTTPException:
+            raise
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+        except FileTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except UnsupportedFileError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error finalizing upload {upload_id}: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Error finalizing upload: {str(e)}")
@@ -0,0 +1,51 @@
+import threading
+from ..models.document import YearVersion
+
+
+class DataVersion:
+    """
+    Versions of the data behind per-year views (the yearly metrics table)
+
+    The versions are kept in the database: triggers on documents, period
+    tags, metrics and metric links bump a year's year_versions row in the
+    same transaction as the write (see models.document.version_triggers).
+    Writes from other processes, such as the chat agent's SQLite tool or
+    other job workers, and raw SQL move them as well, and a rolled back
+    write never does.
+    """
+
+    @staticmethod
+    def version(db, year):
+        """
+        Opaque version string for a year's data, usable as an ETag
+        """
+        row = db.query(YearVersion.version).filter(YearVersion.year == year).first()
+        return str(row.version if row else 0)
+
+
+class YearCache:
+    """
+    Per-year cache of computed responses, valid while the year's data version is unchanged
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, year, version):
+        with self._lock:
+            entry = self._entries.get(year)
+        if entry and entry[0] == version:
+            return entry[1]
+        return None
+
+    def put(self, year, version, value):
+        """
+        Store a value computed from data at version (read before computing,
+        so a write committed meanwhile leaves the entry already stale)
+        """
+        with self._lock:
+            self._entries[year] = (version, value)
+
+
+data_version = DataVersion()
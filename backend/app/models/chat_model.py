@@ -9,6 +9,7 @@ class ChatRequest(BaseModel):
     query: str
     message_history: Optional[List[Message]] = None
     file: Optional[str] = None
+    conversation_id: Optional[str] = None  # scopes cached tool results; one per chat session
     
 class ChatResponse(BaseModel):
     response: Union[str, dict]
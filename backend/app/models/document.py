@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, Index, UniqueConstraint, create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 import os
+from config import Config
 from typing import List, Optional
 
 Base = declarative_base()
@@ -17,10 +18,30 @@ class Document(Base):
     original_format = Column(String, nullable=False)  # pdf, xlsx, csv, jpg, etc.
     status = Column(String, default="uploading")  # uploading, analyzing, complete, error
     ai_confidence = Column(Integer, nullable=True)
+    content_hash = Column(String, nullable=True, index=True)  # sha256 of the file, see StoredFile
+    duplicate_of = Column(Integer, ForeignKey("documents.id"), nullable=True)  # near-duplicate of an earlier upload
+    batch_id = Column(String, nullable=True, index=True)  # set for documents uploaded together
+    detection_source = Column(String, nullable=True)  # what tagged the periods: rules, llm, batch_llm, reuse, near_duplicate, default
+    current_parse_id = Column(
+        Integer,
+        ForeignKey("parsed_content.id", use_alter=True, name="fk_documents_current_parse_id"),
+        nullable=True
+    )  # the ParsedContent version readers use
     
     # Relationships
-    parsed_content = relationship("ParsedContent", back_populates="document", uselist=False, cascade="all, delete-orphan")
+    parsed_content = relationship("ParsedContent", foreign_keys=[current_parse_id], uselist=False, post_update=True)
+    parse_versions = relationship(
+        "ParsedContent", foreign_keys="ParsedContent.document_id", back_populates="document",
+        order_by="ParsedContent.version", cascade="all, delete-orphan"
+    )
     tags = relationship("DocumentTag", back_populates="document", cascade="all, delete-orphan")
+    jobs = relationship("ProcessingJob", back_populates="document", cascade="all, delete-orphan")
+    financials = relationship("DocumentFinancials", back_populates="document", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Keyset pagination of the document listing (newest first)
+        Index('ix_documents_upload_date_id', 'upload_date', 'id'),
+    )
     
     def __repr__(self):
         return f"<Document(id={self.id}, filename='{self.filename}', status='{self.status}')>"
@@ -30,13 +51,21 @@ class ParsedContent(Base):
     __tablename__ = 'parsed_content'
 
     id = Column(Integer, primary_key=True)
-    document_id = Column(Integer, ForeignKey("documents.id"))
-    markdown_text = Column(Text)
-    parse_status = Column(String, default="pending")  # pending, success, failed
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    version = Column(Integer, default=1)  # increases with every processing run that produced new text
+    source_hash = Column(String, nullable=True)  # sha256 of the file that was parsed
+    engine_config_hash = Column(String, nullable=True)  # OCR engine and settings, see OCRService.engine_fingerprint
+    markdown_text = deferred(Column(Text))  # loaded on first access, never for listings
+    parse_status = Column(String, default="pending")  # pending, partial, success, failed
     parse_date = Column(DateTime, default=datetime.utcnow)
+    page_stats = Column(Text, nullable=True)  # JSON list: per-page method (text_layer/ocr) and timings
+    pages_processed = Column(Integer, default=0)
+    page_count = Column(Integer, nullable=True)
+    simhash = Column(Integer, nullable=True)  # 64-bit fingerprint of the phase-one text (signed for SQLite)
+    table_rows = Column(Text, nullable=True)  # JSON list of tables rebuilt from OCR word boxes / text layout
     
     # Relationship
-    document = relationship("Document", back_populates="parsed_content")
+    document = relationship("Document", foreign_keys=[document_id], back_populates="parse_versions")
     
     def __repr__(self):
         return f"<ParsedContent(id={self.id}, document_id={self.document_id}, status='{self.parse_status}')>"
@@ -54,6 +83,11 @@ class DocumentTag(Base):
     year = Column(Integer, nullable=True)
     month = Column(Integer, nullable=True)
     
+    __table_args__ = (
+        Index('ix_document_tags_document_id', 'document_id'),
+        Index('ix_document_tags_period', 'tag', 'year', 'month', 'document_id'),
+    )
+
     # Relationship
     document = relationship("Document", back_populates="tags")
     
@@ -67,19 +101,340 @@ class FinancialMetric(Base):
     id = Column(Integer, primary_key=True)
     year = Column(Integer, nullable=False)
     month = Column(Integer, nullable=False)
-    document_ids = Column(String)  # Comma-separated list of document IDs
     revenue = Column(Float, default=0.0)
     expenses = Column(Float, default=0.0)
     profit = Column(Float, default=0.0)
     cash_flow = Column(Float, default=0.0)
     last_analysis_date = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        Index('ix_financial_metrics_period', 'year', 'month'),
+    )
+
+    # Relationships
+    document_links = relationship("FinancialMetricDocument", back_populates="metric", cascade="all, delete-orphan")
+    documents = relationship("Document", secondary="financial_metric_documents", order_by="Document.id", viewonly=True)
+    
     def __repr__(self):
         return f"<FinancialMetric(id={self.id}, year={self.year}, month={self.month})>"
 
 
+class FinancialMetricDocument(Base):
+    __tablename__ = 'financial_metric_documents'
+
+    # Which documents a month's metrics were summed from
+    metric_id = Column(Integer, ForeignKey("financial_metrics.id", ondelete="CASCADE"), primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (
+        Index('ix_financial_metric_documents_document_id', 'document_id'),
+    )
+
+    # Relationship
+    metric = relationship("FinancialMetric", back_populates="document_links")
+
+    def __repr__(self):
+        return f"<FinancialMetricDocument(metric_id={self.metric_id}, document_id={self.document_id})>"
+
+
+class DocumentFinancials(Base):
+    __tablename__ = 'document_financials'
+
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    revenue = Column(Float, default=0.0)
+    expenses = Column(Float, default=0.0)
+    profit = Column(Float, default=0.0)
+    cash_flow = Column(Float, default=0.0)
+    source = Column(String, nullable=True)  # spreadsheet, table, llm
+    source_hash = Column(String, nullable=True)  # sha1 of the parsed text the figures came from
+    notes = Column(Text, nullable=True)
+    extracted_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('document_id', 'year', 'month', name='uq_document_financials_period'),
+    )
+
+    # Relationship
+    document = relationship("Document", back_populates="financials")
+
+    def __repr__(self):
+        return f"<DocumentFinancials(document_id={self.document_id}, year={self.year}, month={self.month})>"
+
+
+class StoredFile(Base):
+    __tablename__ = 'stored_files'
+
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String, nullable=False, unique=True)  # sha256 hex digest
+    file_path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0)  # documents pointing at this file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<StoredFile(id={self.id}, content_hash='{self.content_hash}', ref_count={self.ref_count})>"
+
+
+class UploadSession(Base):
+    __tablename__ = 'upload_sessions'
+
+    id = Column(String, primary_key=True)  # uuid4 hex, handed to the client
+    filename = Column(String, nullable=False)
+    total_size = Column(Integer, nullable=False)
+    received_bytes = Column(Integer, default=0)
+    expected_hash = Column(String, nullable=True)  # optional sha256 of the whole file, checked on finalize
+    part_path = Column(String, nullable=False)
+    status = Column(String, default="uploading")  # uploading, complete
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=True)  # set once finalized
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<UploadSession(id='{self.id}', filename='{self.filename}', received={self.received_bytes}/{self.total_size})>"
+
+
+class ProcessingJob(Base):
+    __tablename__ = 'processing_jobs'
+
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    job_type = Column(String, nullable=False)  # extract_text, extract_full_text, detect_period, detect_period_batch
+    stage = Column(String, nullable=False)  # ocr, llm (decides which worker pool runs it)
+    status = Column(String, default="queued")  # queued, running, failed
+    priority = Column(Integer, default=0)  # lower runs first
+    payload = Column(Text, nullable=True)  # JSON-encoded job arguments
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    locked_by = Column(String, nullable=True)  # "<host>:<pid>:<boot id>/<worker>"
+    locked_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # refreshed by the owning process while the job runs
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_processing_jobs_claim', 'status', 'stage', 'priority', 'run_after'),
+    )
+
+    # Relationship
+    document = relationship("Document", back_populates="jobs")
+
+    def __repr__(self):
+        return f"<ProcessingJob(id={self.id}, document_id={self.document_id}, job_type='{self.job_type}', status='{self.status}')>"
+
+
+class YearVersion(Base):
+    __tablename__ = 'year_versions'
+
+    year = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)  # bumped by triggers on every write to the year's data (version_triggers)
+
+    def __repr__(self):
+        return f"<YearVersion(year={self.year}, version={self.version})>"
+
+
+def current_parsed_content(db, document_id):
+    """
+    The current parse result of a document, or None
+    """
+    return db.query(ParsedContent).join(Document, Document.current_parse_id == ParsedContent.id).filter(
+        Document.id == document_id
+    ).first()
+
+
 # Initialize database
 def init_db(db_path="sqlite:///./financial_docs.db"):
     engine = create_engine(db_path)
     Base.metadata.create_all(engine)
-    return engine 
\ No newline at end of file
+    upgrade_db(engine)
+    return engine
+
+
+def upgrade_db(engine):
+    """
+    Bring an existing database up to date with the models
+
+    create_all only creates missing tables, so columns and indexes added to
+    existing tables later are applied here.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, bool):
+                    ddl += f" DEFAULT {int(default)}"
+                elif isinstance(default, (int, float)):
+                    ddl += f" DEFAULT {default}"
+                elif isinstance(default, str):
+                    ddl += " DEFAULT '{}'".format(default.replace("'", "''"))
+                conn.execute(text(ddl))
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    migrate_metric_documents(engine)
+    migrate_parse_versions(engine)
+
+    if engine.dialect.name == "sqlite":
+        create_fulltext_index(engine)
+        create_version_triggers(engine)
+
+
+def migrate_metric_documents(engine):
+    """
+    Move the comma-separated financial_metrics.document_ids of older databases
+    into financial_metric_documents
+
+    Ids of documents that no longer exist are dropped. Converted rows have
+    document_ids cleared, so running this again is a no-op.
+    """
+    inspector = inspect(engine)
+    if "document_ids" not in {column["name"] for column in inspector.get_columns("financial_metrics")}:
+        return
+
+    with engine.begin() as conn:
+        rows = conn.execute(text(
+            "SELECT id, document_ids FROM financial_metrics WHERE document_ids IS NOT NULL AND document_ids != ''"
+        )).fetchall()
+        for metric_id, document_ids in rows:
+            ids = {int(doc_id) for doc_id in document_ids.split(",") if doc_id.strip().isdigit()}
+            for document_id in ids:
+                conn.execute(text(
+                    "INSERT INTO financial_metric_documents (metric_id, document_id) "
+                    "SELECT :metric_id, id FROM documents WHERE id = :document_id AND NOT EXISTS ("
+                    "SELECT 1 FROM financial_metric_documents WHERE metric_id = :metric_id AND document_id = :document_id)"
+                ), {"metric_id": metric_id, "document_id": document_id})
+            conn.execute(text("UPDATE financial_metrics SET document_ids = NULL WHERE id = :id"), {"id": metric_id})
+
+
+def migrate_parse_versions(engine):
+    """
+    Point documents of older databases at their latest parse and drop the
+    copies piled up by reprocessing
+
+    The current row and the newest Config.PARSE_VERSIONS_KEPT - 1 others are
+    kept, as after any processing run.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE documents SET current_parse_id = (
+                SELECT max(id) FROM parsed_content WHERE parsed_content.document_id = documents.id
+            ) WHERE current_parse_id IS NULL
+        """))
+        conn.execute(text("""
+            DELETE FROM parsed_content WHERE id IN (
+                SELECT id FROM (
+                    SELECT pc.id, row_number() OVER (
+                        PARTITION BY pc.document_id
+                        ORDER BY (pc.id = d.current_parse_id) DESC, pc.id DESC
+                    ) AS position
+                    FROM parsed_content pc JOIN documents d ON d.id = pc.document_id
+                ) WHERE position > :keep
+            )
+        """), {"keep": max(Config.PARSE_VERSIONS_KEPT, 1)})
+
+
+# FTS5 index over the parsed text. It is an external-content table (the text
+# is stored once, in parsed_content) kept in sync by triggers, so every insert,
+# update or delete of parsed content, through the ORM or not, is indexed.
+FULLTEXT_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS parsed_content_fts_insert AFTER INSERT ON parsed_content BEGIN
+        INSERT INTO parsed_content_fts(rowid, markdown_text) VALUES (new.id, new.markdown_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS parsed_content_fts_delete AFTER DELETE ON parsed_content BEGIN
+        INSERT INTO parsed_content_fts(parsed_content_fts, rowid, markdown_text)
+        VALUES ('delete', old.id, old.markdown_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS parsed_content_fts_update AFTER UPDATE OF markdown_text ON parsed_content BEGIN
+        INSERT INTO parsed_content_fts(parsed_content_fts, rowid, markdown_text)
+        VALUES ('delete', old.id, old.markdown_text);
+        INSERT INTO parsed_content_fts(rowid, markdown_text) VALUES (new.id, new.markdown_text);
+    END
+    """,
+]
+
+
+def create_fulltext_index(engine):
+    """
+    Create the parsed_content_fts table and its triggers, indexing existing content once
+    """
+    inspector = inspect(engine)
+    existed = inspector.has_table("parsed_content_fts")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS parsed_content_fts USING fts5("
+            "markdown_text, content='parsed_content', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        ))
+        for trigger in FULLTEXT_TRIGGERS:
+            conn.execute(text(trigger))
+        if not existed:
+            conn.execute(text("INSERT INTO parsed_content_fts(parsed_content_fts) VALUES ('rebuild')"))
+
+
+# Years whose yearly metrics table shows a row, for the year_versions triggers.
+# {row} is "new" or "old"; documents only matter for the columns the table shows
+# and tags only when they are period tags.
+VERSIONED_TABLES = [
+    ("documents", "filename, status, upload_date", None, """
+        SELECT year FROM document_tags WHERE document_id = {row}.id AND tag = 'period'
+        UNION SELECT fm.year FROM financial_metrics fm
+        JOIN financial_metric_documents fmd ON fmd.metric_id = fm.id WHERE fmd.document_id = {row}.id
+    """),
+    ("document_tags", None, "{row}.tag = 'period'", "SELECT {row}.year AS year"),
+    ("financial_metrics", None, None, "SELECT {row}.year AS year"),
+    ("financial_metric_documents", None, None, "SELECT year FROM financial_metrics WHERE id = {row}.metric_id"),
+]
+
+VERSION_BUMP = """
+    INSERT INTO year_versions (year, version) SELECT year, 1 FROM ({years}) WHERE year IS NOT NULL
+    ON CONFLICT(year) DO UPDATE SET version = version + 1;
+"""
+
+
+def version_triggers():
+    """
+    CREATE TRIGGER statements that bump year_versions for every write to a
+    VERSIONED_TABLES table, whatever process or connection makes it
+    """
+    triggers = []
+    for table, columns, condition, years in VERSIONED_TABLES:
+        for operation, rows in (("insert", ["new"]), ("update", ["old", "new"]), ("delete", ["old"])):
+            if table == "documents" and operation == "insert":
+                continue  # a new document has no tags or metrics yet
+            event = f"UPDATE OF {columns}" if operation == "update" and columns else operation.upper()
+            when = " OR ".join(f"({condition.format(row=row)})" for row in rows) if condition else None
+            # Old and new years in one statement, so a row that stays in its year bumps it once
+            body = VERSION_BUMP.format(years=" UNION ".join(years.format(row=row) for row in rows))
+            triggers.append(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_version_{operation} AFTER {event} ON {table}"
+                + (f" WHEN {when}" if when else "")
+                + f" BEGIN{body}END"
+            )
+    return triggers
+
+
+def create_version_triggers(engine):
+    """
+    Create the triggers that keep year_versions moving with the data it versions
+    """
+    with engine.begin() as conn:
+        for trigger in version_triggers():
+            conn.execute(text(trigger))
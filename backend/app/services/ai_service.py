@@ -5,9 +5,19 @@ from config import Config
 import re
 import json
 from datetime import datetime
+from . import period_detector
 
 logger = logging.getLogger(__name__)
 
+
+class PeriodDetectionError(Exception):
+    """
+    Raised when the LLM could not be reached or its answer could not be read
+
+    Callers retry (the job queue backs off) rather than tagging a guessed period.
+    """
+
+
 class AIService:
     """
     Service for AI-based document analysis and financial data extraction
@@ -23,10 +33,37 @@ class AIService:
         )
         self.model = Config.LLM_MODEL_NAME
     
-    def detect_document_period(self, markdown_content, filename):
+    def detect_period_locally(self, markdown_content, filename):
+        """
+        Run the rule-based period detector
+
+        Returns:
+            The rules result when it is confident enough to skip the LLM, else None
+        """
+        if not Config.LOCAL_DETECTION_ENABLED:
+            return None
+        result = period_detector.detect_period(markdown_content, filename)
+        if result["periods"] and result["confidence"] >= Config.LOCAL_DETECTION_MIN_CONFIDENCE:
+            logger.info(f"Detected period of {filename} locally ({result['confidence']}%, {', '.join(result['evidence'])})")
+            return result
+        return None
+
+    def detect_document_period(self, markdown_content, filename, use_rules=True):
         """
         Detect the time periods (months and years) a document refers to
+
+        The local rule-based detector is tried first and the LLM is only called
+        when it is not confident. The result's "source" records which one
+        decided ("rules", "llm" or "default" when the model found no period).
+
+        Raises:
+            PeriodDetectionError: The LLM call failed or returned no readable JSON
         """
+        if use_rules:
+            local_result = self.detect_period_locally(markdown_content, filename)
+            if local_result:
+                return local_result
+
         try:
             prompt = f"""
             You are an AI specialized in detecting time periods in financial documents.
@@ -69,96 +106,192 @@ class AIService:
             json_pattern = r'({[\s\S]*})'
             json_match = re.search(json_pattern, response_text)
             
-            if json_match:
-                json_str = json_match.group(1)
-                data = json.loads(json_str)
-                
-                # If using new format with periods array
-                if "periods" in data:
-                    # Return the new format directly
-                    return data
-                # For backward compatibility, convert old format to new format
-                else:
-                    year = data.get("year")
-                    month = data.get("month")
-                    confidence = data.get("confidence", 50)
-                    detected_tags = data.get("detected_tags", [])
-                    
-                    # Create new format
-                    return {
+            if not json_match:
+                raise ValueError(f"No valid JSON found in response: {response_text}")
+            return self._period_answer(json.loads(json_match.group(1)))
+
+        except Exception as e:
+            logger.error(f"Error detecting document period: {str(e)}", exc_info=True)
+            raise PeriodDetectionError(f"Period detection failed: {str(e)}") from e
+
+    def detect_document_periods_batch(self, documents):
+        """
+        Detect the periods of several documents with a single LLM call
+
+        Args:
+            documents: List of tuples containing (document_id, filename, markdown_content);
+                       content is cut to Config.PERIOD_BATCH_SNIPPET_CHARS
+
+        Returns:
+            Dictionary of document_id -> result in the detect_document_period format.
+            Documents the local detector is confident about never reach the LLM;
+            documents the model skipped are detected individually.
+
+        Raises:
+            PeriodDetectionError: The batch call failed or returned no readable JSON
+        """
+        results = {}
+        remaining = []
+        for document_id, filename, markdown_content in documents:
+            local_result = self.detect_period_locally(markdown_content, filename)
+            if local_result:
+                results[document_id] = local_result
+            else:
+                remaining.append((document_id, filename, markdown_content))
+        if not remaining:
+            return results
+
+        try:
+            sections = []
+            for document_id, filename, markdown_content in remaining:
+                snippet = (markdown_content or "")[:Config.PERIOD_BATCH_SNIPPET_CHARS]
+                sections.append(f"=== Document {document_id} ===\nFilename: {filename}\nContent snippet:\n{snippet}")
+            joined_sections = "\n\n".join(sections)
+
+            prompt = f"""
+            You are an AI specialized in detecting time periods in financial documents.
+            Below are {len(remaining)} separate documents. For EACH document, determine which month(s) and year(s) it refers to,
+            using only that document's own filename and content.
+            
+            {joined_sections}
+            
+            Return your analysis as a JSON object with one entry per document, using the document numbers shown above:
+            {{
+                "documents": [
+                    {{
+                        "document_id": <document number as integer>,
                         "periods": [
-                            {
-                                "year": year,
-                                "month": month,
-                                "confidence": confidence
-                            }
+                            {{
+                                "year": <detected year as integer>,
+                                "month": <detected month as integer 1-12>,
+                                "confidence": <confidence level 0-100>
+                            }}
                         ],
-                        "confidence": confidence,
-                        "detected_tags": detected_tags
-                    }
-            else:
-                logger.error(f"No valid JSON found in response: {response_text}")
-                # Return default data in new format
-                return {
-                    "periods": [
-                        {
-                            "year": datetime.now().year,
-                            "month": datetime.now().month,
-                            "confidence": 50
-                        }
-                    ],
-                    "confidence": 50,
-                    "detected_tags": ["unknown"]
-                }
-                
+                        "confidence": <overall confidence level 0-100>,
+                        "detected_tags": [<list of relevant tags like "income statement", "invoice", "receipt", etc.>]
+                    }}
+                ]
+            }}
+            
+            If you cannot detect a specific year or month, use null for that field.
+            Focus on finding dates that represent the reporting period, not the creation date of the document.
+            """
+
+            completion = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "You are a financial document analyzer."},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"}
+            )
+
+            response_text = completion.choices[0].message.content
+            json_match = re.search(r'({[\s\S]*})', response_text)
+            if not json_match:
+                raise ValueError(f"No valid JSON found in batch response: {response_text}")
+            data = json.loads(json_match.group(1))
+            for entry in data.get("documents", []):
+                try:
+                    document_id = int(entry.get("document_id"))
+                except (TypeError, ValueError):
+                    continue
+                if any(document_id == item[0] for item in remaining):
+                    results[document_id] = self._period_answer(entry, source="batch_llm")
+
         except Exception as e:
-            logger.error(f"Error detecting document period: {str(e)}", exc_info=True)
-            # Return default values on error
+            logger.error(f"Error detecting document periods in batch: {str(e)}", exc_info=True)
+            raise PeriodDetectionError(f"Batch period detection failed: {str(e)}") from e
+
+        # Anything the batch answer did not cover falls back to one call per document
+        for document_id, filename, markdown_content in remaining:
+            if document_id not in results:
+                results[document_id] = self.detect_document_period(markdown_content, filename, use_rules=False)
+        return results
+
+    @staticmethod
+    def _normalize_period_result(data, source="llm"):
+        """
+        Convert a period-detection response to the format with a periods array
+        """
+        # If using new format with periods array
+        if "periods" in data:
             return {
-                "periods": [
-                    {
-                        "year": datetime.now().year,
-                        "month": datetime.now().month,
-                        "confidence": 50
-                    }
-                ],
-                "confidence": 50,
-                "detected_tags": ["error"]
+                "periods": data.get("periods") or [],
+                "confidence": data.get("confidence", 50),
+                "detected_tags": data.get("detected_tags", []),
+                "source": source
             }
+
+        # For backward compatibility, convert old format to new format
+        confidence = data.get("confidence", 50)
+        return {
+            "periods": [
+                {
+                    "year": data.get("year"),
+                    "month": data.get("month"),
+                    "confidence": confidence
+                }
+            ],
+            "confidence": confidence,
+            "detected_tags": data.get("detected_tags", []),
+            "source": source
+        }
+
+    def _period_answer(self, data, source="llm"):
+        """
+        Result for a period-detection answer; the default result only when the
+        model read the document and found no period in it
+        """
+        result = self._normalize_period_result(data, source=source)
+        if not any(period.get("year") for period in result["periods"]):
+            return self._default_period_result("unknown")
+        return result
+
+    @staticmethod
+    def _default_period_result(tag):
+        return {
+            "periods": [
+                {
+                    "year": datetime.now().year,
+                    "month": datetime.now().month,
+                    "confidence": 50
+                }
+            ],
+            "confidence": 50,
+            "detected_tags": [tag],
+            "source": "default"
+        }
     
-    def analyze_financial_metrics(self, document_contents, year, month):
+    def extract_document_financials(self, markdown_content, filename, year, month):
         """
-        Analyze document contents to extract financial metrics
-        
+        Extract one document's financial figures for a month
+
         Args:
-            document_contents: List of tuples containing (document_id, markdown_content)
-            year: Year to analyze
-            month: Month to analyze
-            
+            markdown_content: Parsed document text (cut to Config.FINANCIAL_EXTRACTION_MAX_CHARS)
+            filename: Document filename
+            year: Year to extract
+            month: Month to extract
+
         Returns:
-            Dictionary with financial metrics
+            Dictionary with revenue, expenses, profit, cash_flow and notes,
+            or None if the figures could not be extracted
         """
         try:
-            # Combine all document contents (limiting length to avoid token limits)
-            combined_content = ""
-            doc_ids = []
-            
-            for doc_id, content in document_contents:
-                doc_ids.append(doc_id)
-                
-                combined_content += f"\n--- Document {doc_id} ---\n{content}\n"
-            
+            content = (markdown_content or "")[:Config.FINANCIAL_EXTRACTION_MAX_CHARS]
+
             prompt = f"""
-            You are a financial analyst AI. Analyze the following financial documents for {month}/{year} 
-            and extract these key metrics:
+            You are a financial analyst AI. Analyze the following financial document and extract
+            these key metrics for {month}/{year} only:
             
             1. Revenue: Total income or revenue figure
             2. Expenses: Total expenses or costs
             3. Profit: Net profit or income (Revenue - Expenses)
             4. Cash Flow: Net cash flow or change in cash position
             
-            Documents:
-            {combined_content}
+            Document filename: {filename}
+            Document content:
+            {content}
             
             Return ONLY a JSON object with these exact keys:
             {{
@@ -166,10 +299,10 @@ class AIService:
                 "expenses": <float>,
                 "profit": <float>,
                 "cash_flow": <float>,
-                "analysis_notes": "<brief explanation of your findings>"
+                "notes": "<brief explanation of where the figures come from>"
             }}
             
-            If you cannot determine a specific value, use 0 for that field.
+            If the document does not contain a specific value, use 0 for that field.
             """
             
             completion = self.client.chat.completions.create(
@@ -183,42 +316,20 @@ class AIService:
             
             # Extract and parse response
             response_text = completion.choices[0].message.content
-            json_pattern = r'({[\s\S]*})'
-            json_match = re.search(json_pattern, response_text)
-            
-            if json_match:
-                json_str = json_match.group(1)
-                data = json.loads(json_str)
-                
-                # Ensure all required fields exist and are numeric
-                result = {
-                    "revenue": float(data.get("revenue", 0)),
-                    "expenses": float(data.get("expenses", 0)),
-                    "profit": float(data.get("profit", 0)),
-                    "cash_flow": float(data.get("cash_flow", 0)),
-                    "analysis_notes": data.get("analysis_notes", "No additional notes"),
-                    "document_ids": ",".join(str(x) for x in doc_ids)
-                }
-                
-                return result
-            else:
+            json_match = re.search(r'({[\s\S]*})', response_text)
+            if not json_match:
                 logger.error(f"No valid JSON found in response: {response_text}")
-                return {
-                    "revenue": 0,
-                    "expenses": 0,
-                    "profit": 0,
-                    "cash_flow": 0,
-                    "analysis_notes": "Error processing response",
-                    "document_ids": ",".join(str(x) for x in doc_ids)
-                }
+                return None
+
+            data = json.loads(json_match.group(1))
+            return {
+                "revenue": float(data.get("revenue") or 0),
+                "expenses": float(data.get("expenses") or 0),
+                "profit": float(data.get("profit") or 0),
+                "cash_flow": float(data.get("cash_flow") or 0),
+                "notes": data.get("notes", "")
+            }
                 
         except Exception as e:
-            logger.error(f"Error analyzing financial metrics: {str(e)}", exc_info=True)
-            return {
-                "revenue": 0,
-                "expenses": 0,
-                "profit": 0,
-                "cash_flow": 0,
-                "analysis_notes": f"Error: {str(e)}",
-                "document_ids": ",".join(str(x) for x in doc_ids) if doc_ids else ""
-            } 
\ No newline at end of file
+            logger.error(f"Error extracting financials from {filename}: {str(e)}", exc_info=True)
+            return None
@@ -0,0 +1,209 @@
+import re
+import threading
+import time
+import logging
+import unicodedata
+import numpy as np
+from config import Config
+from .text_vectorizer import HashingVectorizer
+
+logger = logging.getLogger(__name__)
+
+# Politeness and framing words that don't change what is being asked
+FILLER_PATTERNS = {
+    "en": [
+        r"\b(please|pls|kindly|thanks|thank you)\b",
+        r"\b(can|could|would) you( please)?( tell me| explain| let me know)?\b",
+        r"\b(i want to know|i would like to know|tell me|explain to me)\b",
+    ],
+    "ms": [
+        r"\b(tolong|sila|mohon|terima kasih)\b",
+        r"\b(boleh|bolehkah) (anda |awak )?(terangkan|jelaskan|beritahu)( saya)?\b",
+        r"\b(saya nak tahu|saya ingin tahu)\b",
+    ],
+}
+
+# Equivalent ways of opening a definition question, applied before the filler
+# words are removed so a politely framed request is still recognised
+QUESTION_REWRITES = {
+    "en": [
+        (r"\bwhat's\b", "what is"),
+        (r"^((please|kindly) )?((can|could|would) you )?(please )?(explain|define|describe)( to me)?\b", "what is"),
+    ],
+    "ms": [
+        (r"\bapakah( itu)?\b", "apa itu"),
+        (r"^((tolong|sila|mohon) )?((boleh|bolehkah) (anda |awak )?)?(terangkan|jelaskan)( kepada)?( saya)?"
+         r"( (tentang|mengenai))?\b", "apa itu"),
+    ],
+}
+
+MALAY_MARKERS = {
+    "apa", "itu", "ini", "yang", "dan", "untuk", "bagaimana", "adalah", "ialah", "dengan",
+    "bagi", "cara", "maksud", "geran", "pinjaman", "perniagaan", "syarikat", "kewangan",
+    "aliran", "tunai", "untung", "rugi", "boleh", "mengapa", "kenapa", "berapa", "mana", "tolong",
+}
+ENGLISH_MARKERS = {
+    "what", "is", "the", "how", "and", "for", "of", "to", "a", "an", "does", "do", "why",
+    "which", "explain", "mean", "meaning", "difference", "between", "can", "are",
+}
+
+# Queries about the user's own company/data must always go to the model
+COMPANY_SPECIFIC_PATTERNS = [
+    r"\b(my|our|ours|mine|we|us|we're|i'm)\b",
+    r"\b(saya|kami|kita|aku)\b",
+    r"\b(company profile|dashboard|uploaded|upload)\b",
+    r"\b(profil syarikat|muat naik)\b",
+    r"\d",
+]
+
+
+def normalize_query(query):
+    """
+    Normalize a query so trivially different phrasings map to the same text
+
+    Returns:
+        Tuple of (normalized_text, language)
+    """
+    text = unicodedata.normalize("NFKC", query or "").lower().strip()
+    language = detect_language(text)
+
+    for pattern, replacement in QUESTION_REWRITES[language]:
+        text = re.sub(pattern, replacement, text)
+    for pattern in FILLER_PATTERNS[language]:
+        text = re.sub(r"\s+", " ", re.sub(pattern, " ", text)).strip()
+    text = re.sub(r"^(what is|apa itu) \1\b", r"\1", text)
+
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text, language
+
+
+def detect_language(text):
+    """
+    Classify a query as Malay ("ms") or English ("en") by function words
+    """
+    words = re.findall(r"[a-z']+", text.lower())
+    malay = sum(1 for w in words if w in MALAY_MARKERS)
+    english = sum(1 for w in words if w in ENGLISH_MARKERS)
+    return "ms" if malay > english else "en"
+
+
+def is_company_specific(query):
+    """
+    Whether a query refers to the user's own company or data
+    """
+    text = (query or "").lower()
+    return any(re.search(pattern, text) for pattern in COMPANY_SPECIFIC_PATTERNS)
+
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of answers to general questions, looked up by similarity
+
+    Queries are normalized and embedded with a hashing vectorizer; each language
+    has its own index so an English answer is never returned for a Malay query.
+    """
+
+    def __init__(self, threshold=None, ttl_seconds=None, max_entries=None, vectorizer=None):
+        self.threshold = threshold if threshold is not None else Config.ANSWER_CACHE_SIMILARITY
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.ANSWER_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or Config.ANSWER_CACHE_MAX_ENTRIES
+        self.vectorizer = vectorizer or HashingVectorizer()
+        self._entries = {}   # language -> list of dicts
+        self._matrices = {}  # language -> stacked vectors, rebuilt lazily
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _matrix(self, language):
+        matrix = self._matrices.get(language)
+        if matrix is None:
+            entries = self._entries.get(language, [])
+            if entries:
+                matrix = np.vstack([entry["vector"] for entry in entries])
+            else:
+                matrix = np.zeros((0, self.vectorizer.n_features), dtype=np.float32)
+            self._matrices[language] = matrix
+        return matrix
+
+    def _expire(self, language, now):
+        entries = self._entries.get(language, [])
+        alive = [entry for entry in entries if now - entry["created"] <= self.ttl_seconds]
+        if len(alive) != len(entries):
+            self._entries[language] = alive
+            self._matrices.pop(language, None)
+
+    def lookup(self, query):
+        """
+        Return a cached answer for a similar query, or None
+        """
+        if is_company_specific(query):
+            return None
+
+        normalized, language = normalize_query(query)
+        if not normalized:
+            return None
+        vector = self.vectorizer.transform_one(normalized)
+        now = time.monotonic()
+
+        with self._lock:
+            self._expire(language, now)
+            matrix = self._matrix(language)
+            if matrix.shape[0] == 0:
+                self.misses += 1
+                return None
+
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry = self._entries[language][best]
+            entry["last_hit"] = now
+            self.hits += 1
+
+        logger.info(f"Answer cache hit ({scores[best]:.3f}) for '{normalized}' -> '{entry['query']}'")
+        return entry["answer"]
+
+    def store(self, query, answer):
+        """
+        Cache an answer for a general (non company-specific) query
+        """
+        if not answer or is_company_specific(query):
+            return
+
+        normalized, language = normalize_query(query)
+        if not normalized:
+            return
+        vector = self.vectorizer.transform_one(normalized)
+        now = time.monotonic()
+
+        with self._lock:
+            self._expire(language, now)
+            entries = self._entries.setdefault(language, [])
+
+            # Replace a near-identical entry instead of storing it twice
+            matrix = self._matrix(language)
+            if matrix.shape[0]:
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entries.pop(best)
+
+            if len(entries) >= self.max_entries:
+                # Evict the least recently used entry
+                lru = min(range(len(entries)), key=lambda i: entries[i]["last_hit"])
+                entries.pop(lru)
+
+            entries.append({
+                "query": normalized,
+                "vector": vector,
+                "answer": answer,
+                "created": now,
+                "last_hit": now
+            })
+            self._matrices.pop(language, None)
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,554 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+from sqlalchemy import func
+from config import Config
+from .ocr_service import OCRService
+from .ai_service import AIService
+from .job_queue import job_queue, JobDeferred
+from .near_duplicate import near_duplicate_index, simhash, to_signed, to_unsigned
+from .table_reconstruction import load_tables
+from .retrieval_index import retrieval_index
+from .preview_service import preview_service
+from ..models.document import Document, ParsedContent, DocumentTag, current_parsed_content
+
+logger = logging.getLogger(__name__)
+
+
+def save_detected_tags(db, document_id, ai_result, replace=False):
+    """
+    Store the period and type tags from a period-detection result
+
+    Args:
+        db: Database session
+        document_id: Document the tags belong to
+        ai_result: Result dict from AIService.detect_document_period
+        replace: Remove existing period/type tags first
+    """
+    if replace:
+        db.query(DocumentTag).filter(
+            DocumentTag.document_id == document_id,
+            DocumentTag.tag.in_(["period", "type"])
+        ).delete(synchronize_session=False)
+
+    # Add period tags for each detected period
+    for period in ai_result.get("periods", []):
+        year = period.get("year")
+        month = period.get("month")
+
+        if year:
+            db.add(DocumentTag(
+                document_id=document_id,
+                tag="period",
+                value=f"{month}/{year}" if month else f"{year}",
+                ai_detected=True,
+                confidence=period.get("confidence", 50),
+                year=year,
+                month=month
+            ))
+
+    # Add other detected tags
+    for tag in ai_result.get("detected_tags", []):
+        db.add(DocumentTag(
+            document_id=document_id,
+            tag="type",
+            value=tag,
+            ai_detected=True,
+            confidence=ai_result.get("confidence", 50)
+        ))
+
+
+class DocumentPipeline:
+    """
+    Document processing stages run by the job queue workers
+    """
+
+    def __init__(self, ai_service=None):
+        self.ai_service = ai_service or AIService()
+
+    def register(self, queue):
+        """
+        Register the pipeline stages as job handlers
+        """
+        queue.register("extract_text", "ocr", self.extract_text, on_failure=self.mark_failed)
+        queue.register("detect_period", "llm", self.detect_period, on_failure=self.mark_failed)
+        queue.register("extract_full_text", "ocr", self.extract_full_text, on_failure=self.mark_extraction_failed)
+        queue.register("detect_period_batch", "llm", self.detect_period_batch, on_failure=self.split_failed_batch)
+
+    def create_document(self, db, filename, stored_file):
+        """
+        Create a Document for a stored upload and queue its processing (committed by the caller)
+
+        Args:
+            db: Database session
+            filename: Original filename
+            stored_file: StoredFile the document points at
+
+        Returns:
+            Tuple of (document, job); job is None if an identical upload's results were reused
+        """
+        file_extension = os.path.splitext(filename)[1].lower()
+        document = Document(
+            filename=filename,
+            file_path=stored_file.file_path,
+            content_hash=stored_file.content_hash,
+            original_format=file_extension.replace(".", ""),
+            status="uploading"
+        )
+        db.add(document)
+        db.flush()
+
+        job = self.enqueue_document(db, document)
+        return document, job
+
+    def create_documents_batch(self, db, uploads, batch_id):
+        """
+        Create Documents for several stored uploads in one flush and queue them as a group
+
+        Text is extracted per document, but period detection runs as a single
+        detect_period_batch job that packs several documents into each LLM call.
+        The caller commits.
+
+        Args:
+            db: Database session
+            uploads: List of (filename, stored_file) tuples
+            batch_id: Identifier shared by the documents
+
+        Returns:
+            List of (document, job) tuples, in upload order
+        """
+        documents = []
+        for filename, stored_file in uploads:
+            file_extension = os.path.splitext(filename)[1].lower()
+            documents.append(Document(
+                filename=filename,
+                file_path=stored_file.file_path,
+                content_hash=stored_file.content_hash,
+                original_format=file_extension.replace(".", ""),
+                status="uploading",
+                batch_id=batch_id
+            ))
+        db.add_all(documents)
+        db.flush()
+
+        created = [(document, self.enqueue_document(db, document)) for document in documents]
+        if any(job for _, job in created):
+            job_queue.enqueue(
+                db, None, "detect_period_batch",
+                payload={"batch_id": batch_id},
+                delay_seconds=Config.PERIOD_BATCH_WAIT_SECONDS
+            )
+        return created
+
+    def enqueue_document(self, db, document):
+        """
+        Queue a newly uploaded document for processing (committed by the caller)
+
+        Returns:
+            The queued job, or None if the results of an identical upload were reused
+        """
+        if self.reuse_existing(db, document):
+            return None
+        return job_queue.enqueue(db, document.id, "extract_text")
+
+    def reuse_existing(self, db, document):
+        """
+        Copy the parsed content and tags of an already processed upload with the same bytes
+
+        Returns:
+            True if the document was completed from an existing one
+        """
+        if not document.content_hash:
+            return False
+
+        source = db.query(Document).join(ParsedContent, Document.current_parse_id == ParsedContent.id).filter(
+            Document.content_hash == document.content_hash,
+            Document.id != document.id,
+            Document.status == "complete",
+            ParsedContent.parse_status == "success",
+            ParsedContent.engine_config_hash == OCRService.engine_fingerprint()
+        ).order_by(Document.id.desc()).first()
+        if not source:
+            return False
+
+        parsed = source.parsed_content
+        copy = ParsedContent(
+            version=1,
+            source_hash=parsed.source_hash,
+            engine_config_hash=parsed.engine_config_hash,
+            markdown_text=parsed.markdown_text,
+            parse_status=parsed.parse_status,
+            page_stats=parsed.page_stats,
+            pages_processed=parsed.pages_processed,
+            page_count=parsed.page_count,
+            simhash=parsed.simhash,
+            table_rows=parsed.table_rows
+        )
+        document.parse_versions.append(copy)
+        document.parsed_content = copy
+        self._copy_analysis(db, source, document, "reuse")
+        # Same bytes means the same statement, so it must not be counted twice either
+        document.duplicate_of = source.duplicate_of or source.id
+        logger.info(f"Document {document.id} has the same content as document {source.id}, reusing its results")
+        return True
+
+    @staticmethod
+    def _copy_analysis(db, source, document, detection_source):
+        """
+        Give a document the tags and completed status of another one
+        """
+        for tag in source.tags:
+            if tag.tag == "status":
+                continue
+            db.add(DocumentTag(
+                document_id=document.id,
+                tag=tag.tag,
+                value=tag.value,
+                ai_detected=tag.ai_detected,
+                confidence=tag.confidence,
+                year=tag.year,
+                month=tag.month
+            ))
+
+        document.status = "complete"
+        document.ai_confidence = source.ai_confidence
+        document.detection_source = detection_source
+
+    def find_near_duplicate(self, db, document, fingerprint):
+        """
+        Find an earlier document whose text is nearly identical (e.g. a rescan of the same statement)
+
+        Returns:
+            The original Document, or None
+        """
+        if fingerprint is None or not Config.NEAR_DUPLICATE_ENABLED:
+            return None
+
+        near_duplicate_index.ensure_loaded(db)
+        for document_id, distance in near_duplicate_index.query(fingerprint, exclude=document.id):
+            candidate = db.query(Document).filter(Document.id == document_id).first()
+            if candidate:
+                logger.info(f"Document {document.id} is a near-duplicate of document {candidate.id} (distance {distance})")
+                # Point at the first upload rather than at another copy
+                if candidate.duplicate_of:
+                    original = db.query(Document).filter(Document.id == candidate.duplicate_of).first()
+                    return original or candidate
+                return candidate
+        return None
+
+    def extract_text(self, db, job):
+        """
+        OCR stage, phase one: extract the first pages and queue period detection
+
+        The reporting period is almost always on the first page or two, so only
+        Config.PERIOD_DETECTION_PAGES pages are extracted before the document is
+        handed to period detection. The rest of the document is queued as a
+        lower-priority extract_full_text job. A document already fully parsed
+        from the same file and OCR settings is not extracted again.
+        """
+        document = db.query(Document).filter(Document.id == job.document_id).first()
+        if not document:
+            logger.warning(f"Document {job.document_id} no longer exists, skipping text extraction")
+            return
+
+        document.status = "analyzing"
+        db.commit()
+
+        inputs = self.parse_inputs(document)
+        parsed_content = document.parsed_content
+        if parsed_content and self.parsed_from(parsed_content) == inputs and parsed_content.parse_status == "success":
+            # Same file, same engine and settings: the text would come out the same
+            logger.info(f"Document {document.id} was already parsed from the same inputs, skipping OCR")
+            markdown_text = parsed_content.markdown_text
+        else:
+            extraction = OCRService.extract_document(
+                document.file_path, last_page=max(Config.PERIOD_DETECTION_PAGES, 1)
+            )
+            parsed_content = self.store_extraction(db, document, inputs, extraction, phase_one=True)
+            markdown_text = extraction["markdown"]
+
+            if parsed_content.pages_processed < parsed_content.page_count:
+                job_queue.enqueue(
+                    db, document.id, "extract_full_text",
+                    payload={"first_page": parsed_content.pages_processed + 1},
+                    priority=Config.FULL_EXTRACTION_PRIORITY
+                )
+        fingerprint = to_unsigned(parsed_content.simhash)
+        # The batch job may have handed the document back while it was being extracted
+        db.refresh(document, attribute_names=["batch_id"])
+
+        original = self.find_near_duplicate(db, document, fingerprint)
+        if original:
+            document.duplicate_of = original.id
+
+        if original and original.status == "complete":
+            # Reuse the original's analysis instead of asking the LLM again
+            self._copy_analysis(db, original, document, "near_duplicate")
+        elif self._detect_locally(db, document, markdown_text):
+            # Period stated plainly enough for the rule-based detector; no LLM job needed
+            pass
+        elif not document.batch_id:
+            # Batch uploads are picked up by their detect_period_batch job instead
+            job_queue.enqueue(db, document.id, "detect_period")
+        db.commit()
+
+        if fingerprint is not None:
+            near_duplicate_index.add(document.id, fingerprint)
+        if parsed_content.parse_status == "success":
+            retrieval_index.index_document(document)
+        preview_service.render_document(document)
+
+    def extract_full_text(self, db, job):
+        """
+        OCR stage, phase two: extract the remaining pages and append them
+        """
+        parsed_content = current_parsed_content(db, job.document_id)
+        if not parsed_content or not parsed_content.document:
+            logger.warning(f"Document {job.document_id} no longer exists, skipping full text extraction")
+            return
+        if parsed_content.parse_status == "success":
+            logger.info(f"Document {job.document_id} is already fully extracted, skipping")
+            return
+
+        # Continue after the pages the current parse already has (a rerun must not append them twice)
+        payload = json.loads(job.payload) if job.payload else {}
+        first_page = max(payload.get("first_page", 1), (parsed_content.pages_processed or 0) + 1)
+        extraction = OCRService.extract_document(parsed_content.document.file_path, first_page=first_page)
+
+        page_stats = json.loads(parsed_content.page_stats) if parsed_content.page_stats else []
+        parsed_content.markdown_text = (parsed_content.markdown_text or "") + extraction["markdown"]
+        parsed_content.page_stats = json.dumps(page_stats + self._page_stats(extraction["pages"]))
+        parsed_content.table_rows = json.dumps(load_tables(parsed_content) + self._page_tables(extraction["pages"]))
+        parsed_content.page_count = extraction["page_count"]
+        parsed_content.pages_processed = extraction["page_count"]
+        parsed_content.parse_status = "success"
+        db.commit()
+        logger.info(f"Full text extracted for document {job.document_id} ({extraction['page_count']} pages)")
+        retrieval_index.index_document(parsed_content.document)
+
+    @staticmethod
+    def parse_inputs(document):
+        """
+        What a processing run of the document depends on
+
+        Returns:
+            Tuple of (source file sha256, OCRService.engine_fingerprint())
+        """
+        source_hash = document.content_hash
+        if not source_hash:
+            # Uploaded before content addressing
+            digest = hashlib.sha256()
+            with open(document.file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            source_hash = digest.hexdigest()
+        return source_hash, OCRService.engine_fingerprint()
+
+    @staticmethod
+    def parsed_from(parsed_content):
+        return parsed_content.source_hash, parsed_content.engine_config_hash
+
+    def store_extraction(self, db, document, inputs, extraction, phase_one=False):
+        """
+        Save an extraction as the document's current parse
+
+        A run over the same inputs as the current parse (a retried or resumed
+        run) overwrites it; anything else becomes a new version, and versions
+        beyond Config.PARSE_VERSIONS_KEPT are deleted.
+
+        Args:
+            db: Database session (the caller commits)
+            document: Document that was extracted
+            inputs: parse_inputs(document)
+            extraction: Result of OCRService.extract_document from the first page
+            phase_one: Only the first Config.PERIOD_DETECTION_PAGES pages were
+                extracted; the parse stays "partial" if there are more
+
+        Returns:
+            The current ParsedContent
+        """
+        parsed_content = document.parsed_content
+        if not parsed_content or self.parsed_from(parsed_content) != inputs:
+            latest = db.query(func.max(ParsedContent.version)).filter(ParsedContent.document_id == document.id).scalar()
+            parsed_content = ParsedContent(
+                version=(latest or 0) + 1,
+                source_hash=inputs[0],
+                engine_config_hash=inputs[1]
+            )
+            document.parse_versions.append(parsed_content)
+            document.parsed_content = parsed_content
+            db.flush()
+            self.prune_parse_versions(db, document)
+
+        detection_pages = max(Config.PERIOD_DETECTION_PAGES, 1)
+        page_count = extraction["page_count"]
+        parsed_content.markdown_text = extraction["markdown"]
+        parsed_content.page_stats = json.dumps(self._page_stats(extraction["pages"]))
+        parsed_content.table_rows = json.dumps(self._page_tables(extraction["pages"]))
+        parsed_content.page_count = page_count
+        parsed_content.pages_processed = min(detection_pages, page_count) if phase_one else page_count
+        parsed_content.parse_status = "partial" if parsed_content.pages_processed < page_count else "success"
+        parsed_content.parse_date = datetime.utcnow()
+
+        # Fingerprint only the phase-one pages so every document is compared on the same span
+        if page_count > detection_pages and not phase_one:
+            head = OCRService.pages_to_markdown([page for page in extraction["pages"] if page["page"] <= detection_pages])
+        else:
+            head = extraction["markdown"]
+        fingerprint = simhash(head)
+        parsed_content.simhash = to_signed(fingerprint)
+        return parsed_content
+
+    @staticmethod
+    def prune_parse_versions(db, document):
+        """
+        Delete all but the newest Config.PARSE_VERSIONS_KEPT parses (the current one is always kept)
+        """
+        keep = [document.current_parse_id] + [
+            row.id for row in db.query(ParsedContent.id).filter(
+                ParsedContent.document_id == document.id,
+                ParsedContent.id != document.current_parse_id
+            ).order_by(ParsedContent.version.desc(), ParsedContent.id.desc()).limit(max(Config.PARSE_VERSIONS_KEPT, 1) - 1)
+        ]
+        pruned = db.query(ParsedContent).filter(
+            ParsedContent.document_id == document.id,
+            ParsedContent.id.notin_(keep)
+        ).delete(synchronize_session="fetch")
+        if pruned:
+            logger.info(f"Deleted {pruned} old parse versions of document {document.id}")
+
+    @staticmethod
+    def _page_stats(pages):
+        return [{k: v for k, v in page.items() if k not in ("text", "tables")} for page in pages]
+
+    @staticmethod
+    def _page_tables(pages):
+        return [table for page in pages for table in page.get("tables", [])]
+
+    def detect_period(self, db, job):
+        """
+        LLM stage: detect reporting periods and document type tags
+        """
+        document = db.query(Document).filter(Document.id == job.document_id).first()
+        if not document:
+            logger.warning(f"Document {job.document_id} no longer exists, skipping period detection")
+            return
+
+        parsed_content = document.parsed_content
+        if not parsed_content or not parsed_content.markdown_text:
+            raise ValueError(f"Document {document.id} has no parsed content")
+
+        ai_result = self.ai_service.detect_document_period(parsed_content.markdown_text, document.filename)
+
+        self._apply_detection(db, document, ai_result)
+        db.commit()
+        logger.info(f"Document {document.id} processed successfully")
+
+    def detect_period_batch(self, db, job):
+        """
+        LLM stage for batch uploads: detect periods for several documents per call
+
+        Documents whose text is ready are sent in packs of Config.PERIOD_BATCH_SIZE.
+        While other documents of the batch are still being extracted, only full
+        packs are sent and the job is deferred until the rest are ready. After
+        Config.PERIOD_BATCH_MAX_WAIT_SECONDS the remaining packs are sent and the
+        documents still extracting get their own detection jobs.
+        """
+        batch_id = json.loads(job.payload)["batch_id"]
+        # Documents in "error" (or already complete) are done and not waited for
+        documents = db.query(Document).filter(
+            Document.batch_id == batch_id,
+            Document.status.in_(["uploading", "analyzing"])
+        ).order_by(Document.id).all()
+
+        ready = [document for document in documents if self._text_ready(document)]
+        waiting = len(documents) - len(ready)
+        size = max(Config.PERIOD_BATCH_SIZE, 1)
+        waited = (datetime.utcnow() - job.created_at).total_seconds() if job.created_at else 0
+        give_up = waiting and waited >= Config.PERIOD_BATCH_MAX_WAIT_SECONDS
+
+        while ready and (len(ready) >= size or not waiting or give_up):
+            pack, ready = ready[:size], ready[size:]
+            results = self.ai_service.detect_document_periods_batch(
+                [(document.id, document.filename, document.parsed_content.markdown_text) for document in pack]
+            )
+            for document in pack:
+                self._apply_detection(db, document, results[document.id])
+            db.commit()
+            logger.info(f"Detected periods for {len(pack)} documents of batch {batch_id} in one call")
+
+        if give_up:
+            logger.warning(f"{waiting} documents of batch {batch_id} still extracting after {int(waited)}s, "
+                           f"detecting their periods one by one")
+            self.split_failed_batch(db, job)
+            db.commit()
+        elif waiting or ready:
+            raise JobDeferred(Config.PERIOD_BATCH_WAIT_SECONDS, f"{waiting} documents of batch {batch_id} still extracting")
+
+    @staticmethod
+    def _text_ready(document):
+        """
+        Whether a document has text to detect periods from; a failed full-text
+        extraction still leaves the phase-one text
+        """
+        parsed_content = document.parsed_content
+        return bool(
+            parsed_content
+            and parsed_content.parse_status in ("partial", "success", "failed")
+            and parsed_content.markdown_text
+        )
+
+    def split_failed_batch(self, db, job):
+        """
+        Fall back to per-document period detection when a batch job gives up
+        or has waited too long
+        """
+        batch_id = json.loads(job.payload)["batch_id"]
+        documents = db.query(Document).filter(
+            Document.batch_id == batch_id,
+            Document.status.in_(["uploading", "analyzing"])
+        ).all()
+        for document in documents:
+            # Documents still extracting will queue their own detection when done
+            document.batch_id = None
+            if self._text_ready(document):
+                job_queue.enqueue(db, document.id, "detect_period")
+
+    def _detect_locally(self, db, document, markdown_text):
+        ai_result = self.ai_service.detect_period_locally(markdown_text, document.filename)
+        if not ai_result:
+            return False
+        self._apply_detection(db, document, ai_result)
+        return True
+
+    @staticmethod
+    def _apply_detection(db, document, ai_result):
+        document.status = "complete"
+        document.ai_confidence = ai_result.get("confidence", 50)
+        document.detection_source = ai_result.get("source")
+        save_detected_tags(db, document.id, ai_result, replace=True)
+
+    def mark_failed(self, db, job):
+        """
+        Flag the document once a stage has exhausted its retries
+        """
+        document = db.query(Document).filter(Document.id == job.document_id).first()
+        if document:
+            document.status = "error"
+
+    def mark_extraction_failed(self, db, job):
+        """
+        Record that the remaining pages could not be extracted
+
+        The document keeps its phase-one text and tags; only the parse status
+        changes, so it stays usable.
+        """
+        parsed_content = current_parsed_content(db, job.document_id)
+        if parsed_content:
+            parsed_content.parse_status = "failed"
+
+
+document_pipeline = DocumentPipeline()
+document_pipeline.register(job_queue)
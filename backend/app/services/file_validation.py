@@ -0,0 +1,196 @@
+import os
+import re
+import logging
+from pdf2image.exceptions import PDFInfoNotInstalledError
+from config import Config
+from .ocr_service import OCRService
+
+logger = logging.getLogger(__name__)
+
+# Bytes inspected before the rest of an upload is accepted
+HEAD_BYTES = 64 * 1024
+
+# Magic-byte prefixes of the formats OCRService can extract
+SIGNATURES = [
+    (b"%PDF-", "pdf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"BM", "bmp"),
+    (b"PK\x03\x04", "zip"),  # xlsx is a zip container
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "ole"),  # legacy xls
+]
+
+# Sniffed type each allowed extension must match ("text" = no binary signature)
+EXTENSION_TYPES = {
+    ".pdf": "pdf",
+    ".png": "png",
+    ".jpg": "jpeg",
+    ".jpeg": "jpeg",
+    ".tiff": "tiff",
+    ".bmp": "bmp",
+    ".xlsx": "zip",
+    ".xls": "ole",
+    ".csv": "text",
+}
+
+LINEARIZED_PAGE_COUNT = re.compile(rb"/Linearized\s[^>]*?/N\s+(\d+)")
+
+
+class UnsupportedFileError(ValueError):
+    """
+    Raised when an upload is not a file type we can process
+    """
+
+
+class FileTooLargeError(ValueError):
+    """
+    Raised when an upload exceeds the configured size or page limits
+    """
+
+
+def sniff_file_type(head):
+    """
+    Identify a file from its first bytes
+
+    Returns:
+        One of the SIGNATURES types, "text" for NUL-free content, or None
+    """
+    for signature, file_type in SIGNATURES:
+        if head.startswith(signature):
+            return file_type
+    if head and b"\x00" not in head:
+        return "text"
+    return None
+
+
+def pdf_page_count_hint(head):
+    """
+    Page count of a linearized PDF, read from the dictionary at the start of the file
+
+    Returns:
+        Number of pages, or None if the PDF is not linearized
+    """
+    match = LINEARIZED_PAGE_COUNT.search(head[:4096])
+    return int(match.group(1)) if match else None
+
+
+def check_pdf_pages(file_path, max_pages=None):
+    """
+    Check a complete PDF's page count against the page limit
+
+    Only linearized PDFs state their page count in the first bytes, so every
+    PDF is counted again once it has been written.
+
+    Args:
+        file_path: Path of the fully written PDF
+        max_pages: Page limit, defaults to Config.MAX_UPLOAD_PAGES
+
+    Returns:
+        Number of pages, or None if pdfinfo is not installed
+
+    Raises:
+        FileTooLargeError, UnsupportedFileError
+    """
+    max_pages = max_pages or Config.MAX_UPLOAD_PAGES
+    try:
+        page_count = OCRService.get_pdf_page_count(file_path)
+    except PDFInfoNotInstalledError:
+        logger.warning("pdfinfo is not installed, PDF page counts are not checked")
+        return None
+    except Exception as e:
+        raise UnsupportedFileError(f"PDF could not be read: {str(e)}")
+    if page_count > max_pages:
+        raise FileTooLargeError(f"PDF has {page_count} pages, the limit is {max_pages}")
+    return page_count
+
+
+class UploadValidator:
+    """
+    Checks an upload incrementally as its chunks arrive
+
+    The file type and (for linearized PDFs) page count are checked as soon as
+    the first HEAD_BYTES have been seen, and the size limit on every chunk, so
+    an oversized or unsupported upload is rejected before it is fully written.
+    The page count of other PDFs is checked once the file is complete
+    (check_pdf_pages).
+    """
+
+    def __init__(self, filename, max_bytes=None, max_pages=None):
+        self.extension = os.path.splitext(filename or "")[1].lower()
+        self.max_bytes = max_bytes or Config.MAX_UPLOAD_BYTES
+        self.max_pages = max_pages or Config.MAX_UPLOAD_PAGES
+        self.size = 0
+        self.file_type = None
+        self.page_count = None
+        self._head = b""
+        self._checked = False
+
+        if self.extension not in EXTENSION_TYPES:
+            raise UnsupportedFileError(f"Unsupported file type: {self.extension or filename}")
+
+    def feed(self, chunk):
+        """
+        Account for the next chunk of the upload
+
+        Raises:
+            FileTooLargeError, UnsupportedFileError
+        """
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise FileTooLargeError(f"File exceeds the maximum upload size of {self.max_bytes // (1024 * 1024)} MB")
+
+        if not self._checked:
+            self._head += chunk[:HEAD_BYTES - len(self._head)]
+            if len(self._head) >= HEAD_BYTES:
+                self._check_head()
+
+    def finish(self):
+        """
+        Run the remaining checks once the whole upload has been read
+        """
+        if self.size == 0:
+            raise UnsupportedFileError("File is empty")
+        if not self._checked:
+            self._check_head()
+
+    def _check_head(self):
+        self._checked = True
+        self.file_type, self.page_count = check_file_head(self.extension, self._head, self.max_pages)
+        self._head = b""
+
+
+def check_file_head(extension, head, max_pages=None):
+    """
+    Check the first bytes of a file against its extension and page limit
+
+    Args:
+        extension: Lowercase file extension including the dot
+        head: Up to HEAD_BYTES from the start of the file
+        max_pages: Page limit for PDFs, defaults to Config.MAX_UPLOAD_PAGES
+
+    Returns:
+        Tuple of (file_type, page_count or None)
+
+    Raises:
+        FileTooLargeError, UnsupportedFileError
+    """
+    expected = EXTENSION_TYPES.get(extension)
+    if expected is None:
+        raise UnsupportedFileError(f"Unsupported file type: {extension}")
+
+    file_type = sniff_file_type(head)
+    if file_type != expected:
+        raise UnsupportedFileError(
+            f"File content does not match its {extension} extension"
+            f" (detected {file_type or 'unknown binary data'})"
+        )
+
+    page_count = None
+    if file_type == "pdf":
+        page_count = pdf_page_count_hint(head)
+        max_pages = max_pages or Config.MAX_UPLOAD_PAGES
+        if page_count and page_count > max_pages:
+            raise FileTooLargeError(f"PDF has {page_count} pages, the limit is {max_pages}")
+    return file_type, page_count
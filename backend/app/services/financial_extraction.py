@@ -0,0 +1,288 @@
+import hashlib
+import logging
+from datetime import datetime
+from config import Config
+from . import spreadsheet_metrics
+from .table_reconstruction import load_tables, tables_to_frame, tables_to_markdown
+from .ai_service import AIService
+from ..models.document import Document, FinancialMetric, FinancialMetricDocument, DocumentFinancials
+
+logger = logging.getLogger(__name__)
+
+FIGURES = ("revenue", "expenses", "profit", "cash_flow")
+
+
+def text_hash(markdown_content):
+    """
+    Fingerprint of the parsed text a set of figures was extracted from
+    """
+    return hashlib.sha1((markdown_content or "").encode("utf-8")).hexdigest()
+
+
+def metric_document_ids(db, year, month):
+    """
+    Ids of the documents recorded in a month's metrics, in id order
+    """
+    rows = db.query(FinancialMetricDocument.document_id).join(FinancialMetric).filter(
+        FinancialMetric.year == year,
+        FinancialMetric.month == month
+    ).order_by(FinancialMetricDocument.document_id).all()
+    return [row.document_id for row in rows]
+
+
+def drop_duplicates(db, document_ids):
+    """
+    Keep one document of each rescan/re-upload group, so a statement is never
+    summed twice: the original when it is among document_ids, else the
+    earliest copy
+
+    Returns:
+        Tuple of (kept ids in their given order, {dropped id: kept id})
+    """
+    if not document_ids:
+        return [], {}
+    rows = db.query(Document.id, Document.duplicate_of).filter(Document.id.in_(set(document_ids))).all()
+    groups = {}
+    for row in sorted(rows, key=lambda row: row.id):
+        groups.setdefault(row.duplicate_of or row.id, []).append(row.id)
+    dropped = {}
+    for original, members in groups.items():
+        kept = original if original in members else members[0]
+        dropped.update({member: kept for member in members if member != kept})
+    return [document_id for document_id in document_ids if document_id not in dropped], dropped
+
+
+def set_metric_documents(db, metric, document_ids):
+    """
+    Make a metric's document links exactly document_ids (ids of missing documents are skipped)
+
+    Args:
+        db: Database session (the caller commits)
+        metric: FinancialMetric, flushed here if it is new
+        document_ids: Ids of the documents the metric is summed from
+    """
+    if metric.id is None:
+        db.flush()
+    wanted = {row.id for row in db.query(Document.id).filter(Document.id.in_(set(document_ids)))} if document_ids else set()
+    links = db.query(FinancialMetricDocument).filter(FinancialMetricDocument.metric_id == metric.id)
+    if wanted:
+        links.filter(FinancialMetricDocument.document_id.notin_(wanted)).delete(synchronize_session=False)
+    else:
+        links.delete(synchronize_session=False)
+    existing = {row.document_id for row in db.query(FinancialMetricDocument.document_id).filter(
+        FinancialMetricDocument.metric_id == metric.id
+    )}
+    for document_id in sorted(wanted - existing):
+        db.add(FinancialMetricDocument(metric_id=metric.id, document_id=document_id))
+    db.flush()
+
+
+class FinancialExtractor:
+    """
+    Map-reduce computation of monthly financial metrics
+
+    Each document's figures for a month are extracted once (map) and stored in
+    DocumentFinancials, keyed by a hash of the parsed text they came from. A
+    month's FinancialMetric is then just the sum of its documents' rows
+    (reduce), so adding or removing a document never sends the unchanged
+    documents back to the LLM.
+    """
+
+    def __init__(self, ai_service=None):
+        self.ai_service = ai_service or AIService()
+
+    def extract(self, document, parsed_content, year, month):
+        """
+        Figures for one document and month
+
+        Spreadsheets are computed directly from their columns, and scanned or
+        digital statements from the tables rebuilt at OCR time. The LLM is
+        only asked when no layout is recognised with enough confidence, and
+        then sees the document's opening text plus its table rows rather than
+        the whole text.
+
+        Returns:
+            Dict with the FIGURES, "notes" and "source", or None on failure
+        """
+        markdown_content = parsed_content.markdown_text
+        covered_months = spreadsheet_metrics.document_months(document)
+        if spreadsheet_metrics.is_spreadsheet(document):
+            try:
+                result = spreadsheet_metrics.extract_month(document.file_path, year, month, covered_months)
+                if spreadsheet_metrics.confident(result):
+                    return result
+                logger.info(f"Low spreadsheet mapping confidence for document {document.id}, using the LLM")
+            except Exception as e:
+                logger.warning(f"Could not compute figures from spreadsheet {document.id}: {str(e)}")
+
+        tables = load_tables(parsed_content)
+        if tables:
+            frame = tables_to_frame(tables)
+            result = spreadsheet_metrics.sheet_metrics(frame, year, month, covered_months) if frame is not None else None
+            if spreadsheet_metrics.confident(result):
+                columns = ", ".join(f"{role} from '{column}'" for role, column in result["columns"].items())
+                result["notes"] = f"Computed from {result['rows']} table rows ({result['layout']}): {columns}"
+                result["source"] = "table"
+                return result
+            markdown_content = (
+                f"{markdown_content[:Config.TABLE_PROMPT_CONTEXT_CHARS]}\n\n"
+                f"## Table rows\n\n{tables_to_markdown(tables)}"
+            )
+
+        result = self.ai_service.extract_document_financials(markdown_content, document.filename, year, month)
+        if result is None:
+            return None
+        result["source"] = "llm"
+        return result
+
+    def ensure_extracted(self, db, document, year, month):
+        """
+        Get a document's stored figures for a month, extracting them if they
+        are missing or the parsed text has changed since they were extracted
+
+        Returns:
+            DocumentFinancials row, or None if the document has no text or extraction failed
+        """
+        parsed = document.parsed_content
+        if not parsed or not parsed.markdown_text:
+            return None
+
+        current_hash = text_hash(parsed.markdown_text)
+        row = db.query(DocumentFinancials).filter(
+            DocumentFinancials.document_id == document.id,
+            DocumentFinancials.year == year,
+            DocumentFinancials.month == month
+        ).first()
+        if row and row.source_hash == current_hash:
+            return row
+
+        result = self.extract(document, parsed, year, month)
+        if result is None:
+            return row
+
+        if not row:
+            row = DocumentFinancials(document_id=document.id, year=year, month=month)
+            db.add(row)
+        for figure in FIGURES:
+            setattr(row, figure, result.get(figure, 0) or 0)
+        row.source = result.get("source")
+        row.notes = result.get("notes", "")
+        row.source_hash = current_hash
+        row.extracted_at = datetime.utcnow()
+        db.flush()
+        return row
+
+    @staticmethod
+    def reduce_month(rows):
+        """
+        Sum per-document figures into month totals
+        """
+        totals = {figure: 0.0 for figure in FIGURES}
+        for row in rows:
+            for figure in FIGURES:
+                totals[figure] += getattr(row, figure) or 0.0
+        return {figure: round(value, 2) for figure, value in totals.items()}
+
+    def recompute_month(self, db, year, month, document_ids, extract_missing=True):
+        """
+        Rebuild a month's FinancialMetric from its documents' stored figures
+
+        Rescans and re-uploads of a document that is also in document_ids are
+        left out (see drop_duplicates).
+
+        Args:
+            db: Database session
+            year: Year of the metric
+            month: Month of the metric
+            document_ids: Documents that make up the month
+            extract_missing: Extract figures for documents that have none (or
+                stale ones); otherwise only stored figures are summed
+
+        Returns:
+            Dict with the month totals, "notes", "document_count", "failed"
+            (ids without figures) and "duplicates" ({left-out id: id kept in its place})
+        """
+        document_ids, duplicates = drop_duplicates(db, list(dict.fromkeys(document_ids)))
+        rows = []
+        failed = []
+        if extract_missing:
+            documents = db.query(Document).filter(Document.id.in_(document_ids)).all() if document_ids else []
+            for document in documents:
+                row = self.ensure_extracted(db, document, year, month)
+                if row:
+                    rows.append(row)
+                else:
+                    failed.append(document.id)
+        elif document_ids:
+            rows = db.query(DocumentFinancials).filter(
+                DocumentFinancials.document_id.in_(document_ids),
+                DocumentFinancials.year == year,
+                DocumentFinancials.month == month
+            ).all()
+
+        totals = self.reduce_month(rows)
+
+        metric = db.query(FinancialMetric).filter(
+            FinancialMetric.year == year,
+            FinancialMetric.month == month
+        ).first()
+        if not metric:
+            metric = FinancialMetric(year=year, month=month)
+            db.add(metric)
+        for figure, value in totals.items():
+            setattr(metric, figure, value)
+        set_metric_documents(db, metric, document_ids)
+        metric.last_analysis_date = datetime.utcnow()
+
+        if failed:
+            logger.warning(f"No financial figures for documents {failed} in {month}/{year}")
+
+        return {
+            **totals,
+            "notes": "\n".join(
+                f"Document {row.document_id}: {row.notes}" for row in rows if row.notes
+            ),
+            "document_count": len(rows),
+            "failed": failed,
+            "duplicates": duplicates
+        }
+
+    def detach_document(self, db, document_id, keep_periods=()):
+        """
+        Remove a document from the months it is recorded in and recompute
+        those months from the remaining documents' stored figures
+
+        Args:
+            db: Database session
+            document_id: Document to remove
+            keep_periods: (year, month) pairs the document should stay in
+
+        Returns:
+            List of (year, month) that were recomputed
+        """
+        keep_periods = set(keep_periods)
+        # Only the months this document is linked to, found through its index
+        metrics = db.query(FinancialMetric).join(FinancialMetricDocument).filter(
+            FinancialMetricDocument.document_id == document_id
+        ).all()
+        affected = []
+        for metric in metrics:
+            if (metric.year, metric.month) in keep_periods:
+                continue
+            remaining = [row.document_id for row in db.query(FinancialMetricDocument.document_id).filter(
+                FinancialMetricDocument.metric_id == metric.id,
+                FinancialMetricDocument.document_id != document_id
+            )]
+            self.recompute_month(db, metric.year, metric.month, remaining, extract_missing=False)
+            affected.append((metric.year, metric.month))
+
+        for year, month in affected:
+            db.query(DocumentFinancials).filter(
+                DocumentFinancials.document_id == document_id,
+                DocumentFinancials.year == year,
+                DocumentFinancials.month == month
+            ).delete(synchronize_session=False)
+        return affected
+
+
+financial_extractor = FinancialExtractor()
@@ -0,0 +1,364 @@
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from config import Config
+from ..core.database import SessionLocal
+from ..models.document import ProcessingJob
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the processing queue is too deep to accept more work
+    """
+
+
+class JobDeferred(Exception):
+    """
+    Raised by a handler that cannot run yet; the job is re-queued without using up an attempt
+    """
+
+    def __init__(self, delay_seconds, reason=""):
+        super().__init__(reason)
+        self.delay_seconds = delay_seconds
+
+
+def _process_alive(pid):
+    """
+    Whether a process with this pid is running on this host
+    """
+    if os.name != "posix":
+        # os.kill would terminate the process on Windows; rely on heartbeats there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Persistent document-processing queue backed by the processing_jobs table
+
+    Jobs survive restarts, are claimed atomically by worker threads that each use
+    their own database session, and run in per-stage pools so CPU-bound OCR and
+    network-bound LLM calls are limited independently.
+
+    A claimed job records its owner (host, pid and a per-start boot id) and
+    the owning process refreshes its heartbeat while it runs. Running jobs
+    are only put back in the queue once their owner is gone or their heartbeat
+    is older than Config.JOB_STALE_SECONDS, so several worker processes can
+    share the table without running a job twice.
+    """
+
+    def __init__(self, session_factory=SessionLocal, stage_limits=None):
+        self.session_factory = session_factory
+        self.stage_limits = stage_limits or {
+            "ocr": Config.JOB_OCR_CONCURRENCY,
+            "llm": Config.JOB_LLM_CONCURRENCY,
+        }
+        self.handlers = {}
+        self._wakeups = {stage: threading.Event() for stage in self.stage_limits}
+        self._stop = threading.Event()
+        self._threads = []
+        self.owner = None
+
+    def register(self, job_type, stage, handler, on_failure=None):
+        """
+        Register a handler for a job type
+
+        Args:
+            job_type: Name stored in ProcessingJob.job_type
+            stage: Worker pool that runs the job ("ocr" or "llm")
+            handler: Callable (db, job) run by a worker; raising triggers a retry
+            on_failure: Optional callable (db, job) run once retries are exhausted
+        """
+        if stage not in self.stage_limits:
+            raise ValueError(f"Unknown stage: {stage}")
+        self.handlers[job_type] = {"stage": stage, "handler": handler, "on_failure": on_failure}
+
+    def queue_depth(self, db):
+        """
+        Number of jobs waiting or running
+        """
+        return db.query(ProcessingJob).filter(ProcessingJob.status.in_(["queued", "running"])).count()
+
+    def check_capacity(self, db, incoming=1):
+        """
+        Raise QueueFullError if accepting `incoming` more jobs would overload the queue
+        """
+        if self.queue_depth(db) + incoming > Config.JOB_QUEUE_MAX_DEPTH:
+            raise QueueFullError("Document processing queue is full, please retry shortly")
+
+    def enqueue(self, db, document_id, job_type, payload=None, priority=0, delay_seconds=0):
+        """
+        Add a job to the session; it becomes visible to workers when the caller commits
+
+        Returns:
+            The new ProcessingJob
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"No handler registered for job type: {job_type}")
+
+        stage = self.handlers[job_type]["stage"]
+        job = ProcessingJob(
+            document_id=document_id,
+            job_type=job_type,
+            stage=stage,
+            status="queued",
+            priority=priority,
+            payload=json.dumps(payload) if payload is not None else None,
+            max_attempts=Config.JOB_MAX_ATTEMPTS,
+            run_after=datetime.utcnow() + timedelta(seconds=delay_seconds)
+        )
+        db.add(job)
+        self._wakeups[stage].set()
+        return job
+
+    def start(self):
+        """
+        Recover interrupted jobs and start the worker threads
+        """
+        if self._threads:
+            return
+        self._stop.clear()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.recover_interrupted_jobs()
+
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+
+        for stage, limit in self.stage_limits.items():
+            for i in range(limit):
+                worker_id = f"{self.owner}/{stage}-{i}"
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    args=(stage, worker_id),
+                    name=f"job-worker-{stage}-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+        logger.info(f"Started job workers: {self.stage_limits}")
+
+    def stop(self, timeout=10):
+        """
+        Signal workers to stop and wait for running jobs to finish
+        """
+        self._stop.set()
+        for event in self._wakeups.values():
+            event.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def _is_orphaned(self, locked_by, last_seen, stale_before):
+        """
+        Whether a running job's owner is gone
+        """
+        owner = (locked_by or "").split("/", 1)[0]
+        if self.owner and owner == self.owner:
+            return False
+        if last_seen is None or last_seen < stale_before:
+            return True
+
+        parts = owner.split(":")
+        if len(parts) != 3 or parts[0] != socket.gethostname() or not parts[1].isdigit():
+            # Another host (or an old lock format): only the heartbeat can tell
+            return False
+        pid = int(parts[1])
+        if pid == os.getpid():
+            # Our pid but another boot id: an earlier run of this process
+            return True
+        return not _process_alive(pid)
+
+    def recover_interrupted_jobs(self):
+        """
+        Put running jobs whose owner is gone back in the queue
+
+        A job is recovered when its owning process on this host no longer
+        exists, or when no heartbeat has been seen for Config.JOB_STALE_SECONDS
+        (owners on other hosts, or hung processes).
+        """
+        db = self.session_factory()
+        try:
+            stale_before = datetime.utcnow() - timedelta(seconds=Config.JOB_STALE_SECONDS)
+            running = db.query(
+                ProcessingJob.id, ProcessingJob.locked_by, ProcessingJob.locked_at, ProcessingJob.heartbeat_at
+            ).filter(ProcessingJob.status == "running").all()
+
+            recovered = 0
+            for job in running:
+                if not self._is_orphaned(job.locked_by, job.heartbeat_at or job.locked_at, stale_before):
+                    continue
+                # Only if the same owner still holds it, so a fresh claim is left alone
+                recovered += db.query(ProcessingJob).filter(
+                    ProcessingJob.id == job.id,
+                    ProcessingJob.status == "running",
+                    ProcessingJob.locked_by == job.locked_by
+                ).update(
+                    {
+                        ProcessingJob.status: "queued",
+                        ProcessingJob.locked_by: None,
+                        ProcessingJob.locked_at: None,
+                        ProcessingJob.heartbeat_at: None
+                    },
+                    synchronize_session=False
+                )
+            db.commit()
+            if recovered:
+                logger.info(f"Re-queued {recovered} interrupted jobs")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error recovering interrupted jobs: {str(e)}", exc_info=True)
+        finally:
+            db.close()
+
+    def _heartbeat_loop(self):
+        """
+        Refresh the heartbeat of this process's running jobs and recover
+        jobs abandoned by other processes
+        """
+        while not self._stop.wait(Config.JOB_HEARTBEAT_SECONDS):
+            db = self.session_factory()
+            try:
+                db.query(ProcessingJob).filter(
+                    ProcessingJob.status == "running",
+                    ProcessingJob.locked_by.like(f"{self.owner}/%")
+                ).update({ProcessingJob.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error refreshing job heartbeats: {str(e)}", exc_info=True)
+            finally:
+                db.close()
+            self.recover_interrupted_jobs()
+
+    def _worker_loop(self, stage, worker_id):
+        wakeup = self._wakeups[stage]
+        while not self._stop.is_set():
+            try:
+                ran_job = self._run_next(stage, worker_id)
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} error: {str(e)}", exc_info=True)
+                ran_job = False
+
+            if not ran_job:
+                wakeup.wait(Config.JOB_POLL_INTERVAL_SECONDS)
+                wakeup.clear()
+
+    def _claim(self, db, stage, worker_id):
+        """
+        Atomically claim the next runnable job for a stage
+
+        The conditional UPDATE only succeeds for one worker, so two workers that
+        pick the same candidate cannot both run it.
+        """
+        job_types = [name for name, spec in self.handlers.items() if spec["stage"] == stage]
+        if not job_types:
+            return None
+
+        candidate = db.query(ProcessingJob.id).filter(
+            ProcessingJob.status == "queued",
+            ProcessingJob.stage == stage,
+            ProcessingJob.job_type.in_(job_types),
+            ProcessingJob.run_after <= datetime.utcnow()
+        ).order_by(ProcessingJob.priority, ProcessingJob.id).first()
+
+        if not candidate:
+            return None
+
+        claimed = db.query(ProcessingJob).filter(
+            ProcessingJob.id == candidate.id,
+            ProcessingJob.status == "queued"
+        ).update(
+            {
+                ProcessingJob.status: "running",
+                ProcessingJob.locked_by: worker_id,
+                ProcessingJob.locked_at: datetime.utcnow(),
+                ProcessingJob.heartbeat_at: datetime.utcnow(),
+                ProcessingJob.attempts: ProcessingJob.attempts + 1
+            },
+            synchronize_session=False
+        )
+        db.commit()
+
+        if claimed != 1:
+            return None
+        return db.query(ProcessingJob).filter(ProcessingJob.id == candidate.id).first()
+
+    def _run_next(self, stage, worker_id):
+        db = self.session_factory()
+        try:
+            job = self._claim(db, stage, worker_id)
+            if not job:
+                return False
+
+            spec = self.handlers[job.job_type]
+            job_id, job_type, document_id = job.id, job.job_type, job.document_id
+            try:
+                spec["handler"](db, job)
+                # Finished jobs are removed; the table only holds outstanding work
+                db.delete(job)
+                db.commit()
+                logger.info(f"Job {job_id} ({job_type}) for document {document_id} done")
+            except JobDeferred as e:
+                db.rollback()
+                self._defer(db, job_id, e.delay_seconds)
+            except Exception as e:
+                db.rollback()
+                self._handle_failure(db, job_id, spec, e)
+            return True
+        finally:
+            db.close()
+
+    def _defer(self, db, job_id, delay_seconds):
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        if not job:
+            return
+        job.status = "queued"
+        job.attempts = max(job.attempts - 1, 0)
+        job.locked_by = None
+        job.locked_at = None
+        job.heartbeat_at = None
+        job.run_after = datetime.utcnow() + timedelta(seconds=delay_seconds)
+        db.commit()
+
+    def _handle_failure(self, db, job_id, spec, error):
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        if not job:
+            return
+
+        job.last_error = str(error)
+        job.locked_by = None
+        job.locked_at = None
+        job.heartbeat_at = None
+
+        if job.attempts < job.max_attempts:
+            delay = min(Config.JOB_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1)), Config.JOB_RETRY_MAX_SECONDS)
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+            logger.warning(f"Job {job.id} ({job.job_type}) failed on attempt {job.attempts}, retrying in {delay}s: {str(error)}")
+        else:
+            job.status = "failed"
+            logger.error(f"Job {job.id} ({job.job_type}) failed permanently: {str(error)}")
+            if spec["on_failure"]:
+                try:
+                    spec["on_failure"](db, job)
+                except Exception as e:
+                    logger.error(f"Error in failure hook for job {job.id}: {str(e)}", exc_info=True)
+
+        db.commit()
+
+
+job_queue = JobQueue()
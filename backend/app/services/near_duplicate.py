@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import math
+import threading
+from collections import Counter
+from config import Config
+from .text_vectorizer import HashingVectorizer
+from ..models.document import Document, ParsedContent
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+
+
+def simhash(text, shingle_size=2):
+    """
+    64-bit simhash of a text over word shingles
+
+    Each shingle's hash votes on every bit, weighted by its (sublinear) count.
+    Texts that share most of their shingles, such as two OCR runs of the same
+    statement, end up a few bits apart.
+
+    Returns:
+        Unsigned 64-bit fingerprint, or None if the text is too short to fingerprint reliably
+    """
+    tokens = HashingVectorizer.tokenize(text)
+    if len(tokens) < Config.NEAR_DUPLICATE_MIN_TOKENS:
+        return None
+
+    shingles = Counter(
+        " ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)
+    )
+    weights = [0.0] * FINGERPRINT_BITS
+    for shingle, count in shingles.items():
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        weight = 1.0 + math.log(count)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += weight if (h >> bit) & 1 else -weight
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def to_signed(fingerprint):
+    """
+    Store an unsigned 64-bit fingerprint in SQLite's signed INTEGER
+    """
+    if fingerprint is None:
+        return None
+    return fingerprint - (1 << 64) if fingerprint >= (1 << 63) else fingerprint
+
+
+def to_unsigned(value):
+    if value is None:
+        return None
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class NearDuplicateIndex:
+    """
+    In-memory banded index of document simhashes
+
+    The 64 bits are split into max_distance + 1 bands. Two fingerprints within
+    max_distance bits of each other must agree exactly on at least one band,
+    so a lookup only compares against documents sharing a band value instead
+    of scanning every fingerprint.
+    """
+
+    def __init__(self, max_distance=None):
+        self.max_distance = Config.NEAR_DUPLICATE_MAX_DISTANCE if max_distance is None else max_distance
+        bands = self.max_distance + 1
+        widths = [FINGERPRINT_BITS // bands + (1 if i < FINGERPRINT_BITS % bands else 0) for i in range(bands)]
+        self._bands = []
+        offset = 0
+        for width in widths:
+            self._bands.append((offset, (1 << width) - 1))
+            offset += width
+
+        self._tables = [{} for _ in self._bands]
+        self._fingerprints = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _band_values(self, fingerprint):
+        return [(fingerprint >> offset) & mask for offset, mask in self._bands]
+
+    def ensure_loaded(self, db):
+        """
+        Build the index from the stored fingerprints on first use
+        """
+        if self._loaded:
+            return
+        rows = db.query(ParsedContent.document_id, ParsedContent.simhash).join(
+            Document, Document.current_parse_id == ParsedContent.id
+        ).filter(
+            ParsedContent.simhash.isnot(None)
+        ).all()
+        with self._lock:
+            if self._loaded:
+                return
+            for document_id, value in rows:
+                self._add(document_id, to_unsigned(value))
+            self._loaded = True
+        logger.info(f"Loaded {len(rows)} document fingerprints into the near-duplicate index")
+
+    def add(self, document_id, fingerprint):
+        with self._lock:
+            self._add(document_id, fingerprint)
+
+    def _add(self, document_id, fingerprint):
+        self._remove(document_id)
+        self._fingerprints[document_id] = fingerprint
+        for table, value in zip(self._tables, self._band_values(fingerprint)):
+            table.setdefault(value, set()).add(document_id)
+
+    def remove(self, document_id):
+        with self._lock:
+            self._remove(document_id)
+
+    def _remove(self, document_id):
+        fingerprint = self._fingerprints.pop(document_id, None)
+        if fingerprint is None:
+            return
+        for table, value in zip(self._tables, self._band_values(fingerprint)):
+            bucket = table.get(value)
+            if bucket:
+                bucket.discard(document_id)
+                if not bucket:
+                    del table[value]
+
+    def query(self, fingerprint, exclude=None):
+        """
+        Find documents whose fingerprint is within max_distance bits
+
+        Returns:
+            List of (document_id, distance), nearest first
+        """
+        with self._lock:
+            candidates = set()
+            for table, value in zip(self._tables, self._band_values(fingerprint)):
+                candidates.update(table.get(value, ()))
+            candidates.discard(exclude)
+
+            matches = []
+            for document_id in candidates:
+                distance = hamming_distance(fingerprint, self._fingerprints[document_id])
+                if distance <= self.max_distance:
+                    matches.append((document_id, distance))
+        return sorted(matches, key=lambda match: (match[1], match[0]))
+
+
+near_duplicate_index = NearDuplicateIndex()
@@ -1,61 +1,474 @@
 import os
+import re
+import json
+import hashlib
+import time
+import subprocess
+import threading
 import pytesseract
 from PIL import Image
 import pdf2image
 import tempfile
-import pandas as pd
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from config import Config
+from .ocr_preprocessing import ImagePreprocessor
+from .spreadsheet_ingest import SpreadsheetIngestor
+from .table_reconstruction import parse_tsv, words_from_data, words_to_text, words_from_layout, reconstruct_tables
 
 logger = logging.getLogger(__name__)
 
+# Bump when a code change alters extracted text, so stored parses are redone
+PARSER_VERSION = 1
+
+# Settings that change what a document's extracted text looks like
+ENGINE_SETTINGS = [
+    "OCR_ENGINE", "OCR_LANG", "OCR_PSM", "OCR_OEM", "OCR_DPI", "OCR_GRAYSCALE",
+    "OCR_PREPROCESS_STEPS", "OCR_MIN_IMAGE_SIDE", "OCR_MAX_IMAGE_SIDE", "OCR_TABLES_ENABLED",
+    "PDF_TEXT_LAYER_ENABLED", "PDF_TEXT_LAYER_MIN_CHARS", "PDF_TEXT_LAYER_MIN_CHARS_WITH_IMAGE",
+    "PERIOD_DETECTION_PAGES", "SPREADSHEET_PREVIEW_ROWS", "SPREADSHEET_TAIL_ROWS", "SPREADSHEET_PREVIEW_COLUMNS",
+]
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+_ocr_engines = threading.local()
+
+
+class PytesseractEngine:
+    """
+    OCR through the tesseract CLI (one subprocess and temp image file per call)
+    """
+    name = "pytesseract"
+
+    def __init__(self, lang, psm=None, oem=None):
+        self.lang = lang
+        self.config = " ".join(
+            option for option in (f"--psm {psm}" if psm is not None else "", f"--oem {oem}" if oem is not None else "") if option
+        )
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, lang=self.lang, config=self.config)
+
+    def recognize(self, image):
+        """
+        Text and word boxes from a single tesseract run
+
+        Returns:
+            Tuple of (text, list of word dicts)
+        """
+        data = pytesseract.image_to_data(image, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT)
+        words = words_from_data(data)
+        return words_to_text(words), words
+
+
+class TesserocrEngine:
+    """
+    OCR through a long-lived libtesseract handle (tesserocr)
+
+    Language data is loaded once when the handle is created and images are
+    passed in memory, which removes the per-page process start-up cost.
+    """
+    name = "tesserocr"
+
+    def __init__(self, lang, psm=None, oem=None):
+        import tesserocr
+        self.lang = lang
+        options = {"lang": lang}
+        if psm is not None:
+            options["psm"] = psm
+        if oem is not None:
+            options["oem"] = oem
+        self._api = tesserocr.PyTessBaseAPI(**options)
+
+    def image_to_string(self, image):
+        self._api.SetImage(image)
+        return self._api.GetUTF8Text()
+
+    def recognize(self, image):
+        """
+        Text and word boxes; the TSV is read from the same recognition pass
+
+        Returns:
+            Tuple of (text, list of word dicts)
+        """
+        self._api.SetImage(image)
+        text = self._api.GetUTF8Text()
+        return text, parse_tsv(self._api.GetTSVText(0))
+
+
+def get_ocr_engine(name=None):
+    """
+    OCR engine for the current thread, created once and reused
+
+    Args:
+        name: "tesserocr", "pytesseract" or "auto" (defaults to Config.OCR_ENGINE);
+              "auto" uses tesserocr when it is installed
+
+    Returns:
+        Engine with image_to_string(image) and recognize(image) methods
+    """
+    name = name or Config.OCR_ENGINE
+    engines = getattr(_ocr_engines, "engines", None)
+    if engines is None:
+        engines = _ocr_engines.engines = {}
+
+    if name not in engines:
+        engine = None
+        if name in ("auto", "tesserocr"):
+            try:
+                engine = TesserocrEngine(Config.OCR_LANG, Config.OCR_PSM, Config.OCR_OEM)
+            except Exception as e:
+                # ImportError when tesserocr isn't installed, RuntimeError when tessdata can't be loaded
+                log = logger.warning if name == "tesserocr" else logger.info
+                log(f"tesserocr engine unavailable, using pytesseract: {str(e)}")
+        if engine is None:
+            engine = PytesseractEngine(Config.OCR_LANG, Config.OCR_PSM, Config.OCR_OEM)
+        engines[name] = engine
+    return engines[name]
+
+
+def _ocr_image(image, page_number):
+    """
+    OCR a preprocessed page image, rebuilding its table from the word boxes
+    when Config.OCR_TABLES_ENABLED
+
+    Returns:
+        Dict with text and tables
+    """
+    engine = get_ocr_engine()
+    if not Config.OCR_TABLES_ENABLED:
+        return {"text": engine.image_to_string(image), "tables": []}
+    text, words = engine.recognize(image)
+    return {"text": text, "tables": reconstruct_tables(words, page_number)}
+
+
+def _ocr_worker_count():
+    return Config.OCR_WORKERS or os.cpu_count() or 1
+
+
+def _init_ocr_worker():
+    # One tesseract per core already saturates the host; stop each one from
+    # spawning its own OpenMP threads on top of that
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _get_ocr_pool():
+    """
+    Process pool shared by every OCR job in this process, created on first use
+    """
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=_ocr_worker_count(), initializer=_init_ocr_worker)
+        return _ocr_pool
+
+
+def _ocr_page_range(pdf_path, first_page, last_page, options):
+    """
+    Rasterize and OCR a range of PDF pages (runs in a pool worker)
+
+    Pages are rendered to a temporary directory in one pdftoppm call and then
+    loaded one at a time, so only a single page image is held in memory.
+
+    Returns:
+        List of page result dicts in page order
+    """
+    results = []
+    preprocessor = ImagePreprocessor()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.perf_counter()
+        image_paths = pdf2image.convert_from_path(
+            pdf_path,
+            dpi=options["dpi"],
+            first_page=first_page,
+            last_page=last_page,
+            grayscale=options["grayscale"],
+            thread_count=options["thread_count"],
+            output_folder=temp_dir,
+            paths_only=True
+        )
+        render_ms = (time.perf_counter() - start) * 1000 / max(len(image_paths), 1)
+
+        for page_number, image_path in enumerate(sorted(image_paths), first_page):
+            with Image.open(image_path) as img:
+                image, preprocess_timings = preprocessor.process(img, source_dpi=options["dpi"])
+                start = time.perf_counter()
+                recognized = _ocr_image(image, page_number)
+            results.append({
+                "page": page_number,
+                **recognized,
+                "method": "ocr",
+                "render_ms": round(render_ms, 1),
+                **preprocess_timings,
+                "ocr_ms": round((time.perf_counter() - start) * 1000, 1)
+            })
+            os.remove(image_path)
+    return results
+
 class OCRService:
     """
     Service for extracting text from various document formats (PDF, images, Excel, etc.)
     """
     
     @staticmethod
-    def process_document(file_path):
+    def engine_fingerprint():
+        """
+        Hash of the parser version and the settings that shape extracted text
+
+        Two runs over the same file with the same fingerprint produce the same
+        text, so the second one can be skipped.
+        """
+        settings = {name: getattr(Config, name, None) for name in ENGINE_SETTINGS}
+        settings["parser_version"] = PARSER_VERSION
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def process_document(file_path, raise_errors=False):
         """
         Process a document based on its file type and return markdown text
+
+        Errors are returned as text unless raise_errors is set, in which case
+        they propagate so the caller (e.g. a retrying job) can handle them.
         """
-        file_ext = Path(file_path).suffix.lower()
-        
         try:
-            if file_ext in ['.pdf']:
-                return OCRService.process_pdf(file_path)
-            elif file_ext in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp']:
-                return OCRService.process_image(file_path)
-            elif file_ext in ['.xlsx', '.xls']:
-                return OCRService.process_excel(file_path)
-            elif file_ext in ['.csv']:
-                return OCRService.process_csv(file_path)
-            else:
-                return f"Unsupported file format: {file_ext}"
+            return OCRService.extract_document(file_path)["markdown"]
         except Exception as e:
             logger.error(f"Error processing file {file_path}: {str(e)}", exc_info=True)
+            if raise_errors:
+                raise
             return f"Error processing document: {str(e)}"
+
+    @staticmethod
+    def extract_document(file_path, first_page=1, last_page=None):
+        """
+        Extract a document and report how each page was processed
+
+        Args:
+            file_path: Path to the document
+            first_page: First page to extract (1-based); only PDFs have more than one page
+            last_page: Last page to extract, defaults to the end of the document
+
+        Returns:
+            Dict with "markdown", "pages" (per-page method and timings, plus
+            the "tables" rebuilt on each page) and "page_count" (total pages
+            in the document)
+        """
+        file_ext = Path(file_path).suffix.lower()
+
+        if file_ext in ['.pdf']:
+            page_count = OCRService.get_pdf_page_count(file_path)
+            pages = OCRService.extract_pdf_pages(file_path, first_page, last_page, page_count=page_count)
+            return {"markdown": OCRService.pages_to_markdown(pages), "pages": pages, "page_count": page_count}
+
+        # Everything else is extracted as a single page
+        if first_page > 1:
+            return {"markdown": "", "pages": [], "page_count": 1}
+
+        if file_ext in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp']:
+            page = OCRService.extract_image(file_path)
+            return {"markdown": f"# Image Content\n\n{page['text']}", "pages": [page], "page_count": 1}
+
+        if file_ext not in ['.xlsx', '.xls', '.csv']:
+            return {"markdown": f"Unsupported file format: {file_ext}", "pages": [], "page_count": 1}
+
+        start = time.perf_counter()
+        result = SpreadsheetIngestor().ingest(file_path)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        return {
+            "markdown": result["markdown"],
+            "pages": [{
+                "page": 1,
+                "method": "spreadsheet",
+                "elapsed_ms": elapsed_ms,
+                "rows": result["rows"],
+                "sheets": len(result["tables"])
+            }],
+            "page_count": 1
+        }
     
     @staticmethod
     def process_pdf(pdf_path):
         """
-        Convert PDF to images and extract text
+        Extract text from every page of a PDF and return markdown
         """
         try:
-            # Convert PDF to images
-            with tempfile.TemporaryDirectory() as temp_dir:
-                images = pdf2image.convert_from_path(pdf_path)
-                extracted_text = ""
-                
-                # Extract text from each page
-                for i, img in enumerate(images):
-                    page_text = pytesseract.image_to_string(img)
-                    extracted_text += f"## Page {i+1}\n\n{page_text}\n\n"
-                
-                return extracted_text
+            pages = OCRService.extract_pdf_pages(pdf_path)
+            return OCRService.pages_to_markdown(pages)
         except Exception as e:
             logger.error(f"Error processing PDF: {str(e)}", exc_info=True)
             raise
+
+    @staticmethod
+    def extract_pdf_pages(pdf_path, first_page=1, last_page=None, page_count=None):
+        """
+        Extract text from a range of PDF pages
+
+        Pages with a usable embedded text layer (digitally generated PDFs) are
+        read directly; only the remaining, scanned pages are rasterized and
+        OCRed, in chunks of OCR_PAGES_PER_TASK pages across a process pool sized
+        to the host's cores.
+
+        Args:
+            pdf_path: Path to the PDF
+            first_page: First page to process (1-based)
+            last_page: Last page to process, defaults to the last page of the PDF
+            page_count: Total pages in the PDF, if the caller already knows it
+
+        Returns:
+            List of dicts with page, text, method ("text_layer" or "ocr") and timings, in page order
+        """
+        page_count = page_count or OCRService.get_pdf_page_count(pdf_path)
+        last_page = min(last_page or page_count, page_count)
+        if first_page > last_page:
+            return []
+
+        start = time.perf_counter()
+        pages = {}
+        if Config.PDF_TEXT_LAYER_ENABLED:
+            pages = OCRService.extract_text_layer_pages(pdf_path, first_page, last_page)
+
+        options = {
+            "dpi": Config.OCR_DPI,
+            "grayscale": Config.OCR_GRAYSCALE,
+            "thread_count": Config.OCR_RENDER_THREADS
+        }
+        ocr_page_numbers = [n for n in range(first_page, last_page + 1) if n not in pages]
+        ranges = OCRService._page_ranges(ocr_page_numbers, max(Config.OCR_PAGES_PER_TASK, 1))
+
+        if _ocr_worker_count() == 1 or len(ranges) <= 1:
+            chunks = [_ocr_page_range(pdf_path, first, last, options) for first, last in ranges]
+        else:
+            pool = _get_ocr_pool()
+            futures = [pool.submit(_ocr_page_range, pdf_path, first, last, options) for first, last in ranges]
+            chunks = [future.result() for future in futures]
+
+        for chunk_pages in chunks:
+            for page in chunk_pages:
+                pages[page["page"]] = page
+
+        ordered = [pages[n] for n in sorted(pages)]
+        total_ms = (time.perf_counter() - start) * 1000
+        logger.info(
+            f"Extracted {len(ordered)} pages from {pdf_path} in {total_ms:.0f} ms "
+            f"({len(ordered) - len(ocr_page_numbers)} text layer, {len(ocr_page_numbers)} OCR)"
+        )
+        for page in ordered:
+            logger.debug(f"Page {page['page']}: {page['method']} {({k: v for k, v in page.items() if k.endswith('_ms')})}")
+        return ordered
+
+    @staticmethod
+    def _page_ranges(page_numbers, chunk):
+        """
+        Group sorted page numbers into contiguous ranges of at most `chunk` pages
+        """
+        ranges = []
+        for n in page_numbers:
+            if ranges and ranges[-1][1] == n - 1 and ranges[-1][1] - ranges[-1][0] + 1 < chunk:
+                ranges[-1] = (ranges[-1][0], n)
+            else:
+                ranges.append((n, n))
+        return ranges
+
+    @staticmethod
+    def extract_text_layer_pages(pdf_path, first_page, last_page):
+        """
+        Read the embedded text layer of a PDF with poppler's pdftotext
+
+        `-layout` keeps the column alignment of tables. A page is only accepted
+        when its text looks complete: enough readable characters, no encoding
+        garbage, and not a full-page scan with just a few words of text on top.
+
+        Returns:
+            Dict of page number -> page result for pages that can skip OCR
+        """
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(
+                ["pdftotext", "-layout", "-enc", "UTF-8", "-f", str(first_page), "-l", str(last_page), pdf_path, "-"],
+                capture_output=True,
+                timeout=Config.PDF_TEXT_LAYER_TIMEOUT_SECONDS,
+                check=True
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not read text layer of {pdf_path}, falling back to OCR: {str(e)}")
+            return {}
+
+        # pdftotext ends every page with a form feed
+        texts = result.stdout.decode("utf-8", errors="replace").split("\f")
+        scanned_pages = OCRService._pages_with_full_page_images(pdf_path, first_page, last_page)
+        per_page_ms = round((time.perf_counter() - start) * 1000 / (last_page - first_page + 1), 1)
+
+        pages = {}
+        for page_number, text in zip(range(first_page, last_page + 1), texts):
+            if OCRService._is_usable_text_layer(text, page_number in scanned_pages):
+                pages[page_number] = {
+                    "page": page_number,
+                    "text": text.rstrip(),
+                    "tables": reconstruct_tables(words_from_layout(text), page_number) if Config.OCR_TABLES_ENABLED else [],
+                    "method": "text_layer",
+                    "text_layer_ms": per_page_ms
+                }
+        return pages
+
+    @staticmethod
+    def _is_usable_text_layer(text, has_page_image):
+        visible = re.sub(r"\s+", "", text)
+        if len(visible) < Config.PDF_TEXT_LAYER_MIN_CHARS:
+            return False
+
+        # Broken font encodings come out as replacement characters or symbol soup
+        readable = sum(1 for c in visible if c.isalnum() or c in ".,:;/-()%$&'\"@#*+=")
+        if visible.count("\ufffd") > 0 or readable / len(visible) < 0.8:
+            return False
+
+        # A scanned page with a stamped header still needs OCR for the body
+        if has_page_image and len(visible) < Config.PDF_TEXT_LAYER_MIN_CHARS_WITH_IMAGE:
+            return False
+        return True
+
+    @staticmethod
+    def _pages_with_full_page_images(pdf_path, first_page, last_page):
+        """
+        Pages that contain a large raster image (likely a scan), via pdfimages -list
+        """
+        try:
+            result = subprocess.run(
+                ["pdfimages", "-list", "-f", str(first_page), "-l", str(last_page), pdf_path],
+                capture_output=True,
+                timeout=Config.PDF_TEXT_LAYER_TIMEOUT_SECONDS,
+                check=True
+            )
+        except (OSError, subprocess.SubprocessError):
+            return set()
+
+        pages = set()
+        # Columns: page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+        for line in result.stdout.decode("utf-8", errors="replace").splitlines()[2:]:
+            parts = line.split()
+            if len(parts) < 5 or not parts[0].isdigit():
+                continue
+            try:
+                width, height = int(parts[3]), int(parts[4])
+            except ValueError:
+                continue
+            if width * height >= 1_000_000:
+                pages.add(int(parts[0]))
+        return pages
+
+    @staticmethod
+    def get_pdf_page_count(pdf_path):
+        """
+        Number of pages in a PDF
+        """
+        return int(pdf2image.pdfinfo_from_path(pdf_path)["Pages"])
+
+    @staticmethod
+    def pages_to_markdown(pages):
+        """
+        Join page results into the markdown layout used for parsed content
+        """
+        return "".join(f"## Page {page['page']}\n\n{page['text']}\n\n" for page in pages)
     
     @staticmethod
     def process_image(image_path):
@@ -63,32 +476,44 @@ class OCRService:
         Extract text from an image
         """
         try:
-            img = Image.open(image_path)
-            text = pytesseract.image_to_string(img)
-            return f"# Image Content\n\n{text}"
+            page = OCRService.extract_image(image_path)
+            return f"# Image Content\n\n{page['text']}"
         except Exception as e:
             logger.error(f"Error processing image: {str(e)}", exc_info=True)
             raise
+
+    @staticmethod
+    def extract_image(image_path):
+        """
+        Preprocess and OCR an image (photo or scan)
+
+        Returns:
+            Page result dict with text and per-stage timings
+        """
+        with Image.open(image_path) as img:
+            # Photos carry an unreliable DPI, so only trust it for scans (TIFF)
+            source_dpi = img.info.get("dpi", (None,))[0] if Path(image_path).suffix.lower() in ['.tiff', '.tif'] else None
+            image, preprocess_timings = ImagePreprocessor().process(img, source_dpi=source_dpi)
+            start = time.perf_counter()
+            recognized = _ocr_image(image, 1)
+        return {
+            "page": 1,
+            **recognized,
+            "method": "ocr",
+            **preprocess_timings,
+            "ocr_ms": round((time.perf_counter() - start) * 1000, 1)
+        }
     
     @staticmethod
     def process_excel(excel_path):
         """
         Convert Excel file to markdown
+
+        The markdown is a bounded preview of each sheet; the full data is
+        written to the Parquet side store (see spreadsheet_ingest).
         """
         try:
-            # Read Excel file
-            xl = pd.ExcelFile(excel_path)
-            result = "# Excel Content\n\n"
-            
-            # Process each sheet
-            for sheet_name in xl.sheet_names:
-                df = xl.parse(sheet_name)
-                result += f"## Sheet: {sheet_name}\n\n"
-                
-                # Convert to markdown table
-                result += df.to_markdown(index=False) + "\n\n"
-            
-            return result
+            return SpreadsheetIngestor().ingest(excel_path)["markdown"]
         except Exception as e:
             logger.error(f"Error processing Excel: {str(e)}", exc_info=True)
             raise
@@ -97,12 +522,12 @@ class OCRService:
     def process_csv(csv_path):
         """
         Convert CSV file to markdown
+
+        The markdown is a bounded preview; the full data is written to the
+        Parquet side store (see spreadsheet_ingest).
         """
         try:
-            df = pd.read_csv(csv_path)
-            result = "# CSV Content\n\n"
-            result += df.to_markdown(index=False)
-            return result
+            return SpreadsheetIngestor().ingest(csv_path)["markdown"]
         except Exception as e:
             logger.error(f"Error processing CSV: {str(e)}", exc_info=True)
-            raise 
\ No newline at end of file
+            raise 
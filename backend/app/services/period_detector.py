@@ -0,0 +1,260 @@
+import os
+import re
+from collections import Counter
+from datetime import datetime
+
+# Only the start of a document is scanned; the reporting period is stated near the top
+SCAN_CHARS = 6000
+
+MONTHS = {
+    # English
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+    "september": 9, "sept": 9, "sep": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+    # Malay
+    "januari": 1, "februari": 2, "mac": 3, "mei": 5, "julai": 7, "ogos": 8, "ogo": 8,
+    "oktober": 10, "okt": 10, "disember": 12, "dis": 12,
+}
+MONTH = "(?:" + "|".join(sorted(MONTHS, key=len, reverse=True)) + ")"
+
+# Date forms, most specific first; all capture groups are named
+DATE_PATTERNS = [
+    re.compile(rf"\b(?P<day>\d{{1,2}})(?:st|nd|rd|th)?[\s\-/.]*(?P<mon>{MONTH})\.?[\s\-/.,]+(?P<year>\d{{4}})\b"),
+    re.compile(rf"\b(?P<mon>{MONTH})\.?\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?,?\s+(?P<year>\d{{4}})\b"),
+    re.compile(r"\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b"),
+    re.compile(r"\b(?P<day>\d{1,2})[/\-.](?P<month>\d{1,2})[/\-.](?P<year>\d{4})\b"),  # day first, as written in Malaysia
+    re.compile(rf"\b(?P<mon>{MONTH})\.?[\s\-/.,']*(?P<year>\d{{4}})\b"),
+    re.compile(r"\b(?P<month>0?[1-9]|1[0-2])[/\-.](?P<year>\d{4})\b"),
+]
+
+FILENAME_PATTERNS = [
+    re.compile(r"(?<!\d)(?P<year>(?:19|20)\d{2})[-_. ]?(?P<month>0[1-9]|1[0-2])(?!\d)"),
+    re.compile(r"(?<!\d)(?P<month>0?[1-9]|1[0-2])[-_. ](?P<year>(?:19|20)\d{2})(?!\d)"),
+    re.compile(rf"(?<![a-z])(?P<mon>{MONTH})[-_. ]?(?P<year>(?:19|20)\d{{2}})(?!\d)"),
+    re.compile(rf"(?<!\d)(?P<year>(?:19|20)\d{{2}})[-_. ]?(?P<mon>{MONTH})(?![a-z])"),
+]
+
+# Phrases immediately before a date that say what the date means, with the
+# number of months the period covers (0 = whole financial year) and confidence
+PERIOD_PHRASES = [
+    ("month ended", re.compile(r"(?:month|bulan)\s+(?:ended|ending|berakhir)\s*(?:on|pada)?\s*:?\s*$"), 1, 95),
+    ("quarter ended", re.compile(r"(?:quarter|three\s+months|3\s+months|suku\s+tahun|tiga\s+bulan)\s+(?:ended|ending|berakhir)\s*(?:on|pada)?\s*:?\s*$"), 3, 90),
+    ("half year ended", re.compile(r"(?:half[\s\-]year|six\s+months|6\s+months|separuh\s+tahun|enam\s+bulan)\s+(?:ended|ending|berakhir)\s*(?:on|pada)?\s*:?\s*$"), 6, 85),
+    ("year ended", re.compile(r"(?:year|tahun)(?:\s+(?:kewangan|taksiran))?\s+(?:ended|ending|berakhir)\s*(?:on|pada)?\s*:?\s*$"), 0, 90),
+    ("statement date", re.compile(r"(?:statement\s+(?:date|period|month)|tarikh\s+penyata|bulan\s+penyata|for\s+the\s+month\s+of|bagi\s+bulan)\s*:?\s*$"), 1, 90),
+]
+RANGE_CONNECTOR = re.compile(r"^\s*(?:-|–|—|to|until|hingga|sehingga|sampai)\s*$")
+
+DOCUMENT_TYPES = [
+    ("bank statement", ["bank statement", "statement of account", "penyata akaun", "penyata bank",
+                        "opening balance", "closing balance", "baki awal", "baki akhir", "account summary"]),
+    ("income statement", ["income statement", "profit and loss", "profit & loss", "statement of comprehensive income",
+                          "penyata pendapatan", "untung rugi", "untung dan rugi"]),
+    ("balance sheet", ["balance sheet", "statement of financial position", "kunci kira-kira",
+                       "penyata kedudukan kewangan"]),
+    ("cash flow statement", ["cash flow statement", "statement of cash flows", "penyata aliran tunai"]),
+    ("invoice", ["tax invoice", "invoice no", "invoice number", "invois", "bill to"]),
+    ("receipt", ["official receipt", "receipt no", "resit rasmi", "resit no", "payment received"]),
+    ("payslip", ["payslip", "pay slip", "salary slip", "slip gaji", "penyata gaji"]),
+    ("tax document", ["lhdn", "inland revenue", "income tax", "borang", "sst", "cukai"]),
+    ("sales report", ["sales report", "sales summary", "laporan jualan"]),
+]
+
+# Evidence strengths (percent). These are starting points; tune them against
+# documents tagged by the LLM and corrected by users so that a reported
+# confidence of N means the periods are right about N% of the time.
+# A filename alone stays below Config.LOCAL_DETECTION_MIN_CONFIDENCE, so the LLM
+# still decides unless the dates in the text agree with it.
+FILENAME_CONFIDENCE = 70
+FILENAME_CONFIRMED_CONFIDENCE = 88
+DOMINANT_MONTH_CONFIDENCE = 85
+AGREEMENT_BONUS = 10
+CONFLICT_PENALTY = 25
+
+
+class DatePhrase:
+    __slots__ = ("start", "end", "year", "month", "day")
+
+    def __init__(self, start, end, year, month, day):
+        self.start, self.end, self.year, self.month, self.day = start, end, year, month, day
+
+
+def _valid_year(year):
+    return 1990 <= year <= datetime.now().year + 1
+
+
+def _match_date(match):
+    groups = match.groupdict()
+    year = int(groups["year"])
+    month = MONTHS[groups["mon"].lower()] if groups.get("mon") else int(groups["month"])
+    day = int(groups["day"]) if groups.get("day") else None
+    if not _valid_year(year) or not 1 <= month <= 12 or (day is not None and not 1 <= day <= 31):
+        return None
+    return year, month, day
+
+
+def find_dates(text):
+    """
+    Find date mentions in lowercase text
+
+    Returns:
+        List of DatePhrase in text order; overlapping matches keep the most specific form
+    """
+    taken = []
+    dates = []
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            if any(start < t_end and end > t_start for t_start, t_end in taken):
+                continue
+            parsed = _match_date(match)
+            if parsed:
+                taken.append((start, end))
+                dates.append(DatePhrase(start, end, *parsed))
+    return sorted(dates, key=lambda date: date.start)
+
+
+def _months_back(year, month, count):
+    periods = []
+    for _ in range(count):
+        periods.append((year, month))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return sorted(periods)
+
+
+def _months_between(start, end):
+    periods = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month) and len(periods) < 12:
+        periods.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
+
+
+def _phrase_evidence(text, dates):
+    """
+    Periods stated explicitly: "for the month ended 31 March 2025", ranges, statement dates
+    """
+    evidence = []
+    for i, date in enumerate(dates):
+        following = dates[i + 1] if i + 1 < len(dates) else None
+        if following and RANGE_CONNECTOR.match(text[date.end:following.start]) and \
+                (following.year, following.month) >= (date.year, date.month):
+            periods = _months_between(date, following)
+            # A range that is exactly one calendar month is a monthly statement
+            evidence.append((tuple(periods), 95 if len(periods) == 1 else 90, "date range"))
+            continue
+
+        prefix = text[max(date.start - 60, 0):date.start]
+        for label, pattern, months, confidence in PERIOD_PHRASES:
+            if pattern.search(prefix):
+                if months == 0:
+                    periods = ((date.year, None),)
+                else:
+                    periods = tuple(_months_back(date.year, date.month, months))
+                evidence.append((periods, confidence, label))
+                break
+    return evidence
+
+
+def _dominant_month(dates):
+    """
+    The month most dates fall in, e.g. the transaction dates of a bank statement
+    """
+    counts = Counter((date.year, date.month) for date in dates)
+    if not counts:
+        return None
+    (period, count), total = counts.most_common(1)[0], sum(counts.values())
+    share = count / total
+    if count >= 5 and share >= 0.8:
+        return (period,), DOMINANT_MONTH_CONFIDENCE
+    if count >= 3 and share >= 0.6:
+        return (period,), DOMINANT_MONTH_CONFIDENCE - 15
+    return None
+
+
+def detect_from_filename(filename):
+    """
+    Period encoded in a filename such as Statement_2025-03.pdf or Penyata_Mac_2025.pdf
+
+    Returns:
+        (year, month) or None
+    """
+    name = os.path.splitext(os.path.basename(filename or ""))[0].lower()
+    for pattern in FILENAME_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            parsed = _match_date(match)
+            if parsed:
+                return parsed[0], parsed[1]
+    return None
+
+
+def detect_document_types(text, filename=""):
+    """
+    Document type tags from keyword matches in the text and filename
+    """
+    haystack = f"{text}\n{(filename or '').lower().replace('_', ' ').replace('-', ' ')}"
+    return [doc_type for doc_type, keywords in DOCUMENT_TYPES if any(keyword in haystack for keyword in keywords)]
+
+
+def detect_period(markdown_content, filename):
+    """
+    Detect reporting periods and document type without the LLM
+
+    Returns:
+        Dict in the AIService.detect_document_period format plus "source" ("rules")
+        and "evidence"; "confidence" is 0 when nothing usable was found
+    """
+    text = (markdown_content or "")[:SCAN_CHARS].lower()
+    dates = find_dates(text)
+
+    candidates = _phrase_evidence(text, dates)
+    dominant = _dominant_month(dates)
+    if dominant:
+        candidates.append((dominant[0], dominant[1], "dominant month"))
+
+    periods, confidence, evidence = (), 0, []
+    if candidates:
+        candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+        periods, confidence, reason = candidates[0]
+        evidence.append(reason)
+        # Other explicit statements that disagree make the text ambiguous
+        if any(set(other[0]) != set(periods) and other[1] >= 85 for other in candidates[1:]):
+            confidence -= CONFLICT_PENALTY
+            evidence.append("conflicting periods in text")
+
+    from_filename = detect_from_filename(filename)
+    if from_filename:
+        evidence.append("filename")
+        if not periods:
+            periods, confidence = (from_filename,), FILENAME_CONFIDENCE
+            text_periods = {(date.year, date.month) for date in dates}
+            if text_periods - {from_filename}:
+                # e.g. INV-202511.pdf dated 5 March 2025: the number is not a period
+                confidence -= CONFLICT_PENALTY
+                evidence.append("filename disagrees with text")
+            elif text_periods:
+                confidence = FILENAME_CONFIRMED_CONFIDENCE
+                evidence.append("dates in text agree")
+        elif from_filename in periods or (from_filename[0], None) in periods:
+            confidence = min(confidence + AGREEMENT_BONUS, 98)
+        else:
+            confidence = min(confidence, FILENAME_CONFIDENCE) - CONFLICT_PENALTY
+            evidence.append("filename disagrees with text")
+
+    detected_tags = detect_document_types(text, filename)
+    confidence = max(confidence, 0)
+    return {
+        "periods": [
+            {"year": year, "month": month, "confidence": confidence}
+            for year, month in periods
+        ],
+        "confidence": confidence,
+        "detected_tags": detected_tags,
+        "source": "rules",
+        "evidence": evidence
+    }
@@ -0,0 +1,150 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from pathlib import Path
+import pdf2image
+from PIL import Image, ImageOps
+from config import Config
+from .ocr_service import OCRService
+from .retrieval_index import index_key
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tiff", ".tif", ".bmp"}
+THUMBNAIL_FILE = "thumbnail.jpg"
+
+
+def page_file(page):
+    return f"page-{page}.jpg"
+
+
+class PreviewService:
+    """
+    Low-resolution page images and thumbnails for the records page
+
+    The first Config.PREVIEW_PAGES pages are rendered once, when a document is
+    processed, straight to Config.PREVIEW_WIDTH by pdftoppm; later pages are
+    rendered on their first request. Images are cached by content hash, so
+    identical uploads share them, and the browser never has to pull the full
+    PDF to show what a document looks like.
+
+    Layout: <root>/<key>/thumbnail.jpg and page-<n>.jpg
+    """
+
+    def __init__(self, root=None):
+        self.root = root or Config.PREVIEW_PATH
+
+    def path(self, key):
+        return os.path.join(self.root, str(key))
+
+    @staticmethod
+    def supports(document):
+        """
+        Whether previews can be drawn for a document (PDFs and images)
+        """
+        extension = Path(document.file_path).suffix.lower()
+        return extension == ".pdf" or extension in IMAGE_EXTENSIONS
+
+    @staticmethod
+    def page_count(document):
+        if Path(document.file_path).suffix.lower() == ".pdf":
+            return OCRService.get_pdf_page_count(document.file_path)
+        return 1
+
+    @staticmethod
+    def _save(image, target, width):
+        # Written beside the target and swapped in, so a reader never gets half an image
+        image = image.convert("RGB")
+        if image.width > width:
+            image = image.resize((width, max(round(image.height * width / image.width), 1)), Image.LANCZOS)
+        staging = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            image.save(staging, "JPEG", quality=Config.PREVIEW_JPEG_QUALITY, optimize=True)
+            os.replace(staging, target)
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+
+    def _render(self, document, first_page, last_page):
+        directory = self.path(index_key(document))
+        os.makedirs(directory, exist_ok=True)
+
+        def save_page(page, image):
+            self._save(image, os.path.join(directory, page_file(page)), Config.PREVIEW_WIDTH)
+            if page == 1:
+                self._save(image, os.path.join(directory, THUMBNAIL_FILE), Config.THUMBNAIL_WIDTH)
+
+        if Path(document.file_path).suffix.lower() == ".pdf":
+            with tempfile.TemporaryDirectory() as temp_dir:
+                image_paths = pdf2image.convert_from_path(
+                    document.file_path,
+                    first_page=first_page,
+                    last_page=last_page,
+                    size=(Config.PREVIEW_WIDTH, None),
+                    fmt="jpeg",
+                    output_folder=temp_dir,
+                    paths_only=True
+                )
+                for page, image_path in enumerate(sorted(image_paths), first_page):
+                    with Image.open(image_path) as image:
+                        save_page(page, image)
+        elif first_page == 1:
+            with Image.open(document.file_path) as image:
+                save_page(1, ImageOps.exif_transpose(image))
+
+    def render_document(self, document):
+        """
+        Render a processed document's thumbnail and first pages
+
+        Failures are logged, not raised: previews are rendered again on their
+        first request.
+
+        Returns:
+            True if images were rendered
+        """
+        if not self.supports(document):
+            return False
+        if os.path.exists(os.path.join(self.path(index_key(document)), THUMBNAIL_FILE)):
+            return False
+        try:
+            last_page = min(max(Config.PREVIEW_PAGES, 1), self.page_count(document))
+            self._render(document, 1, last_page)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not render previews for document {document.id}: {str(e)}")
+            return False
+
+    def page(self, document, page):
+        """
+        Path of a page's preview image, rendering it if it is not cached
+
+        Returns:
+            File path, or None if the document has no such page or can't be previewed
+        """
+        target = os.path.join(self.path(index_key(document)), page_file(page))
+        if os.path.exists(target):
+            return target
+        if page < 1 or not self.supports(document) or page > self.page_count(document):
+            return None
+        self._render(document, page, page)
+        return target if os.path.exists(target) else None
+
+    def thumbnail(self, document):
+        """
+        Path of a document's thumbnail (its first page), rendering it if it is not cached
+
+        Returns:
+            File path, or None if the document can't be previewed
+        """
+        target = os.path.join(self.path(index_key(document)), THUMBNAIL_FILE)
+        if not os.path.exists(target) and self.supports(document):
+            self._render(document, 1, 1)
+        return target if os.path.exists(target) else None
+
+    def remove(self, key):
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+
+preview_service = PreviewService()
@@ -0,0 +1,260 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from config import Config
+from .text_vectorizer import HashingVectorizer
+
+logger = logging.getLogger(__name__)
+
+PAGE_HEADING = re.compile(r"^## Page (\d+)\s*$", re.MULTILINE)
+INDEX_KEY = re.compile(r"^[0-9a-zA-Z_-]{1,80}$")
+
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.json"
+META_FILE = "meta.json"
+
+
+def text_hash(markdown_content):
+    """
+    Fingerprint of the text an index was built from
+    """
+    return hashlib.sha1((markdown_content or "").encode("utf-8")).hexdigest()
+
+
+def index_key(document):
+    """
+    Index directory name for a document
+
+    Indexes are keyed by the content hash, so identical uploads (and the same
+    file attached in chat) share one index.
+    """
+    return document.content_hash or f"document-{document.id}"
+
+
+def _split_long(paragraph, size, overlap):
+    step = max(size - overlap, 1)
+    return [paragraph[start:start + size] for start in range(0, max(len(paragraph) - overlap, 1), step)]
+
+
+def chunk_text(markdown_content, chunk_chars=None, overlap_chars=None):
+    """
+    Split parsed text into retrieval chunks
+
+    Pages ("## Page N" headings) are never mixed in one chunk. Within a page,
+    paragraphs are packed up to chunk_chars, and the last paragraph of a
+    chunk is repeated at the start of the next one (up to overlap_chars) so
+    an answer straddling the boundary is not lost.
+
+    Returns:
+        List of dicts with "text" and "page" (None for unpaged text)
+    """
+    size = chunk_chars or Config.RETRIEVAL_CHUNK_CHARS
+    overlap = Config.RETRIEVAL_CHUNK_OVERLAP_CHARS if overlap_chars is None else overlap_chars
+
+    sections = []
+    headings = list(PAGE_HEADING.finditer(markdown_content or ""))
+    if not headings:
+        sections.append((None, markdown_content or ""))
+    else:
+        if headings[0].start() > 0:
+            sections.append((None, markdown_content[:headings[0].start()]))
+        for i, heading in enumerate(headings):
+            end = headings[i + 1].start() if i + 1 < len(headings) else len(markdown_content)
+            sections.append((int(heading.group(1)), markdown_content[heading.end():end]))
+
+    chunks = []
+    for page, section in sections:
+        paragraphs = []
+        for paragraph in re.split(r"\n\s*\n", section):
+            paragraph = paragraph.strip()
+            if paragraph:
+                paragraphs.extend(_split_long(paragraph, size, overlap) if len(paragraph) > size else [paragraph])
+
+        current = []
+        for paragraph in paragraphs:
+            if current and sum(len(p) + 2 for p in current) + len(paragraph) > size:
+                chunks.append({"text": "\n\n".join(current), "page": page})
+                carry = current[-1]
+                current = [carry] if len(carry) <= overlap and len(carry) + len(paragraph) <= size else []
+            current.append(paragraph)
+        if current:
+            chunks.append({"text": "\n\n".join(current), "page": page})
+    return chunks
+
+
+class RetrievalIndex:
+    """
+    Per-document chunk index for question answering
+
+    Each document's parsed text is split into chunks once, at processing
+    time, and every chunk is vectorized with the hashing vectorizer (no model,
+    no GPU). The matrix is saved as .npy and opened memory-mapped, so a
+    question costs one matrix-vector product over pages already in the OS
+    cache instead of re-parsing the file.
+
+    Layout: <root>/<key>/vectors.npy, chunks.json and meta.json
+    """
+
+    def __init__(self, root=None, n_features=None, max_open=None):
+        self.root = root or Config.RETRIEVAL_INDEX_PATH
+        self.vectorizer = HashingVectorizer(n_features=n_features or Config.RETRIEVAL_FEATURES)
+        self.max_open = max_open or Config.RETRIEVAL_MAX_OPEN_INDEXES
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        if not INDEX_KEY.match(str(key)):
+            raise ValueError(f"Invalid index key: {key}")
+        return os.path.join(self.root, str(key))
+
+    def meta(self, key):
+        """
+        Metadata of a built index, or None if there is none
+        """
+        try:
+            with open(os.path.join(self.path(key), META_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_current(self, key, markdown_content):
+        meta = self.meta(key)
+        return bool(meta) and meta.get("text_hash") == text_hash(markdown_content) \
+            and meta.get("n_features") == self.vectorizer.n_features
+
+    def build(self, key, markdown_content, source=None):
+        """
+        Chunk and vectorize a text and save its index
+
+        The index is written to a staging directory and swapped in, so a
+        reader never sees half an index.
+
+        Returns:
+            Number of chunks indexed
+        """
+        chunks = chunk_text(markdown_content)
+        vectors = self.vectorizer.transform([chunk["text"] for chunk in chunks])
+
+        final = self.path(key)
+        staging = f"{final}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        try:
+            np.save(os.path.join(staging, VECTORS_FILE), vectors)
+            with open(os.path.join(staging, CHUNKS_FILE), "w", encoding="utf-8") as f:
+                json.dump(chunks, f, ensure_ascii=False)
+            with open(os.path.join(staging, META_FILE), "w", encoding="utf-8") as f:
+                json.dump({
+                    "text_hash": text_hash(markdown_content),
+                    "n_features": self.vectorizer.n_features,
+                    "chunks": len(chunks),
+                    "source": source,
+                    "built_at": datetime.utcnow().isoformat()
+                }, f)
+
+            with self._lock:
+                self._open.pop(key, None)
+                shutil.rmtree(final, ignore_errors=True)
+                os.replace(staging, final)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        logger.info(f"Built retrieval index {key} with {len(chunks)} chunks")
+        return len(chunks)
+
+    def ensure(self, key, markdown_content, source=None):
+        """
+        Build the index unless one for exactly this text already exists
+
+        Returns:
+            True if the index was (re)built
+        """
+        if self.is_current(key, markdown_content):
+            return False
+        self.build(key, markdown_content, source)
+        return True
+
+    def index_document(self, document):
+        """
+        Build a processed document's index from its parsed text
+
+        Failures are logged, not raised: the document is still usable and the
+        index is rebuilt on its first search.
+
+        Returns:
+            True if the index was (re)built
+        """
+        parsed = document.parsed_content
+        if not parsed or not parsed.markdown_text:
+            return False
+        try:
+            return self.ensure(index_key(document), parsed.markdown_text, source=f"document {document.id}")
+        except Exception as e:
+            logger.warning(f"Could not build retrieval index for document {document.id}: {str(e)}")
+            return False
+
+    def remove(self, key):
+        with self._lock:
+            self._open.pop(key, None)
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+    def _load(self, key):
+        directory = self.path(key)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        mtime = os.stat(vectors_path).st_mtime_ns
+        with self._lock:
+            entry = self._open.get(key)
+            if entry and entry[0] == mtime:
+                self._open.move_to_end(key)
+                return entry[1], entry[2]
+
+        vectors = np.load(vectors_path, mmap_mode="r")
+        with open(os.path.join(directory, CHUNKS_FILE), encoding="utf-8") as f:
+            chunks = json.load(f)
+
+        with self._lock:
+            self._open[key] = (mtime, vectors, chunks)
+            self._open.move_to_end(key)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return vectors, chunks
+
+    def search(self, key, query, top_k=None):
+        """
+        Chunks of one index most similar to a question
+
+        Returns:
+            List of dicts with "chunk", "page", "score" and "text", best first;
+            empty if the index does not exist
+        """
+        top_k = top_k or Config.RETRIEVAL_TOP_K
+        try:
+            vectors, chunks = self._load(key)
+        except OSError:
+            return []
+        if not chunks:
+            return []
+
+        scores = np.asarray(vectors @ self.vectorizer.transform_one(query))
+        top_k = min(top_k, len(chunks))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [
+            {
+                "chunk": int(i),
+                "page": chunks[i]["page"],
+                "score": round(float(scores[i]), 4),
+                "text": chunks[i]["text"]
+            }
+            for i in best if scores[i] > 0
+        ]
+
+
+retrieval_index = RetrievalIndex()
@@ -0,0 +1,112 @@
+import re
+import logging
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+QUERY_TERM = re.compile(r'"([^"]+)"|(\S+)')
+OPERATORS = {"OR", "NOT", "AND"}
+
+SNIPPET_TOKENS = 16
+
+
+class InvalidSearchQuery(ValueError):
+    """
+    Raised when a search string cannot be turned into an FTS5 query
+    """
+
+
+def build_match_query(query):
+    """
+    Turn a user search string into an FTS5 MATCH expression
+
+    Every term is quoted, so punctuation such as "INV-2231" or "RM1,200"
+    matches as a phrase instead of being read as query syntax. "quoted
+    phrases", a trailing * for prefix search and the OR / NOT operators are
+    kept; all other terms must all match.
+    """
+    terms = []
+    for phrase, word in QUERY_TERM.findall(query or ""):
+        if word in OPERATORS and terms:
+            terms.append(word)
+            continue
+        value = phrase or word
+        prefix = not phrase and value.endswith("*")
+        value = value.rstrip("*").replace('"', "")
+        if value.strip():
+            terms.append(f'"{value}"' + ("*" if prefix else ""))
+    while terms and terms[-1] in OPERATORS:
+        terms.pop()
+    if not terms:
+        raise InvalidSearchQuery("Search query is empty")
+    return " ".join(terms)
+
+
+def search_documents(db, query, year=None, month=None, status=None, limit=20, offset=0):
+    """
+    Full-text search over parsed document text, best matches first
+
+    Args:
+        db: Database session
+        query: User search string (see build_match_query)
+        year: Only documents with a period tag in this year
+        month: Only documents with a period tag in this month (with year)
+        status: Only documents with this processing status
+        limit: Page size
+        offset: Rows to skip
+
+    Returns:
+        Tuple of (total matches, list of result dicts with id, filename,
+        status, upload_date, snippet and score)
+    """
+    filters = []
+    params = {"match": build_match_query(query), "limit": limit, "offset": offset}
+    if status:
+        filters.append("d.status = :status")
+        params["status"] = status
+    if year is not None:
+        # Resolved once through ix_document_tags_period, not per match
+        period = "tag = 'period' AND year = :year"
+        params["year"] = year
+        if month is not None:
+            period += " AND month = :month"
+            params["month"] = month
+        filters.append(f"d.id IN (SELECT document_id FROM document_tags WHERE {period})")
+    where = "".join(f" AND {condition}" for condition in filters)
+
+    base = f"""
+        FROM parsed_content_fts
+        JOIN parsed_content pc ON pc.id = parsed_content_fts.rowid
+        JOIN documents d ON d.current_parse_id = pc.id
+        WHERE parsed_content_fts MATCH :match{where}
+    """
+    try:
+        total = db.execute(text(f"SELECT count(*) {base}"), params).scalar()
+        rows = db.execute(text(f"""
+            SELECT d.id, d.filename, d.status, d.upload_date,
+                   snippet(parsed_content_fts, 0, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}) AS snippet,
+                   bm25(parsed_content_fts) AS rank
+            {base}
+            ORDER BY rank, d.id
+            LIMIT :limit OFFSET :offset
+        """), params).fetchall()
+    except OperationalError as e:
+        # Malformed MATCH expressions surface as operational errors
+        if "fts5" in str(e).lower() or "syntax" in str(e).lower():
+            raise InvalidSearchQuery(f"Invalid search query: {query}")
+        raise
+
+    results = [
+        {
+            "id": row.id,
+            "filename": row.filename,
+            "status": row.status,
+            "upload_date": row.upload_date,
+            "snippet": row.snippet,
+            # bm25() is lower for better matches
+            "score": round(-row.rank, 6)
+        }
+        for row in rows
+    ]
+    return total, results
@@ -0,0 +1,454 @@
+import os
+import re
+import json
+import shutil
+import logging
+from collections import Counter, deque
+from datetime import date, datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+# Share of non-empty values that must parse for a column to get that type
+TYPE_THRESHOLD = 0.95
+MAX_TRACKED_VALUES = 1000
+MAX_CELL_CHARS = 40
+
+ARROW_TYPES = {"number": pa.float64(), "date": pa.timestamp("ns"), "text": pa.string()}
+
+
+def table_dir(file_path):
+    """
+    Directory holding the columnar copy of a spreadsheet, next to the file itself
+    """
+    return os.path.splitext(file_path)[0] + ".tables"
+
+
+def to_number(series):
+    """
+    Parse a column of amounts such as "1,234.50", "RM 200" or "(75.00)"
+
+    Returns:
+        float64 Series, NaN where a value is not a number
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return pd.Series(float("nan"), index=series.index)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype("float64")
+    text = series.astype("string").str.strip()
+    negative = text.str.match(r"^\(.*\)$").fillna(False)
+    cleaned = text.str.replace(r"(?i)^rm|[,\s()]", "", regex=True)
+    numbers = pd.to_numeric(cleaned, errors="coerce").astype("float64")
+    return numbers.where(~negative, -numbers)
+
+
+# Text date layouts tried in order; day first as written in Malaysia
+DATE_FORMATS = [
+    "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m-%y",
+    "%d %b %Y", "%d-%b-%Y", "%d %B %Y", "%b %Y", "%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S",
+]
+
+
+def to_date(series, date_format=None):
+    """
+    Parse a column of dates
+
+    Args:
+        series: Raw column values (datetime objects or text)
+        date_format: strptime layout of text dates, from infer_date_format
+
+    Returns:
+        datetime64 Series, NaT where a value is not a date
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.astype("datetime64[ns]")
+    if date_format is None:
+        return pd.to_datetime(
+            series.map(lambda value: value if isinstance(value, (datetime, date)) else None),
+            errors="coerce"
+        ).astype("datetime64[ns]")
+    return pd.to_datetime(series.astype("string").str.strip(), format=date_format, errors="coerce").astype("datetime64[ns]")
+
+
+def infer_date_format(values):
+    """
+    The DATE_FORMATS layout that parses the values, or None if they are
+    datetime objects already (Excel cells)
+
+    Raises:
+        ValueError if the values are not dates
+    """
+    if values.map(lambda value: isinstance(value, (datetime, date))).mean() >= TYPE_THRESHOLD:
+        return None
+    sample = values.head(200)
+    for date_format in DATE_FORMATS:
+        if to_date(sample, date_format).notna().mean() >= TYPE_THRESHOLD:
+            return date_format
+    raise ValueError("Not a date column")
+
+
+def infer_kind(series):
+    """
+    Column type from its first chunk
+
+    Returns:
+        Tuple of ("number", "date" or "text", date format for text dates or None)
+    """
+    values = series.dropna()
+    if values.empty:
+        return "text", None
+    if to_number(values).notna().mean() >= TYPE_THRESHOLD:
+        return "number", None
+    try:
+        date_format = infer_date_format(values)
+        if to_date(values, date_format).notna().mean() >= TYPE_THRESHOLD:
+            return "date", date_format
+    except ValueError:
+        pass
+    return "text", None
+
+
+def _unique_headers(values):
+    headers = []
+    seen = Counter()
+    for i, value in enumerate(values):
+        name = str(value).strip() if value is not None and str(value).strip() else f"Unnamed: {i}"
+        seen[name] += 1
+        headers.append(name if seen[name] == 1 else f"{name}.{seen[name] - 1}")
+    return headers
+
+
+class ColumnSummary:
+    """
+    Running statistics for one column, updated chunk by chunk in constant memory
+    """
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.count = 0
+        self.empty = 0
+        self.invalid = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.values = Counter()
+        self.many_values = False
+
+    def update(self, raw, typed):
+        present = raw.notna()
+        valid = typed.notna()
+        self.count += int(valid.sum())
+        self.empty += int((~present).sum())
+        self.invalid += int((present & ~valid).sum())
+
+        values = typed[valid]
+        if values.empty:
+            return
+        if self.kind in ("number", "date"):
+            low, high = values.min(), values.max()
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+            if self.kind == "number":
+                self.total += float(values.sum())
+        elif not self.many_values:
+            self.values.update(values.value_counts().to_dict())
+            if len(self.values) > MAX_TRACKED_VALUES:
+                self.many_values = True
+                self.values.clear()
+
+    def to_dict(self):
+        summary = {"name": self.name, "type": self.kind, "count": self.count,
+                   "empty": self.empty, "invalid": self.invalid}
+        if self.kind == "number" and self.count:
+            summary.update({"sum": round(self.total, 2), "min": self.min, "max": self.max})
+        elif self.kind == "date" and self.count:
+            summary.update({"min": self.min.date().isoformat(), "max": self.max.date().isoformat()})
+        elif self.kind == "text":
+            summary["distinct"] = f">{MAX_TRACKED_VALUES}" if self.many_values else len(self.values)
+            summary["top"] = [value for value, _ in self.values.most_common(3)]
+        return summary
+
+    def describe(self):
+        summary = self.to_dict()
+        if self.kind == "number" and self.count:
+            detail = f"sum {summary['sum']:,.2f}, min {summary['min']:,.2f}, max {summary['max']:,.2f}"
+        elif self.kind == "date" and self.count:
+            detail = f"{summary['min']} to {summary['max']}"
+        elif self.kind == "text":
+            detail = f"{summary['distinct']} distinct"
+            if summary["top"]:
+                detail += "; most common: " + ", ".join(_cell(value) for value in summary["top"])
+        else:
+            detail = ""
+        return [self.name, self.kind, self.count, detail]
+
+
+def _cell(value):
+    text = str(value)
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS - 1] + "…"
+
+
+class SheetWriter:
+    """
+    Writes one sheet to Parquet chunk by chunk while keeping its summary,
+    first rows and last rows for the markdown preview
+    """
+
+    def __init__(self, path, name, preview_rows, tail_rows):
+        self.path = path
+        self.name = name
+        self.rows = 0
+        self.columns = None
+        self.kinds = None
+        self.date_formats = None
+        self.summaries = None
+        self.head = []
+        self.tail = deque(maxlen=tail_rows)
+        self.preview_rows = preview_rows
+        self._writer = None
+
+    def write(self, chunk):
+        if chunk.empty:
+            return
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            inferred = {column: infer_kind(chunk[column]) for column in self.columns}
+            self.kinds = {column: kind for column, (kind, _) in inferred.items()}
+            self.date_formats = {column: date_format for column, (_, date_format) in inferred.items()}
+            self.summaries = {column: ColumnSummary(column, self.kinds[column]) for column in self.columns}
+            schema = pa.schema([(column, ARROW_TYPES[self.kinds[column]]) for column in self.columns])
+            self._writer = pq.ParquetWriter(self.path, schema, compression="zstd")
+
+        typed = {}
+        for column in self.columns:
+            raw = chunk[column]
+            kind = self.kinds[column]
+            if kind == "number":
+                values = to_number(raw)
+            elif kind == "date":
+                values = to_date(raw, self.date_formats[column])
+            else:
+                values = raw.astype("string").str.strip().replace("", pd.NA)
+            self.summaries[column].update(raw, values)
+            typed[column] = values
+        frame = pd.DataFrame(typed)
+
+        self._writer.write_table(pa.Table.from_pandas(frame, schema=self._writer.schema, preserve_index=False))
+
+        if len(self.head) < self.preview_rows:
+            self.head.extend(chunk.head(self.preview_rows - len(self.head)).itertuples(index=False, name=None))
+        self.tail.extend(chunk.tail(self.tail.maxlen).itertuples(index=False, name=None))
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+
+    def info(self):
+        return {
+            "sheet": self.name,
+            "file": os.path.basename(self.path),
+            "rows": self.rows,
+            "columns": [self.summaries[column].to_dict() for column in self.columns or []]
+        }
+
+    def to_markdown(self, max_columns):
+        if not self.columns:
+            return "_Empty sheet_\n\n"
+
+        shown = self.columns[:max_columns]
+        parts = [f"Rows: {self.rows:,}. Columns: {len(self.columns)}."]
+        if len(shown) < len(self.columns):
+            parts[0] += f" Only the first {len(shown)} columns are shown."
+
+        summary = pd.DataFrame(
+            [self.summaries[column].describe() for column in shown],
+            columns=["Column", "Type", "Values", "Summary"]
+        )
+        parts.append("### Columns\n\n" + summary.to_markdown(index=False))
+
+        def rows_table(rows):
+            frame = pd.DataFrame([row[:len(shown)] for row in rows], columns=shown)
+            return frame.map(lambda value: "" if pd.isna(value) else _cell(value)).to_markdown(index=False)
+
+        parts.append(f"### First {len(self.head)} rows\n\n" + rows_table(self.head))
+        remaining = self.rows - len(self.head)
+        if remaining > 0:
+            tail = list(self.tail)[-remaining:]
+            skipped = remaining - len(tail)
+            if skipped:
+                parts.append(f"_{skipped:,} rows omitted; the full data is kept in the columnar store._")
+            parts.append(f"### Last {len(tail)} rows\n\n" + rows_table(tail))
+        return "\n\n".join(parts) + "\n\n"
+
+
+class SpreadsheetIngestor:
+    """
+    Streams Excel and CSV files into a Parquet side store
+
+    Rows are read in chunks of Config.SPREADSHEET_CHUNK_ROWS (openpyxl in
+    read-only mode for .xlsx, pandas chunks for CSV), column types are
+    inferred from the first chunk, and each chunk is written out before the
+    next is read. The text kept for the document is a bounded preview (column
+    summaries, first and last rows), so memory use and prompt size do not
+    grow with the size of the sheet.
+    """
+
+    def __init__(self, chunk_rows=None, preview_rows=None, tail_rows=None, max_columns=None):
+        self.chunk_rows = chunk_rows or Config.SPREADSHEET_CHUNK_ROWS
+        self.preview_rows = preview_rows or Config.SPREADSHEET_PREVIEW_ROWS
+        self.tail_rows = tail_rows or Config.SPREADSHEET_TAIL_ROWS
+        self.max_columns = max_columns or Config.SPREADSHEET_PREVIEW_COLUMNS
+
+    def ingest(self, file_path):
+        """
+        Convert a spreadsheet to a markdown preview and a Parquet side store
+
+        Returns:
+            Dict with "markdown", "rows" (total over all sheets) and "tables"
+            (per-sheet info as written to the store's manifest)
+        """
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension == ".csv":
+            title = "# CSV Content\n\n"
+            sheets = [(None, self._csv_chunks(file_path))]
+        else:
+            title = "# Excel Content\n\n"
+            sheets = self._excel_sheets(file_path)
+
+        target = table_dir(file_path)
+        staging = target + ".tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        markdown = [title]
+        tables = []
+        try:
+            for index, (sheet_name, chunks) in enumerate(sheets):
+                safe_name = re.sub(r"[^\w\-]+", "_", sheet_name or "data").strip("_") or "sheet"
+                writer = SheetWriter(
+                    os.path.join(staging, f"{index:02d}_{safe_name}.parquet"),
+                    sheet_name, self.preview_rows, self.tail_rows
+                )
+                try:
+                    for chunk in chunks:
+                        writer.write(chunk)
+                finally:
+                    writer.close()
+
+                if sheet_name is not None:
+                    markdown.append(f"## Sheet: {sheet_name}\n\n")
+                markdown.append(writer.to_markdown(self.max_columns))
+                tables.append(writer.info())
+
+            with open(os.path.join(staging, MANIFEST), "w") as f:
+                json.dump({"source": os.path.basename(file_path), "tables": tables}, f, default=str)
+
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(staging, target)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        finally:
+            if hasattr(sheets, "close"):
+                sheets.close()
+
+        return {
+            "markdown": "".join(markdown),
+            "rows": sum(table["rows"] for table in tables),
+            "tables": tables
+        }
+
+    def _csv_chunks(self, file_path):
+        reader = pd.read_csv(
+            file_path, dtype=str, chunksize=self.chunk_rows,
+            skip_blank_lines=True, encoding_errors="replace"
+        )
+        with reader:
+            for chunk in reader:
+                chunk.columns = _unique_headers(chunk.columns)
+                yield chunk
+
+    def _excel_sheets(self, file_path):
+        if file_path.lower().endswith(".xls"):
+            # Legacy .xls has no streaming reader, but is capped at 65,536 rows per sheet
+            xl = pd.ExcelFile(file_path)
+            return [(name, self._frame_chunks(xl.parse(name, dtype=object))) for name in xl.sheet_names]
+
+        return self._workbook_sheets(file_path)
+
+    def _workbook_sheets(self, file_path):
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                yield sheet.title, self._worksheet_chunks(sheet)
+        finally:
+            workbook.close()
+
+    def _frame_chunks(self, frame):
+        frame.columns = _unique_headers(frame.columns)
+        for start in range(0, len(frame), self.chunk_rows):
+            yield frame.iloc[start:start + self.chunk_rows]
+
+    def _worksheet_chunks(self, sheet):
+        rows = sheet.iter_rows(values_only=True)
+        # The first non-empty row is the header
+        header = None
+        for row in rows:
+            if any(value is not None and str(value).strip() for value in row):
+                header = list(row)
+                break
+        if header is None:
+            return
+        while header and header[-1] is None:
+            header.pop()
+        # A title row can be narrower than the table under it
+        width = max(len(header), sheet.max_column or 0)
+        columns = _unique_headers(header + [None] * (width - len(header)))
+
+        batch = []
+        for row in rows:
+            row = row[:width]
+            if all(value is None for value in row):
+                continue
+            batch.append(row + (None,) * (width - len(row)))
+            if len(batch) >= self.chunk_rows:
+                yield pd.DataFrame(batch, columns=columns, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, dtype=object)
+
+
+def load_manifest(file_path):
+    """
+    Per-sheet info of a spreadsheet's side store, or None if it has none
+    """
+    path = os.path.join(table_dir(file_path), MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_table(file_path, sheet=None, columns=None):
+    """
+    Load a sheet (the first one by default) from a spreadsheet's side store
+
+    Returns:
+        pandas DataFrame with the inferred column types
+    """
+    manifest = load_manifest(file_path)
+    if not manifest or not manifest["tables"]:
+        raise FileNotFoundError(f"No table store for {file_path}")
+    tables = manifest["tables"]
+    table = next((t for t in tables if t["sheet"] == sheet), None) if sheet is not None else tables[0]
+    if table is None:
+        raise KeyError(f"Sheet not found: {sheet}")
+    return pq.read_table(os.path.join(table_dir(file_path), table["file"]), columns=columns).to_pandas()
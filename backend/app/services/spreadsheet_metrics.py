@@ -0,0 +1,482 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+from config import Config
+from . import period_detector
+from .spreadsheet_ingest import SpreadsheetIngestor, load_manifest, read_table, to_number, to_date, infer_date_format
+
+logger = logging.getLogger(__name__)
+
+# Header and row-label synonyms (English and Malay), most specific roles first
+# so that "net cash flow" is a cash-flow column and not a cash-in column
+SYNONYMS = [
+    ("cash_flow", ["net cash flow", "cash flow", "net cash", "net change in cash", "net increase in cash",
+                   "net increase decrease in cash", "net decrease in cash", "aliran tunai bersih", "aliran tunai",
+                   "perubahan bersih tunai"]),
+    ("profit", ["net profit", "net profit loss", "profit loss", "net income", "net loss", "profit",
+                "profit after tax", "profit before tax", "untung bersih", "keuntungan bersih", "keuntungan",
+                "untung rugi", "untung", "pendapatan bersih"]),
+    ("revenue", ["total revenue", "revenue", "total sales", "sales", "turnover", "total income", "income",
+                 "gross revenue", "net sales", "hasil", "jumlah hasil", "jualan", "jumlah jualan", "pendapatan",
+                 "jumlah pendapatan"]),
+    ("expenses", ["total expenses", "expenses", "expense", "total expenditure", "expenditure", "total costs",
+                  "operating expenses", "total operating expenses", "costs", "perbelanjaan",
+                  "jumlah perbelanjaan", "belanja", "kos", "jumlah kos", "cost of sales", "cost of goods sold",
+                  "kos jualan"]),
+    ("cash_in", ["cash inflow", "cash inflows", "inflow", "money in", "deposit", "deposits", "credit", "credits",
+                 "cr", "kredit", "masuk", "wang masuk", "receipts", "penerimaan", "paid in"]),
+    ("cash_out", ["cash outflow", "cash outflows", "outflow", "money out", "withdrawal", "withdrawals", "debit",
+                  "debits", "dr", "keluar", "wang keluar", "payments", "pembayaran", "paid out"]),
+    ("amount", ["amount", "amaun", "transaction amount", "nilai", "value", "jumlah"]),
+    ("date", ["date", "tarikh", "transaction date", "txn date", "posting date", "value date", "tarikh transaksi"]),
+    ("month", ["month", "bulan", "period", "tempoh", "report month", "reporting period"]),
+    ("category", ["type", "category", "kategori", "jenis", "transaction type", "account", "akaun",
+                  "description", "keterangan", "butiran", "particulars"]),
+]
+
+# Expense lines of a summary table that has no total expenses column
+EXPENSE_KEYWORDS = ["payroll", "salary", "salaries", "gaji", "rent", "sewa", "utilities", "utiliti", "marketing",
+                    "advertising", "research", "logistics", "delivery", "miscellaneous", "office", "insurance",
+                    "insurans", "maintenance", "travel", "professional fees"]
+
+# Headers that mention a role but are ratios or forecasts, not amounts
+EXCLUDED_WORDS = {"growth", "margin", "ratio", "rate", "runway", "per", "forecast", "budget", "target", "mom", "yoy"}
+
+INFLOW_WORDS = {"income", "revenue", "sales", "credit", "cr", "deposit", "masuk", "jualan", "pendapatan", "receipt"}
+OUTFLOW_WORDS = {"expense", "expenses", "debit", "dr", "payment", "withdrawal", "keluar", "belanja", "perbelanjaan"}
+
+# Header words for periods longer than a month: "FY2024", "Q1 2025", "YTD", "Quarter ended ..."
+PERIOD_WORDS = {"fy", "ytd", "year", "years", "yearly", "annual", "quarter", "quarterly", "half", "tahun",
+                "tahunan", "suku"}
+
+# Value column headers that sum other columns
+TOTAL_WORDS = {"total", "totals", "jumlah", "sum", "cumulative", "kumulatif"}
+
+HEADER_SCAN_ROWS = 15
+
+
+def normalize_label(value):
+    """
+    Lowercase a header or row label and strip currency markers and punctuation
+    """
+    text = str(value).lower()
+    text = re.sub(r"\(\s*(?:rm|myr|%)\s*\)|\brm\b|\bmyr\b", " ", text)
+    text = re.sub(r"\.\d+$", " ", text)  # suffix added to duplicate headers
+    text = re.sub(r"[^a-z0-9%]+", " ", text)
+    return " ".join(text.split())
+
+
+def match_role(value):
+    """
+    Role of a header or row label
+
+    Returns:
+        Tuple of (role, score) where score is 1.0 for an exact synonym and 0.8
+        when a synonym is contained in the label, or (None, 0)
+    """
+    label = normalize_label(value)
+    if not label or "%" in label:
+        return None, 0
+    words = set(label.split())
+    if words & EXCLUDED_WORDS:
+        return None, 0
+    for role, synonyms in SYNONYMS:
+        if label in synonyms:
+            return role, 1.0
+    for role, synonyms in SYNONYMS:
+        for synonym in synonyms:
+            if len(synonym) > 3 and re.search(rf"\b{re.escape(synonym)}\b", label):
+                return role, 0.8
+    return None, 0
+
+
+def _map_columns(columns):
+    roles = {}
+    for column in columns:
+        role, score = match_role(column)
+        if role and (role not in roles or score > roles[role][1]):
+            roles[role] = (column, score)
+    return roles
+
+
+def _is_header(values):
+    """
+    A header names at least two roles, or at least two periods (one value column per month)
+    """
+    values = [value for value in values if pd.notna(value)]
+    if len(_map_columns(values)) >= 2:
+        return True
+    periods = [value for value in values
+               if normalize_label(value) in period_detector.MONTHS or period_detector.find_dates(str(value).lower())]
+    return len(periods) >= 2
+
+
+def _locate_header(frame):
+    """
+    Use the first rows as the header when the stored one is a title row
+
+    Returns:
+        DataFrame whose columns are the best-matching header row
+    """
+    if _is_header(frame.columns):
+        return frame
+    for i in range(min(HEADER_SCAN_ROWS, len(frame))):
+        row = frame.iloc[i]
+        if _is_header(row):
+            body = frame.iloc[i + 1:].copy()
+            body.columns = [str(value) if pd.notna(value) else f"Unnamed: {j}" for j, value in enumerate(row)]
+            return body
+    return frame
+
+
+def _row_periods(series):
+    """
+    (year, month) of each row from a date or month column
+
+    Returns:
+        Tuple of (years, months) integer arrays, 0 where a row has no date
+    """
+    dates = None
+    if pd.api.types.is_datetime64_any_dtype(series):
+        dates = series
+    else:
+        values = series.dropna()
+        try:
+            date_format = infer_date_format(values)
+            dates = to_date(series, date_format)
+            if dates.notna().sum() < 0.8 * len(values):
+                dates = None
+        except ValueError:
+            pass
+
+    if dates is not None:
+        return dates.dt.year.fillna(0).astype(int).to_numpy(), dates.dt.month.fillna(0).astype(int).to_numpy()
+
+    # Month labels such as "January 2025" or "Mac 2025"; each distinct label is parsed once
+    periods = {}
+    for value in series.dropna().unique():
+        found = period_detector.find_dates(str(value).lower())
+        periods[value] = (found[0].year, found[0].month) if found else (0, 0)
+    mapped = series.map(lambda value: periods.get(value, (0, 0)) if pd.notna(value) else (0, 0))
+    return np.array([p[0] for p in mapped], dtype=int), np.array([p[1] for p in mapped], dtype=int)
+
+
+def _header_period(column):
+    """
+    Period named by a value column's header
+
+    Returns:
+        (year, month) for a single month, with year None for a bare month
+        name; "other" for any longer or mixed period (a year, quarter, FY or
+        month range); None when the header names no period
+    """
+    label = normalize_label(column)
+    words = label.split()
+    if any(word in PERIOD_WORDS or re.fullmatch(r"fy\d{2,4}|q[1-4]|h[12]", word) for word in words):
+        return "other"
+    months = {period_detector.MONTHS[word] for word in words if word in period_detector.MONTHS}
+    if len(months) > 1:
+        return "other"
+    found = period_detector.find_dates(str(column).lower())
+    if found:
+        return found[0].year, found[0].month
+    if re.search(r"\b(?:19|20)\d{2}\b", label):
+        return "other"
+    if months:
+        return None, months.pop()
+    return None
+
+
+def _is_month(header_period, year, month):
+    return header_period in ((year, month), (None, month))
+
+
+def _undated_confidence(confidence, covered_months):
+    """
+    Confidence for figures tied to the month only by the document's period
+
+    When the document covers more than one month its figures are for the
+    whole span, so they are kept below the acceptance bar for the LLM to read.
+    """
+    if covered_months > 1:
+        return min(confidence, Config.SPREADSHEET_METRICS_MIN_CONFIDENCE - 10)
+    return confidence
+
+
+def _direction(category):
+    """
+    +1 for inflow, -1 for outflow and 0 for unknown, from a type/category value
+    """
+    words = set(normalize_label(category).split())
+    if words & INFLOW_WORDS:
+        return 1
+    if words & OUTFLOW_WORDS:
+        return -1
+    return 0
+
+
+def _columnar_metrics(frame, year, month, covered_months=1):
+    """
+    Tables with one row per transaction or per period: ledgers, bank
+    statement exports and monthly summaries
+
+    Args:
+        covered_months: Number of months the document is tagged with
+
+    Returns:
+        Result dict or None if the layout does not apply
+    """
+    roles = _map_columns(frame.columns)
+    amount_roles = {"revenue", "expenses", "profit", "cash_flow", "cash_in", "cash_out", "amount"}
+    if not amount_roles & set(roles):
+        return None
+
+    confidence = 60
+    undated = False
+    period_column = roles.get("date", roles.get("month", (None,)))[0]
+    if period_column is not None:
+        years, months = _row_periods(frame[period_column])
+        dated = (years > 0).sum()
+        if dated == 0:
+            return None
+        mask = (years == year) & (months == month)
+        if not mask.any():
+            return None
+        frame = frame[mask]
+        confidence += 20
+    else:
+        # Without dates the whole sheet is taken to be the document's period,
+        # unless its amount headers name another one
+        headers = [_header_period(roles[role][0]) for role in amount_roles & set(roles)]
+        if any(period is not None and not _is_month(period, year, month) for period in headers):
+            return None
+        undated = True
+        confidence += 5
+
+    def total(role):
+        return float(to_number(frame[roles[role][0]]).fillna(0).sum()) if role in roles else None
+
+    used = {}
+    revenue, expenses, profit, cash_flow = total("revenue"), total("expenses"), total("profit"), total("cash_flow")
+    cash_in, cash_out = total("cash_in"), total("cash_out")
+
+    if cash_in is None and cash_out is None and "amount" in roles:
+        amounts = to_number(frame[roles["amount"][0]]).fillna(0)
+        if "category" in roles:
+            direction = frame[roles["category"][0]].map(_direction).to_numpy()
+            signed = np.where(direction == 0, amounts, np.abs(amounts) * direction)
+        else:
+            signed = amounts.to_numpy()
+        cash_in = float(signed[signed > 0].sum())
+        cash_out = float(-signed[signed < 0].sum())
+        used["cash_in"] = used["cash_out"] = roles["amount"][0]
+
+    if cash_out is not None:
+        cash_out = abs(cash_out)
+
+    layout = "monthly summary" if {"revenue", "expenses", "profit"} & set(roles) else "ledger"
+    if revenue is None:
+        revenue = cash_in
+    if expenses is None:
+        if cash_out is not None and layout == "ledger":
+            expenses = cash_out
+        elif revenue is not None and profit is not None:
+            expenses = revenue - profit
+        else:
+            lines = [column for column in frame.columns
+                     if any(keyword in normalize_label(column).split() for keyword in EXPENSE_KEYWORDS)]
+            if lines:
+                expenses = float(sum(to_number(frame[column]).fillna(0).sum() for column in lines))
+                used["expenses"] = ", ".join(map(str, lines))
+    if profit is None and revenue is not None and expenses is not None:
+        profit = revenue - expenses
+    if cash_flow is None and cash_in is not None and cash_out is not None:
+        cash_flow = cash_in - cash_out
+
+    if revenue is not None:
+        confidence += 10
+    if expenses is not None:
+        confidence += 5
+    if cash_flow is None:
+        confidence -= 5
+    if revenue is None and expenses is None:
+        return None
+
+    if undated:
+        confidence = _undated_confidence(confidence, covered_months)
+
+    for role in ("revenue", "expenses", "profit", "cash_flow", "cash_in", "cash_out"):
+        if role in roles:
+            used.setdefault(role, roles[role][0])
+    return {
+        "revenue": revenue or 0.0,
+        "expenses": abs(expenses or 0.0),
+        "profit": profit or 0.0,
+        "cash_flow": cash_flow or 0.0,
+        "layout": layout,
+        "rows": len(frame),
+        "columns": used,
+        "confidence": min(confidence, 95)
+    }
+
+
+def _statement_metrics(frame, year, month, covered_months=1):
+    """
+    Statements with one labelled row per line item: profit and loss and
+    cash-flow statements, optionally with one value column per month
+
+    Args:
+        covered_months: Number of months the document is tagged with
+
+    Returns:
+        Result dict or None if the layout does not apply
+    """
+    label_column = None
+    matches = {}
+    for column in frame.columns[:3]:
+        found = {}
+        for position, value in enumerate(frame[column]):
+            if pd.isna(value):
+                continue
+            role, score = match_role(value)
+            if role in ("revenue", "expenses", "profit", "cash_flow"):
+                label = normalize_label(value)
+                # Totals beat the line items above them
+                score += 0.5 if label.startswith(("total", "jumlah", "net")) else 0
+                if role not in found or score > found[role][1]:
+                    found[role] = (position, score)
+        if len(found) > len(matches):
+            label_column, matches = column, found
+    if len(matches) < 2:
+        return None
+
+    # Value column: the one headed by the requested month. An undated column
+    # is only used when no column is headed by a period, since next to
+    # period columns it is a total or another period's figure
+    value_column = None
+    confidence = 55
+    periods = {column: _header_period(column) for column in frame.columns if column != label_column}
+    for column, period in periods.items():
+        if _is_month(period, year, month):
+            value_column = column
+            confidence += 15
+            break
+    if value_column is None:
+        if any(period is not None for period in periods.values()):
+            return None
+        numeric = [column for column in periods
+                   if not set(normalize_label(column).split()) & TOTAL_WORDS
+                   and to_number(frame[column]).notna().sum() >= len(matches)]
+        if not numeric:
+            return None
+        value_column = numeric[0]
+        confidence += 10 if len(numeric) == 1 else 0
+
+    values = to_number(frame[value_column]).to_numpy()
+
+    def line(role):
+        if role not in matches:
+            return None
+        value = values[matches[role][0]]
+        return None if np.isnan(value) else float(value)
+
+    revenue, expenses, profit, cash_flow = line("revenue"), line("expenses"), line("profit"), line("cash_flow")
+    if revenue is not None:
+        confidence += 15
+    if expenses is not None or profit is not None:
+        confidence += 10
+    # Net profit already accounts for every cost line, where the best expenses
+    # label may be just one of them (operating expenses beside cost of sales)
+    if revenue is not None and profit is not None:
+        expenses = revenue - profit
+    if profit is None and revenue is not None and expenses is not None:
+        profit = revenue - expenses
+    if periods[value_column] is None:
+        confidence = _undated_confidence(confidence, covered_months)
+
+    return {
+        "revenue": revenue or 0.0,
+        "expenses": abs(expenses or 0.0),
+        "profit": profit or 0.0,
+        "cash_flow": cash_flow or 0.0,
+        "layout": "cash flow statement" if cash_flow is not None and revenue is None else "income statement",
+        "rows": len(frame),
+        "columns": {"labels": label_column, "values": value_column},
+        "confidence": min(confidence, 95)
+    }
+
+
+def sheet_metrics(frame, year, month, covered_months=1):
+    """
+    Compute a month's figures from one sheet, trying each known layout
+
+    Args:
+        covered_months: Number of months the document is tagged with;
+            undated figures of a multi-month document stay below the
+            acceptance bar
+
+    Returns:
+        Best result dict (revenue, expenses, profit, cash_flow, layout,
+        columns, confidence) or None
+    """
+    frame = _locate_header(frame)
+    results = [result for result in (_columnar_metrics(frame, year, month, covered_months),
+                                     _statement_metrics(frame, year, month, covered_months))
+               if result]
+    return max(results, key=lambda result: result["confidence"]) if results else None
+
+
+def extract_month(file_path, year, month, covered_months=1):
+    """
+    Compute revenue, expenses, profit and cash flow for a month directly
+    from a spreadsheet's columnar side store
+
+    Args:
+        covered_months: Number of months the document is tagged with
+
+    Returns:
+        Dict in the AIService.extract_document_financials format plus
+        "confidence", "layout" and "source" ("spreadsheet"), or None if no
+        sheet has a recognisable layout
+    """
+    manifest = load_manifest(file_path)
+    if manifest is None:
+        SpreadsheetIngestor().ingest(file_path)
+        manifest = load_manifest(file_path)
+
+    best = None
+    for table in manifest["tables"]:
+        if not table["rows"]:
+            continue
+        result = sheet_metrics(read_table(file_path, table["sheet"]), year, month, covered_months)
+        if result and (best is None or result["confidence"] > best["confidence"]):
+            best = dict(result, sheet=table["sheet"])
+    if best is None:
+        return None
+
+    sources = ", ".join(f"{role} from '{column}'" for role, column in best["columns"].items())
+    sheet = f"sheet '{best['sheet']}'" if best["sheet"] else "the file"
+    best["notes"] = f"Computed from {sheet} ({best['layout']}, {best['rows']} rows): {sources}"
+    best["source"] = "spreadsheet"
+    for figure in ("revenue", "expenses", "profit", "cash_flow"):
+        best[figure] = round(best[figure], 2)
+    return best
+
+
+def is_spreadsheet(document):
+    return (document.original_format or "").lower() in ("xlsx", "xls", "csv")
+
+
+def document_months(document):
+    """
+    Number of months a document's period tags span; a year-only tag counts as twelve
+    """
+    periods = [tag for tag in document.tags if tag.tag == "period" and tag.year]
+    if any(tag.month is None for tag in periods):
+        return 12
+    return max(len({(tag.year, tag.month) for tag in periods}), 1)
+
+
+def confident(result):
+    return result is not None and result["confidence"] >= Config.SPREADSHEET_METRICS_MIN_CONFIDENCE
@@ -1,11 +1,25 @@
 import os
 import shutil
 import uuid
+import hashlib
+import tempfile
 from pathlib import Path
 import logging
+from sqlalchemy.dialects.sqlite import insert
+from starlette.concurrency import run_in_threadpool
+from config import Config
+from .file_validation import UploadValidator, check_pdf_pages
+from .spreadsheet_ingest import table_dir
+from ..models.document import StoredFile
 
 logger = logging.getLogger(__name__)
 
+
+def _write_chunk(buffer, digest, chunk):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
 class StorageService:
     """
     Service for handling document storage and retrieval
@@ -54,6 +68,213 @@ class StorageService:
             logger.error(f"Error saving file {original_filename}: {str(e)}", exc_info=True)
             raise
     
+    async def stream_upload(self, upload, custom_path=None):
+        """
+        Stream an uploaded file to a temporary file without blocking the event loop
+
+        Chunks are validated (type, size, page count) and hashed as they are
+        read from the form Starlette has spooled (the request body itself is
+        capped by the UploadSizeLimit middleware while it is received); disk
+        writes and hashing run in the thread pool. Invalid uploads are
+        rejected at the first offending chunk and the partial file is removed.
+        A PDF's page count is checked again once it is complete.
+
+        Args:
+            upload: FastAPI UploadFile
+            custom_path: Optional custom subdirectory for the temporary file
+
+        Returns:
+            Tuple of (temp_path, content_hash, size)
+
+        Raises:
+            UnsupportedFileError, FileTooLargeError
+        """
+        validator = UploadValidator(upload.filename)
+        save_path = self.storage_path
+        if custom_path:
+            save_path = os.path.join(save_path, custom_path)
+            os.makedirs(save_path, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=save_path, suffix=".part")
+        temp_path = os.path.join(save_path, os.path.basename(temp_path))
+        buffer = os.fdopen(fd, "wb")
+        try:
+            while True:
+                chunk = await upload.read(Config.UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                validator.feed(chunk)
+                await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+            validator.finish()
+            await run_in_threadpool(buffer.close)
+            if validator.file_type == "pdf":
+                validator.page_count = await run_in_threadpool(check_pdf_pages, temp_path, validator.max_pages)
+        except Exception:
+            buffer.close()
+            os.remove(temp_path)
+            raise
+
+        return temp_path, digest.hexdigest(), validator.size
+
+    async def save_upload(self, upload, custom_path=None):
+        """
+        Stream an uploaded file to storage with a unique name (async counterpart of save_file)
+
+        Returns:
+            Tuple of (file_path, unique_filename)
+        """
+        temp_path, _, _ = await self.stream_upload(upload, custom_path)
+        file_ext = os.path.splitext(upload.filename)[1]
+        unique_filename = f"{uuid.uuid4()}{file_ext}"
+        file_path = os.path.join(os.path.dirname(temp_path), unique_filename)
+        os.replace(temp_path, file_path)
+
+        logger.info(f"Saved file {upload.filename} to {file_path}")
+        return file_path, unique_filename
+
+    async def store_upload(self, db, upload):
+        """
+        Stream an upload to content-addressed storage and take a reference to it
+
+        Args:
+            db: Database session (the caller commits)
+            upload: FastAPI UploadFile
+
+        Returns:
+            The StoredFile row for the content, with its ref_count incremented
+        """
+        temp_path, content_hash, size = await self.stream_upload(upload)
+        file_path = self.move_content_addressed(temp_path, content_hash, upload.filename)
+        return self.register_file(db, file_path, content_hash, size)
+
+    def content_path(self, content_hash, original_filename):
+        """
+        Content-addressed path for a file: {storage}/{hash[:2]}/{hash}{ext}
+        """
+        file_ext = os.path.splitext(original_filename)[1].lower()
+        save_path = os.path.join(self.storage_path, content_hash[:2])
+        os.makedirs(save_path, exist_ok=True)
+        return os.path.join(save_path, f"{content_hash}{file_ext}")
+
+    def move_content_addressed(self, temp_path, content_hash, original_filename):
+        """
+        Move a fully written file to its content-addressed path
+
+        If that path already exists the bytes are already stored and the
+        temporary copy is discarded.
+
+        Returns:
+            Final file path
+        """
+        file_path = self.content_path(content_hash, original_filename)
+
+        if os.path.exists(file_path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, file_path)
+
+        logger.info(f"Saved file {original_filename} to {file_path}")
+        return file_path
+
+    def place_content_addressed(self, source_path, content_hash, original_filename):
+        """
+        Make a file available at its content-addressed path while keeping the source
+
+        The new path is a hard link (no data copied) where the filesystem
+        allows it, and a copy otherwise. The caller deletes the source once the
+        references to the new path are committed, or calls discard_placed if
+        they are not, so a failed attempt can simply be retried.
+
+        Returns:
+            Tuple of (file_path, created); created is False if the content was already stored
+        """
+        file_path = self.content_path(content_hash, original_filename)
+        if os.path.exists(file_path):
+            return file_path, False
+        try:
+            os.link(source_path, file_path)
+        except FileExistsError:
+            return file_path, False
+        except OSError:
+            staging = f"{file_path}.tmp-{uuid.uuid4().hex[:8]}"
+            shutil.copyfile(source_path, staging)
+            os.replace(staging, file_path)
+
+        logger.info(f"Saved file {original_filename} to {file_path}")
+        return file_path, True
+
+    def discard_placed(self, db, file_path, content_hash):
+        """
+        Remove a file placed by place_content_addressed whose references were rolled back
+
+        It is kept if a committed StoredFile (another upload of the same bytes) uses it.
+        """
+        stored = db.query(StoredFile).filter(StoredFile.content_hash == content_hash).first()
+        if (not stored or stored.file_path != file_path) and os.path.exists(file_path):
+            os.remove(file_path)
+
+    def register_file(self, db, file_path, content_hash, size):
+        """
+        Take a reference to a content-addressed file
+
+        Args:
+            db: Database session (the caller commits)
+            file_path: Path returned by move_content_addressed
+            content_hash: sha256 hex digest of the content
+            size: Size in bytes
+
+        Returns:
+            The StoredFile row for the content, with its ref_count incremented
+        """
+        # One statement, so concurrent uploads of the same bytes can't both insert
+        db.execute(
+            insert(StoredFile)
+            .values(content_hash=content_hash, file_path=file_path, size=size, ref_count=1)
+            .on_conflict_do_update(
+                index_elements=[StoredFile.content_hash],
+                set_={"ref_count": StoredFile.ref_count + 1}
+            )
+        )
+        stored = db.query(StoredFile).filter(StoredFile.content_hash == content_hash).populate_existing().one()
+
+        if stored.file_path != file_path and os.path.exists(file_path):
+            # The same bytes were stored earlier under another extension; keep that copy only
+            os.remove(file_path)
+            logger.info(f"Removed duplicate copy {file_path} of {stored.file_path}")
+        return stored
+
+    def release_file(self, db, document):
+        """
+        Drop a document's reference to its stored file
+
+        Args:
+            db: Database session (the caller commits)
+            document: Document being deleted
+
+        Returns:
+            Path of the file to remove once the transaction commits, or None if
+            other documents still reference it
+        """
+        if not document.content_hash:
+            # Uploaded before content addressing; the file belongs to this document alone
+            return document.file_path
+
+        stored = db.query(StoredFile).filter(StoredFile.content_hash == document.content_hash).first()
+        if not stored:
+            return document.file_path
+
+        db.query(StoredFile).filter(StoredFile.id == stored.id).update(
+            {StoredFile.ref_count: StoredFile.ref_count - 1},
+            synchronize_session=False
+        )
+        db.refresh(stored)
+        if stored.ref_count > 0:
+            return None
+
+        db.delete(stored)
+        return stored.file_path
+
     def delete_file(self, file_path):
         """
         Delete a file from storage
@@ -67,6 +288,8 @@ class StorageService:
         try:
             if os.path.exists(file_path):
                 os.remove(file_path)
+                # Columnar copy of a spreadsheet, if one was made
+                shutil.rmtree(table_dir(file_path), ignore_errors=True)
                 logger.info(f"Deleted file {file_path}")
                 return True
             else:
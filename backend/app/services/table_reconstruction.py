@@ -0,0 +1,310 @@
+import re
+import json
+import logging
+from statistics import median
+import pandas as pd
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+AMOUNT_PATTERN = re.compile(
+    r"^(?P<open>\()?(?P<lead>[-+])?\s*(?:RM|MYR)?\s*(?P<lead2>-)?"
+    r"(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+\.\d{2})"
+    r"(?P<close>\))?(?P<trail>-)?\s*(?P<marker>CR|DR)?\.?$",
+    re.IGNORECASE
+)
+MARKER_PATTERN = re.compile(r"^(?:CR|DR|-)\.?$", re.IGNORECASE)
+
+# Rows that carry totals or balances rather than transactions
+TOTAL_PATTERN = re.compile(
+    r"\b(?:total|subtotal|jumlah|balance\s+b/?f|balance\s+c/?f|b/?f|c/?f|opening\s+balance|closing\s+balance|"
+    r"baki\s+awal|baki\s+akhir|baki\s+dibawa|brought\s+forward|carried\s+forward)\b",
+    re.IGNORECASE
+)
+
+
+def parse_amount(text):
+    """
+    Parse an amount as printed on a statement or invoice
+
+    Handles "RM" prefixes, thousands separators, parenthesized and trailing
+    minus negatives, and CR/DR markers (DR is negative).
+
+    Returns:
+        float, or None if the text is not an amount
+    """
+    match = AMOUNT_PATTERN.match(str(text).strip())
+    if not match:
+        return None
+    value = float(match.group("number").replace(",", ""))
+    negative = (
+        (match.group("open") and match.group("close"))
+        or match.group("lead") == "-" or match.group("lead2") or match.group("trail")
+        or (match.group("marker") or "").upper() == "DR"
+    )
+    return -value if negative else value
+
+
+def parse_tsv(tsv):
+    """
+    Word boxes from tesseract TSV output (image_to_data / GetTSVText)
+
+    Returns:
+        List of word dicts (text, left, top, width, height, conf, block, par, line)
+    """
+    words = []
+    for line in (tsv or "").splitlines():
+        parts = line.split("\t")
+        if len(parts) < 12 or parts[0] != "5":
+            continue
+        text = parts[11].strip()
+        if not text:
+            continue
+        words.append({
+            "text": text,
+            "block": int(parts[2]), "par": int(parts[3]), "line": int(parts[4]),
+            "left": int(parts[6]), "top": int(parts[7]), "width": int(parts[8]), "height": int(parts[9]),
+            "conf": float(parts[10])
+        })
+    return words
+
+
+def words_from_data(data):
+    """
+    Word boxes from pytesseract.image_to_data(..., output_type=Output.DICT)
+    """
+    words = []
+    for i, text in enumerate(data["text"]):
+        text = (text or "").strip()
+        if data["level"][i] != 5 or not text:
+            continue
+        words.append({
+            "text": text,
+            "block": data["block_num"][i], "par": data["par_num"][i], "line": data["line_num"][i],
+            "left": data["left"][i], "top": data["top"][i], "width": data["width"][i], "height": data["height"][i],
+            "conf": float(data["conf"][i])
+        })
+    return words
+
+
+def words_to_text(words):
+    """
+    Plain text from word boxes in tesseract's reading order, laid out like image_to_string
+    """
+    lines = []
+    current = None
+    for word in words:
+        key = (word["block"], word["par"], word["line"])
+        if current is None or key != current:
+            if current is not None and key[:2] != current[:2]:
+                lines.append("")
+            lines.append(word["text"])
+            current = key
+        else:
+            lines[-1] += " " + word["text"]
+    return "\n".join(lines)
+
+
+def words_from_layout(text):
+    """
+    Word boxes from `pdftotext -layout` text, in character cells
+
+    The layout output keeps column alignment with spaces, so each word's
+    character offset serves as its x position and the line number as its y.
+    """
+    words = []
+    for line_number, line in enumerate(text.splitlines()):
+        for match in re.finditer(r"\S+", line):
+            words.append({
+                "text": match.group(), "left": match.start(), "top": line_number,
+                "width": match.end() - match.start(), "height": 1, "conf": 100.0
+            })
+    return words
+
+
+def _group_lines(words, tolerance):
+    lines = []
+    for word in sorted(words, key=lambda w: w["top"] + w["height"] / 2):
+        center = word["top"] + word["height"] / 2
+        if lines and abs(center - lines[-1]["center"]) <= tolerance:
+            line = lines[-1]
+            line["words"].append(word)
+            line["center"] = sum(w["top"] + w["height"] / 2 for w in line["words"]) / len(line["words"])
+        else:
+            lines.append({"center": center, "words": [word]})
+    return lines
+
+
+def _split_cells(line_words, gap):
+    cells = []
+    for word in sorted(line_words, key=lambda w: w["left"]):
+        right = word["left"] + word["width"]
+        if cells and word["left"] - cells[-1]["right"] <= gap:
+            cell = cells[-1]
+            cell["text"] += " " + word["text"]
+            cell["right"] = right
+        else:
+            cells.append({"text": word["text"], "left": word["left"], "right": right})
+
+    # "1,234.00 CR" split across cells: keep the marker with its amount
+    merged = []
+    for cell in cells:
+        if merged and MARKER_PATTERN.match(cell["text"]) and merged[-1]["amount"] is not None:
+            merged[-1]["text"] += " " + cell["text"]
+            merged[-1]["right"] = cell["right"]
+            merged[-1]["amount"] = parse_amount(merged[-1]["text"])
+            continue
+        cell["amount"] = parse_amount(cell["text"])
+        merged.append(cell)
+    return merged
+
+
+def _cluster(values, tolerance):
+    """
+    1-D clusters of positions; returns the mean position of each cluster
+    """
+    clusters = []
+    for value in sorted(values):
+        if clusters and value - clusters[-1][-1] <= tolerance:
+            clusters[-1].append(value)
+        else:
+            clusters.append([value])
+    return [sum(cluster) / len(cluster) for cluster in clusters]
+
+
+def _nearest(anchors, position):
+    return min(range(len(anchors)), key=lambda i: abs(anchors[i] - position))
+
+
+def reconstruct_tables(words, page=None):
+    """
+    Rebuild the table on a page from word boxes
+
+    Words are grouped into lines by their vertical centres and into cells by
+    horizontal gaps. Lines holding at least one amount are table rows; amount
+    cells are aligned into columns by their right edges (figures are right
+    aligned) and text cells by their left edges. The line of labels just
+    above the first row, if any, names the columns.
+
+    Args:
+        words: Word dicts with text, left, top, width and height
+        page: Page number recorded with the table
+
+    Returns:
+        List with at most one table dict: page, columns, rows (transactions,
+        amount columns as numbers) and totals (total/balance rows)
+    """
+    if not words:
+        return []
+    height = median(word["height"] for word in words) or 1
+    tolerance = max(1.5 * height, 2)
+
+    lines = [_split_cells(line["words"], gap=height) for line in _group_lines(words, 0.5 * height)]
+    row_indexes = [i for i, cells in enumerate(lines) if len(cells) >= 2 and any(c["amount"] is not None for c in cells)]
+    if len(row_indexes) < 2:
+        return []
+
+    table_cells = [cell for i in row_indexes for cell in lines[i]]
+    amount_anchors = _cluster([c["right"] for c in table_cells if c["amount"] is not None], tolerance)
+    text_anchors = _cluster([c["left"] for c in table_cells if c["amount"] is None], tolerance)
+
+    # Column order by position; each column remembers which edge it is aligned on
+    columns = sorted(
+        [("amount", anchor) for anchor in amount_anchors] + [("text", anchor) for anchor in text_anchors],
+        key=lambda column: column[1]
+    )
+    amount_columns = [i for i, column in enumerate(columns) if column[0] == "amount"]
+    text_columns = [i for i, column in enumerate(columns) if column[0] == "text"]
+
+    def place(cells):
+        row = [None] * len(columns)
+        for cell in cells:
+            if cell["amount"] is not None:
+                index = amount_columns[_nearest(amount_anchors, cell["right"])]
+                value = cell["amount"]
+            elif text_columns:
+                index = text_columns[_nearest(text_anchors, cell["left"])]
+                value = cell["text"]
+            else:
+                continue
+            if row[index] is None:
+                row[index] = value
+            elif isinstance(row[index], str) and isinstance(value, str):
+                row[index] += " " + value
+        return row
+
+    # Header: the closest line of plain labels above the first row
+    names = [None] * len(columns)
+    first = row_indexes[0]
+    for i in range(first - 1, max(first - 4, -1), -1):
+        cells = lines[i]
+        if len(cells) >= 2 and all(c["amount"] is None for c in cells):
+            for cell in cells:
+                # Compare like with like: left edges for text columns, right edges for amounts
+                index = min(range(len(columns)), key=lambda j: abs(
+                    columns[j][1] - (cell["right"] if columns[j][0] == "amount" else cell["left"])
+                ))
+                names[index] = f"{names[index]} {cell['text']}" if names[index] else cell["text"]
+            break
+    names = [name or f"Column {i + 1}" for i, name in enumerate(names)]
+
+    rows, totals = [], []
+    for i in row_indexes:
+        row = place(lines[i])
+        label = " ".join(str(value) for value in row if isinstance(value, str))
+        (totals if TOTAL_PATTERN.search(label) else rows).append(row)
+
+    return [{"page": page, "columns": names, "rows": rows, "totals": totals}]
+
+
+def tables_to_frame(tables):
+    """
+    Combine reconstructed tables into one DataFrame
+
+    Tables with the same columns (a statement continuing over several pages)
+    are concatenated; the largest such group is returned.
+
+    Returns:
+        DataFrame of transaction rows, or None
+    """
+    groups = {}
+    for table in tables or []:
+        groups.setdefault(tuple(table["columns"]), []).extend(table["rows"])
+    if not groups:
+        return None
+    columns, rows = max(groups.items(), key=lambda item: len(item[1]))
+    if not rows:
+        return None
+    return pd.DataFrame(rows, columns=list(columns))
+
+
+def load_tables(parsed_content):
+    """
+    Reconstructed tables stored on a ParsedContent
+    """
+    if not parsed_content or not parsed_content.table_rows:
+        return []
+    return json.loads(parsed_content.table_rows)
+
+
+def tables_to_markdown(tables, max_rows=None):
+    """
+    Compact markdown of reconstructed tables for LLM prompts
+
+    Totals and balance rows are always included; transaction rows are cut
+    to max_rows (Config.TABLE_PROMPT_MAX_ROWS) in total.
+    """
+    max_rows = Config.TABLE_PROMPT_MAX_ROWS if max_rows is None else max_rows
+    parts = []
+    remaining = max_rows
+    for table in tables:
+        rows = table["rows"][:max(remaining, 0)]
+        remaining -= len(rows)
+        if not rows and not table["totals"]:
+            continue
+        frame = pd.DataFrame(rows + table["totals"], columns=table["columns"]).fillna("")
+        parts.append(f"Page {table['page']}:\n\n{frame.to_markdown(index=False)}")
+        omitted = len(table["rows"]) - len(rows)
+        if omitted:
+            parts.append(f"_{omitted} more rows on page {table['page']} omitted_")
+    return "\n\n".join(parts)
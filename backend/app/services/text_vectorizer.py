@@ -0,0 +1,77 @@
+import re
+import unicodedata
+import zlib
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+")
+
+
+class HashingVectorizer:
+    """
+    CPU-only text vectorizer using the hashing trick
+
+    Word unigrams, word bigrams and character trigrams are hashed into a fixed
+    number of dimensions, so no vocabulary has to be fitted or stored. crc32 is
+    used instead of hash() to keep vectors stable across processes and restarts.
+    """
+
+    def __init__(self, n_features=4096, char_ngram=3):
+        self.n_features = n_features
+        self.char_ngram = char_ngram
+
+    @staticmethod
+    def tokenize(text):
+        """
+        Lowercase, strip accents and split text into word tokens
+        """
+        text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+        return TOKEN_PATTERN.findall(text.lower())
+
+    def _features(self, tokens):
+        features = list(tokens)
+        features.extend(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        n = self.char_ngram
+        for token in tokens:
+            padded = f"<{token}>"
+            features.extend(f"#{padded[i:i + n]}" for i in range(max(len(padded) - n + 1, 1)))
+        return features
+
+    def transform_one(self, text):
+        """
+        Vectorize a single text
+
+        Returns:
+            L2-normalized float32 vector of length n_features
+        """
+        vector = np.zeros(self.n_features, dtype=np.float32)
+        features = self._features(self.tokenize(text))
+        if not features:
+            return vector
+
+        indices = np.fromiter(
+            (zlib.crc32(f.encode("utf-8")) % self.n_features for f in features),
+            dtype=np.int64,
+            count=len(features)
+        )
+        np.add.at(vector, indices, 1.0)
+
+        # Sublinear tf so long documents aren't dominated by repeated terms
+        nonzero = vector > 0
+        vector[nonzero] = 1.0 + np.log(vector[nonzero])
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def transform(self, texts):
+        """
+        Vectorize several texts
+
+        Returns:
+            float32 matrix of shape (len(texts), n_features)
+        """
+        matrix = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for i, text in enumerate(texts):
+            matrix[i] = self.transform_one(text)
+        return matrix
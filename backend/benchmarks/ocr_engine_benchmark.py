@@ -0,0 +1,84 @@
+"""
+Compare OCR throughput of the pytesseract and tesserocr engines
+
+Pages are rendered once up front, so only recognition time is measured.
+
+Usage (from the backend directory):
+    python benchmarks/ocr_engine_benchmark.py [pdf ...] [--pages 10] [--dpi 200] [--repeat 3]
+
+Defaults to the sample documents in asset/docs.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import pdf2image
+from app.services.ocr_service import PytesseractEngine, TesserocrEngine
+from config import Config
+
+DEFAULT_DOCS = os.path.join(BACKEND_DIR, "..", "asset", "docs", "*.pdf")
+
+
+def load_pages(paths, max_pages, dpi):
+    pages = []
+    for path in paths:
+        for image in pdf2image.convert_from_path(path, dpi=dpi, grayscale=True):
+            pages.append(image)
+            if len(pages) >= max_pages:
+                return pages
+    return pages
+
+
+def run_engine(engine, pages, repeat):
+    # Warm-up call so tesserocr's one-off language data load isn't counted per page
+    engine.image_to_string(pages[0])
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            engine.image_to_string(page)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDF files to OCR")
+    parser.add_argument("--pages", type=int, default=10, help="maximum number of pages to OCR")
+    parser.add_argument("--dpi", type=int, default=Config.OCR_DPI, help="render resolution")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per engine (best is reported)")
+    parser.add_argument("--lang", default=Config.OCR_LANG, help="tesseract language(s)")
+    args = parser.parse_args()
+
+    paths = args.pdfs or sorted(glob.glob(DEFAULT_DOCS))
+    if not paths:
+        parser.error("no PDF files found")
+
+    pages = load_pages(paths, args.pages, args.dpi)
+    print(f"Benchmarking {len(pages)} pages at {args.dpi} dpi, best of {args.repeat} runs\n")
+
+    engines = [PytesseractEngine(args.lang)]
+    try:
+        engines.append(TesserocrEngine(args.lang))
+    except Exception as e:
+        print(f"tesserocr not available ({e}); only pytesseract will be measured\n")
+
+    results = {}
+    for engine in engines:
+        elapsed = run_engine(engine, pages, args.repeat)
+        results[engine.name] = elapsed
+        print(f"{engine.name:<12} {len(pages) / elapsed:8.2f} pages/s   {elapsed * 1000 / len(pages):8.1f} ms/page")
+
+    if len(results) == 2:
+        print(f"\ntesserocr speed-up: {results['pytesseract'] / results['tesserocr']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,4 +14,96 @@ class Config:
     LLM_MODEL_SERVER = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1" 
     DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY","") 
     
-         
\ No newline at end of file
+    # agent tool-result cache (read-only MCP tools, per conversation)
+    TOOL_CACHE_TTL_SECONDS = int(os.getenv("TOOL_CACHE_TTL_SECONDS", "900"))
+    TOOL_CACHE_MAX_CONVERSATIONS = int(os.getenv("TOOL_CACHE_MAX_CONVERSATIONS", "256"))
+    TOOL_CACHE_MAX_ENTRIES_PER_CONVERSATION = int(os.getenv("TOOL_CACHE_MAX_ENTRIES_PER_CONVERSATION", "64"))
+
+    # semantic answer cache for general ChatAgent questions
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.9"))
+    ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+    # document-processing job queue
+    JOB_OCR_CONCURRENCY = int(os.getenv("JOB_OCR_CONCURRENCY", "2"))
+    JOB_LLM_CONCURRENCY = int(os.getenv("JOB_LLM_CONCURRENCY", "4"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+    JOB_RETRY_MAX_SECONDS = int(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+    JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "1000"))
+    JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+    JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+    JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "120"))  # running jobs without a heartbeat for this long are re-queued
+
+    # PDF OCR
+    OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+    OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "true").lower() == "true"
+    OCR_RENDER_THREADS = int(os.getenv("OCR_RENDER_THREADS", "1"))
+    OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))  # 0 = one per CPU core
+    OCR_PAGES_PER_TASK = int(os.getenv("OCR_PAGES_PER_TASK", "4"))
+    PDF_TEXT_LAYER_ENABLED = os.getenv("PDF_TEXT_LAYER_ENABLED", "true").lower() == "true"
+    PDF_TEXT_LAYER_MIN_CHARS = int(os.getenv("PDF_TEXT_LAYER_MIN_CHARS", "40"))
+    PDF_TEXT_LAYER_MIN_CHARS_WITH_IMAGE = int(os.getenv("PDF_TEXT_LAYER_MIN_CHARS_WITH_IMAGE", "400"))
+    PDF_TEXT_LAYER_TIMEOUT_SECONDS = int(os.getenv("PDF_TEXT_LAYER_TIMEOUT_SECONDS", "60"))
+    OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")  # auto, tesserocr, pytesseract
+    OCR_LANG = os.getenv("OCR_LANG", "eng+msa")
+    OCR_PSM = int(os.getenv("OCR_PSM", "3"))  # tesseract page segmentation mode (3 = fully automatic)
+    OCR_OEM = int(os.getenv("OCR_OEM", "1"))  # tesseract engine mode (1 = LSTM only)
+    OCR_PREPROCESS_STEPS = os.getenv("OCR_PREPROCESS_STEPS", "grayscale,normalize_dpi,crop_borders,deskew,threshold")
+    OCR_MIN_IMAGE_SIDE = int(os.getenv("OCR_MIN_IMAGE_SIDE", "1200"))
+    OCR_MAX_IMAGE_SIDE = int(os.getenv("OCR_MAX_IMAGE_SIDE", "3500"))
+    OCR_TABLES_ENABLED = os.getenv("OCR_TABLES_ENABLED", "true").lower() == "true"  # rebuild tables from word boxes
+    TABLE_PROMPT_MAX_ROWS = int(os.getenv("TABLE_PROMPT_MAX_ROWS", "200"))
+    TABLE_PROMPT_CONTEXT_CHARS = int(os.getenv("TABLE_PROMPT_CONTEXT_CHARS", "3000"))  # opening text sent with table rows
+    PERIOD_DETECTION_PAGES = int(os.getenv("PERIOD_DETECTION_PAGES", "2"))  # pages extracted before period detection
+    FULL_EXTRACTION_PRIORITY = int(os.getenv("FULL_EXTRACTION_PRIORITY", "10"))  # queued behind new uploads
+    PARSE_VERSIONS_KEPT = int(os.getenv("PARSE_VERSIONS_KEPT", "2"))  # parse results kept per document, current included
+
+    # Spreadsheets
+    SPREADSHEET_CHUNK_ROWS = int(os.getenv("SPREADSHEET_CHUNK_ROWS", "5000"))
+    SPREADSHEET_PREVIEW_ROWS = int(os.getenv("SPREADSHEET_PREVIEW_ROWS", "20"))  # first rows kept as text
+    SPREADSHEET_TAIL_ROWS = int(os.getenv("SPREADSHEET_TAIL_ROWS", "5"))  # last rows kept as text (totals)
+    SPREADSHEET_PREVIEW_COLUMNS = int(os.getenv("SPREADSHEET_PREVIEW_COLUMNS", "30"))
+    SPREADSHEET_METRICS_MIN_CONFIDENCE = int(os.getenv("SPREADSHEET_METRICS_MIN_CONFIDENCE", "80"))  # below this the LLM reads the sheet
+
+    # Uploads
+    MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+    MAX_UPLOAD_PAGES = int(os.getenv("MAX_UPLOAD_PAGES", "500"))
+    UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+    UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))  # unfinished resumable uploads
+    BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", "50"))
+    MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(500 * 1024 * 1024)))
+    PERIOD_BATCH_SIZE = int(os.getenv("PERIOD_BATCH_SIZE", "8"))  # documents per period-detection prompt
+    PERIOD_BATCH_SNIPPET_CHARS = int(os.getenv("PERIOD_BATCH_SNIPPET_CHARS", "3000"))
+    PERIOD_BATCH_WAIT_SECONDS = int(os.getenv("PERIOD_BATCH_WAIT_SECONDS", "5"))  # wait for the rest of a batch to be extracted
+    PERIOD_BATCH_MAX_WAIT_SECONDS = int(os.getenv("PERIOD_BATCH_MAX_WAIT_SECONDS", "1800"))  # then split into per-document jobs
+
+    # Rule-based period detection (the LLM is skipped above this confidence)
+    LOCAL_DETECTION_ENABLED = os.getenv("LOCAL_DETECTION_ENABLED", "true").lower() == "true"
+    LOCAL_DETECTION_MIN_CONFIDENCE = int(os.getenv("LOCAL_DETECTION_MIN_CONFIDENCE", "85"))
+
+    # Per-document financial extraction
+    FINANCIAL_EXTRACTION_MAX_CHARS = int(os.getenv("FINANCIAL_EXTRACTION_MAX_CHARS", "24000"))
+
+    # Document retrieval index (DocumentAgent)
+    RETRIEVAL_INDEX_PATH = os.getenv("RETRIEVAL_INDEX_PATH", "workspace/indexes")
+    RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "1200"))
+    RETRIEVAL_CHUNK_OVERLAP_CHARS = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP_CHARS", "300"))  # paragraph repeated across chunk boundaries
+    RETRIEVAL_FEATURES = int(os.getenv("RETRIEVAL_FEATURES", "4096"))  # hashing vectorizer dimensions
+    RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+    RETRIEVAL_MAX_OPEN_INDEXES = int(os.getenv("RETRIEVAL_MAX_OPEN_INDEXES", "32"))  # memory-mapped matrices kept open
+    RETRIEVAL_SEARCH_DOCUMENTS = int(os.getenv("RETRIEVAL_SEARCH_DOCUMENTS", "5"))  # documents shortlisted by full-text search
+
+    # Page previews and thumbnails (records page)
+    PREVIEW_PATH = os.getenv("PREVIEW_PATH", "workspace/previews")
+    PREVIEW_WIDTH = int(os.getenv("PREVIEW_WIDTH", "480"))  # pixels
+    THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "160"))
+    PREVIEW_PAGES = int(os.getenv("PREVIEW_PAGES", "3"))  # pages rendered at processing time; later ones on first request
+    PREVIEW_JPEG_QUALITY = int(os.getenv("PREVIEW_JPEG_QUALITY", "70"))
+    PREVIEW_MAX_AGE = int(os.getenv("PREVIEW_MAX_AGE", "86400"))  # seconds browsers may reuse a preview or download
+
+    # Near-duplicate detection
+    NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true"
+    NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))  # simhash bits
+    NEAR_DUPLICATE_MIN_TOKENS = int(os.getenv("NEAR_DUPLICATE_MIN_TOKENS", "50"))
@@ -1,14 +1,87 @@
-from fastapi import FastAPI 
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.v1 import chat, document, metrics, admin, dashboard, company, funding
-from app.models.document import init_db
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from config import Config
+from app.api.v1 import chat, document, uploads, metrics, admin, dashboard, company, funding
+from app.models.document import init_db, upgrade_db
 from app.core.database import engine
 from app.models.document import Base as DocumentBase
 from app.models.company import Base as CompanyBase, init_company_db
 from app.models.funding import Base as FundingBase
+from app.services.job_queue import job_queue
+
+# Allowance for multipart boundaries and form fields around the file itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimit:
+    """
+    Refuse request bodies larger than the upload limit
+
+    Bodies that announce a larger Content-Length are refused before they are
+    read. Chunked bodies (no Content-Length) are counted as the server hands
+    them over and cut off at the limit, before Starlette has spooled the
+    multipart form to disk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _response(limit):
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Upload exceeds the maximum size of {limit // (1024 * 1024)} MB"}
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        limit = Config.MAX_BATCH_UPLOAD_BYTES if scope["path"].endswith("/upload/batch") else Config.MAX_UPLOAD_BYTES
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit + UPLOAD_FORM_OVERHEAD:
+            return await self._response(limit)(scope, receive, send)
+
+        state = {"received": 0, "exceeded": False, "started": False}
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > limit + UPLOAD_FORM_OVERHEAD:
+                    state["exceeded"] = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # Form parsing may turn the error into its own response; send the 413 instead
+            if state["exceeded"]:
+                if message["type"] == "http.response.start" and not state["started"]:
+                    state["started"] = True
+                    await self._response(limit)(scope, receive, send)
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if not state["started"]:
+                await self._response(limit)(scope, receive, send)
+
 
 app = FastAPI() 
 
+# Declared before CORS so the rejection still carries CORS headers
+app.add_middleware(UploadSizeLimit)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -16,16 +89,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified", "Accept-Ranges", "Content-Range", "Content-Length", "Content-Disposition"],
 )
 
 # Initialize database
 DocumentBase.metadata.create_all(bind=engine)
 CompanyBase.metadata.create_all(bind=engine)
 FundingBase.metadata.create_all(bind=engine)
+upgrade_db(engine)
+
+# Start document-processing workers (interrupted jobs are resumed)
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    job_queue.stop()
 
 # Include all routers
 app.include_router(chat.router, prefix="/api/v1", tags=["chat"])
 app.include_router(document.router, prefix="/api/v1", tags=["document"])
+app.include_router(uploads.router, prefix="/api/v1", tags=["uploads"])
 app.include_router(metrics.router, prefix="/api/v1", tags=["metrics"])
 app.include_router(admin.router, prefix="/api/v1", tags=["admin"])
 app.include_router(dashboard.router, prefix="/api/v1/dashboard", tags=["dashboard"])
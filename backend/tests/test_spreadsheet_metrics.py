@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import spreadsheet_metrics
+
+
+def income_statement():
+    return pd.DataFrame({
+        "Item": ["Revenue", "Cost of sales", "Total expenses", "Net profit"],
+        "Jan 2025": [1000, 400, 300, 300],
+        "Feb 2025": [1100, 420, 320, 330],
+        "Total": [2100, 820, 620, 630],
+    })
+
+
+def test_month_column_is_used():
+    result = spreadsheet_metrics.sheet_metrics(income_statement(), 2025, 2)
+
+    assert result["columns"]["values"] == "Feb 2025"
+    assert result["revenue"] == 1100
+    assert spreadsheet_metrics.confident(result)
+
+
+def test_total_column_is_not_used_for_a_missing_month():
+    assert spreadsheet_metrics.sheet_metrics(income_statement(), 2025, 3) is None
+
+
+def test_expenses_reconcile_with_net_profit():
+    result = spreadsheet_metrics.sheet_metrics(income_statement(), 2025, 1)
+
+    assert result["revenue"] == 1000
+    assert result["profit"] == 300
+    assert result["expenses"] == 700
+
+
+def test_other_period_column_is_not_used():
+    frame = pd.DataFrame({"Item": ["Revenue", "Total expenses", "Net profit"], "FY2024": [100, 60, 40]})
+
+    assert spreadsheet_metrics.sheet_metrics(frame, 2025, 2) is None
+
+
+def test_undated_figures_of_a_multi_month_document_need_the_llm():
+    frame = pd.DataFrame({"Item": ["Revenue", "Total expenses", "Net profit"], "Amount (RM)": [100, 60, 40]})
+
+    assert spreadsheet_metrics.confident(spreadsheet_metrics.sheet_metrics(frame, 2025, 2, covered_months=1))
+    assert not spreadsheet_metrics.confident(spreadsheet_metrics.sheet_metrics(frame, 2025, 2, covered_months=3))
@@ -13,6 +13,7 @@ export const chatApi = {
     query: string;
     message_history: Message[];
     file?: string | null;
+    conversation_id?: string;
   }) => {
     try {
       const response = await api.post('/api/v1/chat', data);
@@ -28,6 +29,7 @@ export const chatApi = {
     query: string;
     message_history: Message[];
     file?: string | null;
+    conversation_id?: string;
   }, onChunk: (chunk: string) => void, onError: (error: any) => void, onTabSwitch: (tab: string, loanData?: { funding_purpose?: string; requested_amount?: string }) => void, onLoanData?: (data: { funding_purpose?: string; requested_amount?: string }) => void) => {
     try {
       const response = await fetch(`${api.defaults.baseURL}/api/v1/chat/stream`, {
@@ -164,6 +166,7 @@ export const chatApi = {
     query: string;
     message_history: Message[];
     file?: string | null;
+    conversation_id?: string;
   }, onChunk: (chunk: string) => void, onError: (error: any) => void, onTabSwitch: (tab: string, loanData?: { funding_purpose?: string; requested_amount?: string }) => void, onLoanData?: (data: { funding_purpose?: string; requested_amount?: string }) => void) => {
     try {
       const response = await fetch(`${api.defaults.baseURL}/api/v1/chat/stream`, {
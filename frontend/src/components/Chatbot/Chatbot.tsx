@@ -24,6 +24,9 @@ interface Message {
   imageData?: string;
 }
 
+// Identifies one chat session to the backend, which caches tool results per conversation
+const newConversationId = () => `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
 const pulseAnimation = keyframes`
   0% { transform: scale(1); }
   50% { transform: scale(1.1); }
@@ -46,6 +49,7 @@ export const Chatbot: React.FC<ChatbotProps> = ({ onClose, onLoanData, input })
   const [fileInfo, setFileInfo] = useState<{ name: string; type: string; data: string } | null>(null);
   const [isImageModalOpen, setIsImageModalOpen] = useState(false);
   const [selectedImage, setSelectedImage] = useState<string | null>(null);
+  const conversationId = useRef(newConversationId());
 
   // Effect for localStorage sync
   useEffect(() => {
@@ -80,6 +84,7 @@ export const Chatbot: React.FC<ChatbotProps> = ({ onClose, onLoanData, input })
           const messageData = {
             query: input,
             message_history: messages,
+            conversation_id: conversationId.current,
           };
 
           let accumulatedContent = '';
@@ -205,6 +210,7 @@ export const Chatbot: React.FC<ChatbotProps> = ({ onClose, onLoanData, input })
       const messageData = {
         query: inputValue,
         message_history: messages,
+        conversation_id: conversationId.current,
         ...(fileInfo && { file: fileInfo.data })
       };
 
@@ -371,6 +377,7 @@ export const Chatbot: React.FC<ChatbotProps> = ({ onClose, onLoanData, input })
       const messageData = {
         query: msg,
         message_history: messages,
+        conversation_id: conversationId.current,
       };
 
       let accumulatedContent = '';
@@ -612,6 +619,7 @@ export const Chatbot: React.FC<ChatbotProps> = ({ onClose, onLoanData, input })
   const handleClearChat = () => {
     setMessages([]);
     localStorage.removeItem('chatMessages');
+    conversationId.current = newConversationId();
     setInputValue('');
     setFile(null);
     setFileInfo(null);
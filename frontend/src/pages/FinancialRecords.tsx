@@ -20,12 +20,13 @@ import {
   Button,
   CircularProgress,
   Snackbar,
-  Alert
+  Alert,
+  Avatar
 } from '@mui/material';
 import Layout from '../components/Layout';
 import { BulkUploadSection } from '../components/FinancialRecords';
 import { PictureAsPdf, AttachMoney, ShowChart, Refresh } from '@mui/icons-material';
-import { metricsApi } from '../services';
+import { metricsApi, documentsApi } from '../services';
 
 const MONTHS = [
   'January', 'February', 'March', 'April', 'May', 'June',
@@ -283,10 +284,18 @@ const FinancialRecords: React.FC = () => {
                             {monthData.documents.map(doc => (
                               <Chip 
                                 key={doc.id}
-                                icon={<PictureAsPdf fontSize="small" />}
+                                avatar={
+                                  <Avatar
+                                    variant="rounded"
+                                    src={documentsApi.thumbnailUrl(doc.id)}
+                                    imgProps={{ loading: 'lazy' }}
+                                  >
+                                    <PictureAsPdf fontSize="small" />
+                                  </Avatar>
+                                }
                                 label={doc.filename}
                                 component="a"
-                                href={`/api/v1/documents/${doc.id}/download`} // Assuming you'll add a download endpoint
+                                href={documentsApi.downloadUrl(doc.id)}
                                 target="_blank"
                                 clickable
                                 variant="outlined"
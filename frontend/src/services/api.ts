@@ -27,6 +27,22 @@ export interface DocumentResponse {
   tags: DocumentTag[];
 }
 
+export interface DocumentListParams {
+  status?: string;
+  tag?: string;
+  value?: string;
+  year?: number;
+  month?: number;
+  cursor?: string;
+  limit?: number;
+}
+
+export interface DocumentListResponse {
+  items: DocumentResponse[];
+  next_cursor: string | null;
+  limit: number;
+}
+
 export interface MetricsResponse {
   year: number;
   month: number;
@@ -114,6 +130,23 @@ export const documentsApi = {
     return response.data;
   },
   
+  // List documents page by page (pass next_cursor back as cursor)
+  listDocuments: async (params: DocumentListParams = {}): Promise<DocumentListResponse> => {
+    const response = await api.get<DocumentListResponse>('/documents', { params });
+    return response.data;
+  },
+  
+  // URL of the original file (opens inline unless download is true)
+  downloadUrl: (id: string | number, download: boolean = false): string =>
+    `${API_BASE_URL}/documents/${id}/download${download ? '?download=true' : ''}`,
+  
+  // URL of a small image of the first page
+  thumbnailUrl: (id: string | number): string => `${API_BASE_URL}/documents/${id}/thumbnail`,
+  
+  // URL of a low-resolution image of one page
+  previewUrl: (id: string | number, page: number = 1): string =>
+    `${API_BASE_URL}/documents/${id}/preview/${page}`,
+  
   // Get document by ID
   getDocument: async (id: string | number): Promise<DocumentResponse> => {
     const response = await api.get<DocumentResponse>(`/documents/${id}`);